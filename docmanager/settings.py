@@ -36,6 +36,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'users.middleware.PermissionContextMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -98,6 +99,12 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Hash and sniff uploads while they stream in (see documents/uploadhandlers.py)
+FILE_UPLOAD_HANDLERS = [
+    'documents.uploadhandlers.HashingMemoryFileUploadHandler',
+    'documents.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -112,9 +119,68 @@ DEFAULT_FROM_EMAIL = 'noreply@docmanager.local'
 
 # Guardian settings for object-level permissions
 AUTHENTICATION_BACKENDS = (
-    'django.contrib.auth.backends.ModelBackend',  # Django default
+    'users.backends.ProfileModelBackend',  # Django ModelBackend loading profile and role with the user
     'guardian.backends.ObjectPermissionBackend',  # Guardian
 )
 
 DEFAULT_USER_ROLE = 'czytelnik' 
-DEFAULT_USER_ACTIVE = True
\ No newline at end of file
+DEFAULT_USER_ACTIVE = True
+# Full-text search backend (see documents/search.py)
+DOCUMENT_SEARCH_BACKEND = 'documents.search.SQLiteFTSBackend'
+
+# Background tasks (see documents/tasks.py) - text extraction etc.
+DOCUMENT_TASKS_SYNC = False
+DOCUMENT_TASK_WORKERS = 2
+
+# File downloads/previews (see documents/serving.py): 'direct', 'x-sendfile' or 'x-accel-redirect'
+DOCUMENT_SERVE_MODE = 'direct'
+DOCUMENT_ACCEL_REDIRECT_PREFIX = '/protected/'
+# Downscaled images shown in grid tiles and on the document page (see documents/renditions.py):
+# size name -> longest side in pixels, and 'webp' or 'jpeg'
+DOCUMENT_RENDITION_SIZES = {'miniatura': 320, 'srednia': 800, 'duza': 1600}
+DOCUMENT_RENDITION_FORMAT = 'webp'
+# HTML previews of docx/xlsx files (see documents/office_preview.py): pages of a document,
+# rows and columns of every sheet
+OFFICE_PREVIEW_MAX_PAGES = 10
+OFFICE_PREVIEW_MAX_ROWS = 200
+OFFICE_PREVIEW_MAX_COLUMNS = 30
+# ZIP exports of folders and selections (see documents/export.py): bytes read from a file at a time
+EXPORT_READ_BUFFER_SIZE = 1024 * 1024
+
+# Activity log writer (see documents/activity.py)
+ACTIVITY_LOG_SYNC = False
+ACTIVITY_LOG_QUEUE_SIZE = 10000
+ACTIVITY_LOG_BATCH_SIZE = 200
+ACTIVITY_LOG_FLUSH_INTERVAL = 1.0
+# Seconds before a failed write is retried, doubled up to the maximum while it keeps failing
+ACTIVITY_LOG_RETRY_DELAY = 1.0
+ACTIVITY_LOG_MAX_RETRY_DELAY = 60.0
+
+# Seconds between checks of the SystemSettings version stamp (see documents/settings_cache.py)
+SYSTEM_SETTINGS_CHECK_INTERVAL = 5
+
+# Seconds a user's role stays in the cache, and how often each process checks
+# the role version stamp for changes made by other processes (see users/roles.py)
+ROLE_CACHE_TIMEOUT = 300
+ROLE_VERSION_CHECK_INTERVAL = 5
+
+# Listing headers count rows up to this many and show "ponad N" above (see documents/pagination.py)
+PAGINATION_COUNT_LIMIT = 1000
+
+# Folders and documents handled per transaction when deleting a folder subtree, and seconds
+# without progress after which a job is resumed (its worker died, see documents/folder_deletion.py)
+FOLDER_DELETE_BATCH_SIZE = 200
+FOLDER_DELETE_STALE_AFTER = 600
+
+# Chunked uploads (see documents/chunked_uploads.py): largest accepted chunk and hours an unfinished upload is kept
+UPLOAD_MAX_CHUNK_SIZE = 16 * 1024 * 1024
+UPLOAD_SESSION_EXPIRY_HOURS = 24
+
+# Batch uploads (see documents/batch_upload.py): files per batch (ZIP members included) and threads storing them
+BATCH_UPLOAD_MAX_FILES = 500
+BATCH_UPLOAD_WORKERS = 4
+# Archives with more entries or a larger declared uncompressed size are skipped whole
+BATCH_UPLOAD_MAX_ARCHIVE_MEMBERS = 2000
+BATCH_UPLOAD_MAX_ARCHIVE_SIZE = 2 * 1024 * 1024 * 1024
+# Django refuses multipart requests with more files than this
+DATA_UPLOAD_MAX_NUMBER_FILES = BATCH_UPLOAD_MAX_FILES
@@ -0,0 +1,175 @@
+"""
+Denormalized access table for "everything I can see" listings.
+
+ObjectAccess holds one row per (user, document) and (user, folder) the user
+has any access to, with a bitmask of the guardian object permissions granted
+to the user directly or through groups, plus OWNER for the owner. Listings
+join it on the (uzytkownik, dokument) / (uzytkownik, folder) indexes instead
+of building guardian's get_objects_for_user content-type subqueries:
+
+    Document.objects.accessible_by(user)
+    Folder.objects.accessible_by(user, ObjectAccess.CHANGE)
+
+The mask only records grants. Roles (admins see everything, only editors may
+change what is shared with them) are still applied by users.permissions.
+
+Rows are kept in sync by documents.signals when guardian permissions are
+assigned or removed (assign_perm / remove_perm), when group membership
+changes and when an object is created or changes owner; deleting a user,
+document or folder cascades. Inside batch_sync() the signals only collect
+the touched objects, which are synced once when the block ends (used by the
+bulk grant/revoke API in users.permissions). Other bulk guardian operations
+(assign_perm with a queryset or a list of users) bypass signals - run the
+rebuild_access management command afterwards.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+
+from .models import Document, Folder, ObjectAccess
+
+PERMISSION_BITS = {
+    Document: {
+        'browse_document': ObjectAccess.BROWSE,
+        'change_document': ObjectAccess.CHANGE,
+        'delete_document': ObjectAccess.DELETE,
+        'share_document': ObjectAccess.SHARE,
+        'download_document': ObjectAccess.DOWNLOAD,
+        'comment_document': ObjectAccess.COMMENT,
+    },
+    Folder: {
+        'browse_folder': ObjectAccess.BROWSE,
+        'change_folder': ObjectAccess.CHANGE,
+        'delete_folder': ObjectAccess.DELETE,
+        'add_document_to_folder': ObjectAccess.ADD_DOCUMENT,
+        'add_subfolder_to_folder': ObjectAccess.ADD_SUBFOLDER,
+    },
+}
+
+TARGET_FIELDS = {Document: 'dokument', Folder: 'folder'}
+
+
+def tracked_model(content_type_id):
+    """Document or Folder for their content type id, None for other models."""
+    for model in PERMISSION_BITS:
+        if ContentType.objects.get_for_model(model).pk == content_type_id:
+            return model
+    return None
+
+
+def compute_masks(model, object_ids=None, user_ids=None):
+    """{(user_id, object_id): mask} computed from ownership and guardian rows."""
+    from guardian.utils import get_group_obj_perms_model, get_user_obj_perms_model
+
+    bits = PERMISSION_BITS[model]
+    ctype = ContentType.objects.get_for_model(model)
+    masks = defaultdict(int)
+
+    owners = model.objects.all()
+    if object_ids is not None:
+        owners = owners.filter(pk__in=object_ids)
+    if user_ids is not None:
+        owners = owners.filter(wlasciciel_id__in=user_ids)
+    for object_id, owner_id in owners.values_list('pk', 'wlasciciel_id'):
+        masks[(owner_id, object_id)] |= ObjectAccess.OWNER | ObjectAccess.BROWSE
+
+    user_filters = {'content_type': ctype, 'permission__codename__in': list(bits)}
+    group_filters = dict(user_filters, group__user__isnull=False)
+    if object_ids is not None:
+        user_filters['object_pk__in'] = group_filters['object_pk__in'] = [str(object_id) for object_id in object_ids]
+    if user_ids is not None:
+        user_filters['user_id__in'] = group_filters['group__user__in'] = user_ids
+
+    granted = defaultdict(int)
+    # One filter() call each, so the group membership join is shared with values_list()
+    for rows in (
+        get_user_obj_perms_model().objects.filter(**user_filters).values_list('user_id', 'object_pk', 'permission__codename'),
+        get_group_obj_perms_model().objects.filter(**group_filters).values_list('group__user', 'object_pk', 'permission__codename'),
+    ):
+        for user_id, object_pk, codename in rows:
+            if object_pk.isdigit():
+                granted[(user_id, int(object_pk))] |= bits[codename]
+
+    # Guardian rows are not removed with their objects - skip those of deleted objects
+    existing = set(model.objects.filter(pk__in={object_id for _, object_id in granted}).values_list('pk', flat=True))
+    for key, mask in granted.items():
+        if key[1] in existing:
+            masks[key] |= mask
+    return masks
+
+
+def sync_access(model, object_ids=None, user_ids=None, create=True):
+    """
+    Bring ObjectAccess rows of the given objects and/or users (all when None) in line with
+    ownership and guardian. create=False only updates and removes rows - used while
+    rows are being deleted, when access can only shrink.
+    """
+    field = TARGET_FIELDS[model]
+    masks = compute_masks(model, object_ids, user_ids)
+
+    rows = ObjectAccess.objects.filter(**{f'{field}__isnull': False})
+    if object_ids is not None:
+        rows = rows.filter(**{f'{field}_id__in': object_ids})
+    if user_ids is not None:
+        rows = rows.filter(uzytkownik_id__in=user_ids)
+
+    with transaction.atomic():
+        stale = []
+        changed = defaultdict(list) # new mask -> row ids, one UPDATE per distinct mask
+        for pk, user_id, object_id, mask in rows.values_list('pk', 'uzytkownik_id', f'{field}_id', 'uprawnienia'):
+            new_mask = masks.pop((user_id, object_id), 0)
+            if not new_mask:
+                stale.append(pk)
+            elif new_mask != mask:
+                changed[new_mask].append(pk)
+        for new_mask, pks in changed.items():
+            ObjectAccess.objects.filter(pk__in=pks).update(uprawnienia=new_mask)
+        if stale:
+            ObjectAccess.objects.filter(pk__in=stale).delete()
+        if create and masks:
+            ObjectAccess.objects.bulk_create([
+                ObjectAccess(uzytkownik_id=user_id, uprawnienia=mask, **{f'{field}_id': object_id})
+                for (user_id, object_id), mask in masks.items()
+            ])
+
+
+_batch = threading.local()
+
+
+@contextmanager
+def batch_sync():
+    """Defer syncs requested with request_sync() to the end of the block, one per object."""
+    if getattr(_batch, 'pending', None) is not None: # Nested - the outer block syncs
+        yield
+        return
+    _batch.pending = pending = defaultdict(set)
+    try:
+        yield
+    finally:
+        _batch.pending = None
+    for model, object_ids in pending.items():
+        sync_access(model, sorted(object_ids))
+
+
+def request_sync(model, object_ids, create=True):
+    """sync_access() now, or at the end of the enclosing batch_sync() block."""
+    pending = getattr(_batch, 'pending', None)
+    if pending is None:
+        sync_access(model, object_ids, create=create)
+    else:
+        pending[model].update(object_ids)
+
+
+def sync_user_access(user_ids, create=True):
+    """Recompute everything the users can access (e.g. after group membership changes)."""
+    for model in PERMISSION_BITS:
+        sync_access(model, user_ids=user_ids, create=create)
+
+
+def rebuild_access():
+    """Recompute the whole access table."""
+    for model in PERMISSION_BITS:
+        sync_access(model)
@@ -0,0 +1,276 @@
+"""
+Activity logging off the request path.
+
+log_activity() puts an (unsaved) ActivityLog on a bounded in-memory queue once
+the current transaction commits - work that is rolled back is never logged. A
+background thread writes queued entries with bulk_create in batches of up to
+ACTIVITY_LOG_BATCH_SIZE, at least every ACTIVITY_LOG_FLUSH_INTERVAL seconds.
+The timestamp is taken when the event happens, not when it is written.
+
+Audit records are not lost:
+- when the queue is full the entry is written synchronously (back-pressure),
+- a batch that cannot be written (on SQLite typically "database is locked"
+  while requests write) is kept and retried after ACTIVITY_LOG_RETRY_DELAY
+  seconds, doubling up to ACTIVITY_LOG_MAX_RETRY_DELAY while it keeps failing,
+- entries pointing at a document or folder deleted meanwhile are written
+  without it (SET_NULL, as if they had been written before the deletion);
+  entries of a deleted user are not written, the deletion cascades to them,
+- pending entries are flushed at interpreter exit; whatever still cannot be
+  written then is logged in full.
+
+Set ACTIVITY_LOG_SYNC = True to write every entry immediately (tests,
+management commands). get_metrics() returns counters of queued, flushed,
+synchronously written and deferred entries for this process.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ActivityLogWriter:
+    def __init__(self, max_size=10000, batch_size=200, flush_interval=1.0, retry_delay=1.0, max_retry_delay=60.0):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.metrics = {
+            'queued': 0, 'flushed': 0, 'written_sync': 0, 'batches': 0,
+            'deferred': 0, 'failed_attempts': 0, 'skipped_deleted_user': 0,
+        }
+        self._metrics_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._retry = [] # Entries of failed writes, retried from the background thread
+        self._retry_at = 0.0
+        self._next_delay = retry_delay
+
+    def _count(self, name, value=1):
+        with self._metrics_lock:
+            self.metrics[name] += value
+
+    def get_metrics(self):
+        with self._metrics_lock:
+            return dict(self.metrics, pending=self.queue.qsize(), pending_retry=len(self._retry))
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+                self._thread.start()
+
+    def put(self, entry):
+        self.start()
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            with self._flush_lock:
+                if self._write_or_defer([entry]):
+                    self._count('written_sync')
+            return
+        self._count('queued')
+
+    def _take_batch(self, timeout):
+        """Wait up to timeout for the first entry, then take whatever else is queued (up to batch_size)."""
+        batch = []
+        try:
+            first = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return batch, False
+        if first is _STOP:
+            return batch, True
+        batch.append(first)
+        while len(batch) < self.batch_size:
+            try:
+                entry = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is _STOP:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            timeout = self.flush_interval
+            if self._retry:
+                timeout = max(min(timeout, self._retry_at - time.monotonic()), 0.01)
+            batch, stop = self._take_batch(timeout)
+            if batch or (self._retry and time.monotonic() >= self._retry_at):
+                close_old_connections()
+                with self._flush_lock:
+                    if batch:
+                        self._count('flushed', self._write_or_defer(batch))
+                        self._count('batches')
+                    if self._retry and time.monotonic() >= self._retry_at:
+                        self.retry_deferred()
+        close_old_connections()
+
+    def _without_deleted_references(self, entries):
+        """Entries to write: users deleted meanwhile drop theirs, deleted documents/folders are cleared."""
+        from django.contrib.auth.models import User
+        from .models import Document, Folder
+
+        def existing(model, ids):
+            ids = {pk for pk in ids if pk is not None}
+            return set(model._base_manager.filter(pk__in=ids).values_list('pk', flat=True)) if ids else set()
+
+        users = existing(User, (entry.uzytkownik_id for entry in entries))
+        documents = existing(Document, (entry.dokument_id for entry in entries))
+        folders = existing(Folder, (entry.folder_id for entry in entries))
+        kept = []
+        for entry in entries:
+            if entry.uzytkownik_id not in users:
+                self._count('skipped_deleted_user')
+                continue
+            if entry.dokument_id is not None and entry.dokument_id not in documents:
+                entry.dokument_id = None
+            if entry.folder_id is not None and entry.folder_id not in folders:
+                entry.folder_id = None
+            kept.append(entry)
+        return kept
+
+    def _write(self, entries):
+        """Save entries in one transaction (all or nothing). Raises on failure."""
+        from .models import ActivityLog
+
+        entries = self._without_deleted_references(entries)
+        with transaction.atomic():
+            ActivityLog.objects.bulk_create(entries)
+        return len(entries)
+
+    def _write_or_defer(self, entries):
+        """Save entries, keeping them for a retry when that fails. Returns how many were written."""
+        try:
+            return self._write(entries)
+        except Exception:
+            self._count('failed_attempts')
+            self._count('deferred', len(entries))
+            logger.warning("Zapis %d wpisów dziennika nie powiódł się, ponowienie za %.1f s",
+                           len(entries), self._next_delay, exc_info=True)
+            if not self._retry:
+                self._retry_at = time.monotonic() + self._next_delay
+            self._retry.extend(entries)
+            return 0
+
+    def retry_deferred(self):
+        """Write entries of earlier failed attempts; back off further while it keeps failing."""
+        entries, self._retry = self._retry, []
+        failed = []
+        for start in range(0, len(entries), self.batch_size):
+            batch = entries[start:start + self.batch_size]
+            if failed: # Do not hammer a database that just failed
+                failed.extend(batch)
+                continue
+            try:
+                self._count('flushed', self._write(batch))
+                self._count('batches')
+            except Exception:
+                self._count('failed_attempts')
+                logger.warning("Ponowny zapis %d wpisów dziennika nie powiódł się", len(batch), exc_info=True)
+                failed.extend(batch)
+        if failed:
+            self._next_delay = min(self._next_delay * 2, self.max_retry_delay)
+            self._retry_at = time.monotonic() + self._next_delay
+            self._retry = failed + self._retry
+        else:
+            self._next_delay = self.retry_delay
+
+    def flush(self):
+        """Write everything queued so far (and earlier failed entries) from the calling thread."""
+        with self._flush_lock:
+            if self._retry:
+                self.retry_deferred()
+            batch = []
+            while True:
+                try:
+                    entry = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if entry is _STOP:
+                    continue
+                batch.append(entry)
+            for start in range(0, len(batch), self.batch_size):
+                self._count('flushed', self._write_or_defer(batch[start:start + self.batch_size]))
+                self._count('batches')
+
+    def shutdown(self, timeout=10):
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self.queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+        self.flush()
+        deadline = time.monotonic() + timeout
+        while self._retry and time.monotonic() + self._next_delay < deadline:
+            time.sleep(self._next_delay)
+            with self._flush_lock:
+                self.retry_deferred()
+        for entry in self._retry: # Nothing else can keep them once the process exits
+            logger.error("Niezapisany wpis dziennika aktywności: %s %s %s dokument=%s folder=%s ip=%s (%s)",
+                         entry.znacznik_czasu.isoformat(), entry.uzytkownik_id, entry.typ_aktywnosci,
+                         entry.dokument_id, entry.folder_id, entry.adres_ip, entry.szczegoly)
+        metrics = self.get_metrics()
+        if metrics['queued'] or metrics['written_sync']:
+            logger.info("Dziennik aktywności zamknięty: %s", metrics)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ActivityLogWriter(
+                max_size=getattr(settings, 'ACTIVITY_LOG_QUEUE_SIZE', 10000),
+                batch_size=getattr(settings, 'ACTIVITY_LOG_BATCH_SIZE', 200),
+                flush_interval=getattr(settings, 'ACTIVITY_LOG_FLUSH_INTERVAL', 1.0),
+                retry_delay=getattr(settings, 'ACTIVITY_LOG_RETRY_DELAY', 1.0),
+                max_retry_delay=getattr(settings, 'ACTIVITY_LOG_MAX_RETRY_DELAY', 60.0),
+            )
+            atexit.register(_writer.shutdown)
+        return _writer
+
+
+def log_activity(uzytkownik, typ_aktywnosci, dokument=None, folder=None, szczegoly='', adres_ip=None):
+    """Record an ActivityLog entry; written in the background unless ACTIVITY_LOG_SYNC is set."""
+    from .models import ActivityLog
+
+    entry = ActivityLog(
+        uzytkownik_id=getattr(uzytkownik, 'pk', uzytkownik),
+        typ_aktywnosci=typ_aktywnosci,
+        dokument_id=getattr(dokument, 'pk', dokument),
+        folder_id=getattr(folder, 'pk', folder),
+        szczegoly=szczegoly,
+        adres_ip=adres_ip,
+        znacznik_czasu=timezone.now(),
+    )
+    if getattr(settings, 'ACTIVITY_LOG_SYNC', False):
+        entry.save(force_insert=True) # Rolled back with the transaction, if any
+    else:
+        transaction.on_commit(lambda: get_writer().put(entry))
+    return entry
+
+
+def flush_activity_log():
+    if _writer is not None:
+        _writer.flush()
+
+
+def get_metrics():
+    return get_writer().get_metrics()
@@ -1,11 +1,13 @@
 from django.contrib import admin
 from django.contrib.auth.models import User
 from guardian.admin import GuardedModelAdmin
-from guardian.shortcuts import assign_perm, remove_perm, get_perms
+from guardian.shortcuts import assign_perm, remove_perm, get_perms, get_objects_for_user
 from .models import (
     Document, DocumentVersion, Folder, Tag, Tag, 
-    DocumentMetadata, Comment, ActivityLog, DocumentShare, SystemSettings
+    DocumentMetadata, Comment, ActivityLog, DocumentShare, SystemSettings, StorageStats, FolderDeletionJob,
+    UploadSession
 )
+from .stats import rebuild_totals
 
 
 @admin.register(Document)
@@ -14,7 +16,7 @@ class DocumentAdmin(GuardedModelAdmin):
     list_display = ['nazwa', 'typ_pliku', 'get_file_size', 'wlasciciel', 'folder', 'data_utworzenia', 'status', 'usunieto']
     list_filter = ['typ_pliku', 'status', 'usunieto', 'data_utworzenia', 'folder']
     search_fields = ['nazwa', 'wlasciciel__username', 'wlasciciel__first_name', 'wlasciciel__last_name']
-    readonly_fields = ['data_utworzenia', 'ostatnia_modyfikacja', 'rozmiar_pliku']
+    readonly_fields = ['data_utworzenia', 'ostatnia_modyfikacja', 'rozmiar_pliku', 'data_usuniecia', 'usuniety_przez']
     filter_horizontal = ['tagi']  # This works now since we removed 'through' parameter
     
     fieldsets = (
@@ -32,7 +34,7 @@ class DocumentAdmin(GuardedModelAdmin):
             'classes': ('collapse',)
         }),
         ('Status', {
-            'fields': ('usunieto',)
+            'fields': ('usunieto', 'data_usuniecia', 'usuniety_przez')
         })
     )
     
@@ -70,11 +72,12 @@ class FolderAdmin(GuardedModelAdmin):
     )
     
     def get_documents_count(self, obj):
-        return obj.documents.filter(usunieto=False).count()
+        return obj.doc_count
     get_documents_count.short_description = 'Liczba dokumentów'
+    get_documents_count.admin_order_field = 'doc_count'
     
     def get_queryset(self, request):
-        qs = super().get_queryset(request)
+        qs = super().get_queryset(request).with_counts()
         if request.user.is_superuser:
             return qs.select_related('wlasciciel', 'rodzic')
         # For non-superusers, show only folders they can view
@@ -138,6 +141,7 @@ class ActivityLogAdmin(admin.ModelAdmin):
     search_fields = ['uzytkownik__username', 'szczegoly', 'adres_ip']
     readonly_fields = ['znacznik_czasu']
     date_hierarchy = 'znacznik_czasu'
+    show_full_result_count = False # No COUNT(*) of the whole log next to filtered results
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('uzytkownik', 'dokument', 'folder')
@@ -241,56 +245,89 @@ class SystemSettingsAdmin(admin.ModelAdmin):
     #         return self.readonly_fields + ('klucz',)
     #     return self.readonly_fields
 
+@admin.register(StorageStats)
+class StorageStatsAdmin(admin.ModelAdmin):
+    """Running storage totals (maintained automatically)"""
+    list_display = ['uzytkownik', 'liczba_dokumentow', 'liczba_folderow', 'get_size', 'data_modyfikacji']
+    readonly_fields = ['uzytkownik', 'liczba_dokumentow', 'liczba_folderow', 'rozmiar_calkowity', 'data_modyfikacji']
+    actions = ['rebuild_stats']
+
+    def get_size(self, obj):
+        size = obj.rozmiar_calkowity
+        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+            if size < 1024.0:
+                return f"{size:.1f} {unit}"
+            size /= 1024.0
+        return f"{size:.1f} PB"
+    get_size.short_description = 'Rozmiar'
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('uzytkownik')
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description="Przelicz statystyki od nowa")
+    def rebuild_stats(self, request, queryset):
+        rebuild_totals()
+        self.message_user(request, "Statystyki zostały przeliczone.")
+
+
+@admin.register(FolderDeletionJob)
+class FolderDeletionJobAdmin(admin.ModelAdmin):
+    """Background folder deletions (read-only)"""
+    list_display = ['nazwa_folderu', 'uzytkownik', 'status', 'usuniete_dokumenty', 'liczba_dokumentow', 'usuniete_foldery', 'liczba_folderow', 'data_utworzenia', 'data_zakonczenia']
+    list_filter = ['status', 'data_utworzenia']
+    search_fields = ['nazwa_folderu', 'uzytkownik__username']
+    readonly_fields = [field.name for field in FolderDeletionJob._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    """Chunked uploads in progress or waiting to be attached (read-only)"""
+    list_display = ['nazwa_pliku', 'uzytkownik', 'status', 'przeslano', 'rozmiar', 'data_modyfikacji', 'data_wygasniecia']
+    list_filter = ['status', 'data_utworzenia']
+    search_fields = ['nazwa_pliku', 'uzytkownik__username']
+    readonly_fields = [field.name for field in UploadSession._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+def _grant_to_editors(modeladmin, request, queryset, permissions, description):
+    """Nadaj uprawnienia wszystkim aktywnym edytorom do wybranych dokumentów (jednym zapisem)"""
+    # Tutaj możesz dodać formularz do wyboru użytkowników
+    # Na razie jako przykład, nadajmy uprawnienia wszystkim edytorom
+    from users.models import Role, UserProfile
+    from users.permissions import bulk_grant_permissions
+    if not Role.objects.filter(nazwa=Role.EDITOR).exists():
+        modeladmin.message_user(request, "Rola 'edytor' nie istnieje.", level='error')
+        return
+
+    documents = list(queryset)
+    editor_ids = list(UserProfile.objects.filter(rola__nazwa=Role.EDITOR, aktywny=True).values_list('user_id', flat=True))
+    granted = bulk_grant_permissions(documents, editor_ids, permissions, actor=request.user, adres_ip=request.META.get('REMOTE_ADDR'))
+    modeladmin.message_user(
+        request,
+        f"Nadano {description} {len(editor_ids)} użytkownikom dla {len(documents)} dokumentów (nowych uprawnień: {granted})."
+    )
+
+
 def grant_view_permission(modeladmin, request, queryset):
     """Nadaj uprawnienia do przeglądania wybranym dokumentom"""
     if not queryset:
         modeladmin.message_user(request, "Nie wybrano żadnych dokumentów.", level='error')
         return
-    
-    # Tutaj możesz dodać formularz do wyboru użytkowników
-    # Na razie jako przykład, nadajmy uprawnienia wszystkim edytorom
-    from users.models import Role, UserProfile
-    try:
-        editor_role = Role.objects.get(nazwa='edytor')
-        editor_profiles = UserProfile.objects.filter(rola=editor_role, aktywny=True)
-        
-        granted_count = 0
-        for document in queryset:
-            for profile in editor_profiles:
-                assign_perm('browse_document', profile.user, document)
-                assign_perm('comment_document', profile.user, document)
-                granted_count += 1
-        
-        modeladmin.message_user(
-            request, 
-            f"Nadano uprawnienia przeglądania i komentowania {granted_count} użytkownikom dla {queryset.count()} dokumentów."
-        )
-    except Role.DoesNotExist:
-        modeladmin.message_user(request, "Rola 'edytor' nie istnieje.", level='error')
+    _grant_to_editors(modeladmin, request, queryset, ['browse_document', 'comment_document'], "uprawnienia przeglądania i komentowania")
 
 grant_view_permission.short_description = "Nadaj uprawnienia przeglądania edytorom"
 
 def grant_download_permission(modeladmin, request, queryset):
     """Nadaj uprawnienia do pobierania wybranym dokumentom"""
-    from users.models import Role, UserProfile
-    try:
-        editor_role = Role.objects.get(nazwa='edytor')
-        editor_profiles = UserProfile.objects.filter(rola=editor_role, aktywny=True)
-        
-        granted_count = 0
-        for document in queryset:
-            for profile in editor_profiles:
-                assign_perm('browse_document', profile.user, document)
-                assign_perm('comment_document', profile.user, document)
-                assign_perm('download_document', profile.user, document)
-                granted_count += 1
-        
-        modeladmin.message_user(
-            request, 
-            f"Nadano pełne uprawnienia {granted_count} użytkownikom dla {queryset.count()} dokumentów."
-        )
-    except Role.DoesNotExist:
-        modeladmin.message_user(request, "Rola 'edytor' nie istnieje.", level='error')
+    _grant_to_editors(modeladmin, request, queryset, ['browse_document', 'comment_document', 'download_document'], "pełne uprawnienia")
 
 grant_download_permission.short_description = "Nadaj pełne uprawnienia edytorom"
 
@@ -0,0 +1,198 @@
+"""
+Uploading many documents at once.
+
+Saving documents one by one costs a form post, a Document.save() with its
+signals, six assign_perm calls and an ActivityLog row per file.
+ingest_batch() takes all files of one request (ZIP archives are expanded,
+streaming every member out of the archive without loading it into memory)
+and:
+
+1. copies them into the blob storage, hashing on the way, in a pool of
+   BATCH_UPLOAD_WORKERS threads,
+2. creates the Documents and their tags with bulk_create and grants the
+   owner permissions with one bulk insert, in a single transaction,
+3. applies what the Document signals would have done, once for the batch:
+   blob references, storage totals, access table, search index, one
+   background task extracting the text of all files and one creating the
+   thumbnails of the images,
+4. logs one ActivityLog entry for the whole batch.
+
+Files that cannot be accepted (format, size, content not matching the
+extension) are skipped and reported, they do not fail the batch. So are
+whole archives that are damaged or would expand to more than
+BATCH_UPLOAD_MAX_ARCHIVE_MEMBERS entries or BATCH_UPLOAD_MAX_ARCHIVE_SIZE
+bytes - members are read up to their declared size, so the declared sizes
+bound what an archive can expand to. Archives stay open until their members
+are stored and are closed afterwards.
+"""
+import os
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import transaction
+
+from . import access, blobs, search, stats
+from .activity import log_activity
+from .extraction import schedule_bulk_extraction
+from .renditions import schedule_renditions
+from .settings_cache import format_size
+from .uploadhandlers import content_matches_extension, sniff_content_type
+
+# Archive entries that are not documents
+IGNORED_PREFIXES = ('__MACOSX/', '.')
+
+
+def get_max_files():
+    return getattr(settings, 'BATCH_UPLOAD_MAX_FILES', 500)
+
+
+def get_workers():
+    return getattr(settings, 'BATCH_UPLOAD_WORKERS', 4)
+
+
+def get_max_archive_members():
+    return getattr(settings, 'BATCH_UPLOAD_MAX_ARCHIVE_MEMBERS', 2000)
+
+
+def get_max_archive_size():
+    return getattr(settings, 'BATCH_UPLOAD_MAX_ARCHIVE_SIZE', 2 * 1024 * 1024 * 1024)
+
+
+@dataclass
+class BatchResult:
+    documents: list = field(default_factory=list)
+    skipped: list = field(default_factory=list) # (file name, reason)
+
+    @property
+    def total_size(self):
+        return sum(document.rozmiar_pliku or 0 for document in self.documents)
+
+
+@dataclass
+class _Source:
+    name: str
+    open: object # Callable returning a readable stream
+    size: int
+
+
+def _iter_sources(files, result, archives):
+    """Files to store, ZIP archives replaced by their members; archives are opened in the archives ExitStack."""
+    for uploaded in files:
+        if os.path.splitext(uploaded.name)[1].lower() != '.zip':
+            yield _Source(os.path.basename(uploaded.name), lambda uploaded=uploaded: uploaded.open('rb'), uploaded.size)
+            continue
+        try:
+            archive = archives.enter_context(zipfile.ZipFile(uploaded))
+        except zipfile.BadZipFile:
+            result.skipped.append((uploaded.name, "Uszkodzone archiwum ZIP"))
+            continue
+        members = archive.infolist()
+        if len(members) > get_max_archive_members():
+            result.skipped.append((uploaded.name, f"Archiwum zawiera ponad {get_max_archive_members()} plików"))
+            continue
+        if sum(info.file_size for info in members) > get_max_archive_size():
+            result.skipped.append((uploaded.name, f"Archiwum po rozpakowaniu przekracza {format_size(get_max_archive_size())}"))
+            continue
+        for info in members:
+            name = info.filename
+            if info.is_dir() or name.startswith(IGNORED_PREFIXES) or os.path.basename(name).startswith('.'):
+                continue
+            yield _Source(os.path.basename(name), lambda archive=archive, info=info: archive.open(info), info.file_size)
+
+
+def _collect_sources(files, result, archives):
+    from .models import Document
+
+    max_size = Document.get_max_file_size()
+    sources = []
+    for source in _iter_sources(files, result, archives):
+        extension = os.path.splitext(source.name)[1].lower().lstrip('.')
+        if extension not in Document.ALLOWED_EXTENSIONS:
+            result.skipped.append((source.name, "Nieobsługiwany format pliku"))
+        elif source.size > max_size:
+            result.skipped.append((source.name, f"Plik większy niż {format_size(max_size)}"))
+        elif len(sources) >= get_max_files():
+            result.skipped.append((source.name, f"Przekroczono limit {get_max_files()} plików w jednej paczce"))
+        else:
+            sources.append(source)
+    return sources, max_size
+
+
+def _store(source, max_size):
+    """Copy one file into the blob storage. Returns (source, stored file) or (source, error)."""
+    try:
+        with source.open() as stream:
+            name, file_hash, size, head = blobs.store_stream(stream, source.name, max_size=max_size)
+    except blobs.FileTooLarge:
+        return source, f"Plik większy niż {format_size(max_size)}"
+    except (OSError, EOFError, zipfile.BadZipFile, zlib.error, RuntimeError, NotImplementedError) as exc:
+        # Damaged, encrypted or unsupported archive member
+        return source, f"Nie udało się odczytać pliku: {exc}"
+    return source, (name, file_hash, size, sniff_content_type(head, source.name))
+
+
+def ingest_batch(files, user, folder=None, tags=(), status='draft', adres_ip=None):
+    """Create a document for every file (members of ZIP archives included). Returns a BatchResult."""
+    from .models import Document
+    from users.permissions import DOCUMENT_PERMISSIONS, bulk_grant_permissions
+
+    result = BatchResult()
+    stored = []
+    rejected = []
+    with ExitStack() as archives:
+        sources, max_size = _collect_sources(files, result, archives)
+        with ThreadPoolExecutor(max_workers=max(get_workers(), 1), thread_name_prefix='batch-upload') as executor:
+            for source, outcome in executor.map(lambda source: _store(source, max_size), sources):
+                if isinstance(outcome, str):
+                    result.skipped.append((source.name, outcome))
+                elif not content_matches_extension(source.name, outcome[3]):
+                    result.skipped.append((source.name, "Zawartość pliku nie odpowiada jego rozszerzeniu"))
+                    rejected.append((source, outcome))
+                else:
+                    stored.append((source, outcome))
+    # Until the documents exist the files are unreferenced blobs, collected if the transaction fails
+    # (rejected files right away)
+    blobs.register_blobs([(name, file_hash, size) for _, (name, file_hash, size, _) in stored + rejected])
+    if not stored:
+        return result
+
+    documents = [
+        Document(
+            nazwa=source.name, plik=name, typ_pliku=os.path.splitext(name)[1].lstrip('.'),
+            rozmiar_pliku=size, hash_pliku=file_hash, typ_mime=content_type,
+            wlasciciel=user, folder=folder, status=status,
+        )
+        for source, (name, file_hash, size, content_type) in stored
+    ]
+    tags = list(tags)
+    with transaction.atomic(), access.batch_sync():
+        Document.objects.bulk_create(documents, batch_size=500)
+        if tags:
+            Document.tagi.through.objects.bulk_create([
+                Document.tagi.through(document_id=document.pk, tag_id=tag.pk) for document in documents for tag in tags
+            ], batch_size=500)
+        # bulk_create sends no signals - do once what they do per document
+        blobs.add_references([(document.plik.name, document.hash_pliku, document.rozmiar_pliku) for document in documents])
+        stats.apply_delta(user.pk, documents=len(documents), size=sum(document.rozmiar_pliku for document in documents))
+        document_ids = [document.pk for document in documents]
+        access.request_sync(Document, document_ids)
+        bulk_grant_permissions(documents, [user], DOCUMENT_PERMISSIONS)
+        search.schedule_reindex(document_ids)
+        schedule_bulk_extraction(document_ids)
+        schedule_renditions(documents)
+    result.documents = documents
+
+    log_activity(
+        uzytkownik=user, typ_aktywnosci='tworzenie', folder=folder,
+        szczegoly=(
+            f"Wgrano {len(documents)} dokumentów ({format_size(result.total_size)})"
+            + (f" do folderu {folder.nazwa}" if folder else "")
+            + (f", pominięto {len(result.skipped)} plików" if result.skipped else "")
+        ),
+        adres_ip=adres_ip,
+    )
+    return result
@@ -0,0 +1,289 @@
+"""
+Content-addressed blob store for document and version files.
+
+Files are stored once per distinct content under a name derived from their
+SHA-256 hash (blobs/ab/cd/<hash>.<ext>). Saving content that is already
+stored costs no disk space and no write I/O - the existing blob is reused.
+Document.plik and DocumentVersion.plik may point to the same blob.
+
+FileBlob keeps a reference count per stored name, maintained by the signals
+in documents.signals. Blobs are never deleted when the last reference goes
+away; collect_garbage() (management command collect_blobs) removes blobs that
+have been unreferenced for a grace period, so an upload racing with the
+deletion of the last reference cannot lose its file. Renditions and previews
+of content no longer stored (documents.renditions, documents.office_preview)
+are deleted with it.
+"""
+import hashlib
+import logging
+import os
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+BLOB_PREFIX = 'blobs/'
+# Files being written before they are moved to their blob name (same file system, so moving is a rename)
+TEMPORARY_PREFIX = 'uploads/'
+GARBAGE_GRACE_PERIOD = timedelta(hours=1)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that keeps one file per name and never overwrites or renames blobs."""
+
+    def get_available_name(self, name, max_length=None):
+        if name.startswith(BLOB_PREFIX):
+            return name # Same name = same content
+        return super().get_available_name(name, max_length=max_length)
+
+    def _save(self, name, content):
+        if not name.startswith(BLOB_PREFIX):
+            return super()._save(name, content)
+        if self.exists(name):
+            return name
+        # Write under a unique name and rename into place, so a concurrent upload of
+        # the same content never sees a partially written blob
+        temporary_name = super()._save(f"{name}.{uuid.uuid4().hex}.part", content)
+        os.replace(self.path(temporary_name), self.path(name))
+        return name
+
+
+_blob_storage = None
+
+
+def get_blob_storage():
+    global _blob_storage
+    if _blob_storage is None:
+        _blob_storage = ContentAddressedStorage()
+    return _blob_storage
+
+
+def blob_name(file_hash, filename):
+    """blobs/ab/cd/<sha256>.<ext>"""
+    ext = os.path.splitext(filename)[1].lower()
+    return f"{BLOB_PREFIX}{file_hash[:2]}/{file_hash[2:4]}/{file_hash}{ext}"
+
+
+def blob_upload_path(instance, filename):
+    """upload_to of document files - hash_pliku is computed by the model before the file is saved."""
+    return blob_name(instance.hash_pliku or uuid.uuid4().hex, filename) # No hash: store without deduplication
+
+
+def temporary_path(suffix='.part'):
+    """Absolute path for a file written before move_into_place(), its directory created."""
+    path = get_blob_storage().path(f"{TEMPORARY_PREFIX}{uuid.uuid4().hex}{suffix}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def move_into_place(path, name):
+    """Rename a completely written file to the blob name; dropped when that content is stored already."""
+    storage = get_blob_storage()
+    if storage.exists(name):
+        os.remove(path)
+        return
+    os.makedirs(os.path.dirname(storage.path(name)), exist_ok=True)
+    os.replace(path, storage.path(name))
+
+
+class FileTooLarge(ValueError):
+    pass
+
+
+def store_stream(stream, filename, max_size=None, chunk_size=1024 * 1024):
+    """
+    Copy a stream into the blob storage, hashing it on the way. Returns
+    (blob name, sha256, size, first bytes for MIME sniffing). Raises FileTooLarge
+    as soon as more than max_size bytes arrive (sizes declared by archives can lie).
+    """
+    from .uploadhandlers import SNIFF_SIZE
+
+    path = temporary_path()
+    file_hash = hashlib.sha256()
+    size = 0
+    head = b''
+    try:
+        with open(path, 'wb') as target:
+            for data in iter(lambda: stream.read(chunk_size), b''):
+                size += len(data)
+                if max_size is not None and size > max_size:
+                    raise FileTooLarge(filename)
+                file_hash.update(data)
+                if len(head) < SNIFF_SIZE:
+                    head += data[:SNIFF_SIZE - len(head)]
+                target.write(data)
+        name = blob_name(file_hash.hexdigest(), filename)
+        move_into_place(path, name)
+    except BaseException:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    return name, file_hash.hexdigest(), size, head
+
+
+def add_reference(name, file_hash='', size=0):
+    """Count one more Document/DocumentVersion pointing at the stored file name."""
+    from .models import FileBlob
+
+    if not name:
+        return
+    changes = {'liczba_odwolan': F('liczba_odwolan') + 1, 'data_modyfikacji': timezone.now()}
+    if FileBlob.objects.filter(nazwa=name).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            FileBlob.objects.create(nazwa=name, hash_pliku=file_hash or '', rozmiar=size or 0, liczba_odwolan=1)
+    except IntegrityError: # Created concurrently
+        FileBlob.objects.filter(nazwa=name).update(**changes)
+
+
+def register_blobs(files):
+    """
+    Record stored files nothing references yet (finished uploads) from (name, hash, size)
+    tuples, so collect_garbage() can remove them if they are never used; restarts the
+    grace period of files already known.
+    """
+    from .models import FileBlob
+
+    fingerprints = {name: (file_hash, size) for name, file_hash, size in files if name}
+    if not fingerprints:
+        return
+    FileBlob.objects.filter(nazwa__in=list(fingerprints)).update(data_modyfikacji=timezone.now())
+    FileBlob.objects.bulk_create([
+        FileBlob(nazwa=name, hash_pliku=file_hash or '', rozmiar=size or 0, liczba_odwolan=0)
+        for name, (file_hash, size) in fingerprints.items()
+    ], ignore_conflicts=True)
+
+
+def register_blob(name, file_hash='', size=0):
+    register_blobs([(name, file_hash, size)])
+
+
+def add_references(files):
+    """add_reference() for many (name, hash, size) tuples - one UPDATE per distinct count."""
+    from .models import FileBlob
+
+    counts = Counter(name for name, _, _ in files if name)
+    if not counts:
+        return
+    register_blobs(files) # Creates the missing rows with no references
+    by_count = defaultdict(list)
+    for name, count in counts.items():
+        by_count[count].append(name)
+    for count, names in by_count.items():
+        FileBlob.objects.filter(nazwa__in=names).update(
+            liczba_odwolan=F('liczba_odwolan') + count, data_modyfikacji=timezone.now()
+        )
+
+
+def remove_reference(name):
+    from .models import FileBlob
+
+    if name:
+        FileBlob.objects.filter(nazwa=name, liczba_odwolan__gt=0).update(
+            liczba_odwolan=F('liczba_odwolan') - 1, data_modyfikacji=timezone.now()
+        )
+
+
+def count_references():
+    """{stored name: number of documents and versions using it}, from the database."""
+    from .models import Document, DocumentVersion
+
+    counts = {}
+    for model in (Document, DocumentVersion):
+        rows = model.objects.exclude(plik='').exclude(plik__isnull=True).order_by().values('plik').annotate(count=Count('pk'))
+        for row in rows:
+            counts[row['plik']] = counts.get(row['plik'], 0) + row['count']
+    return counts
+
+
+def rebuild_reference_counts():
+    """Recount references of every stored file (also registers files stored before blobs existed)."""
+    from .models import Document, DocumentVersion, FileBlob
+
+    counts = count_references()
+    fingerprints = {}
+    for model in (Document, DocumentVersion):
+        for name, file_hash, size in model.objects.filter(plik__in=list(counts)).values_list('plik', 'hash_pliku', 'rozmiar_pliku'):
+            fingerprints.setdefault(name, (file_hash, size))
+
+    with transaction.atomic():
+        changed = []
+        for name, blob in FileBlob.objects.in_bulk(field_name='nazwa').items():
+            count = counts.pop(name, 0)
+            if blob.liczba_odwolan != count:
+                blob.liczba_odwolan, blob.data_modyfikacji = count, timezone.now()
+                changed.append(blob)
+        FileBlob.objects.bulk_update(changed, ['liczba_odwolan', 'data_modyfikacji'])
+        FileBlob.objects.bulk_create([
+            FileBlob(nazwa=name, hash_pliku=fingerprints.get(name, ('', 0))[0] or '',
+                     rozmiar=fingerprints.get(name, ('', 0))[1] or 0, liczba_odwolan=count)
+            for name, count in counts.items()
+        ])
+
+
+def delete_files(storage, names, workers=1):
+    """Delete stored files, up to `workers` at a time. Returns the names deleted."""
+    def delete(name):
+        try:
+            storage.delete(name)
+            return name
+        except OSError:
+            logger.warning("Nie udało się usunąć pliku %s", name, exc_info=True)
+            return None
+
+    if workers > 1 and len(names) > 1:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='blob-delete') as executor:
+            results = list(executor.map(delete, names))
+    else:
+        results = [delete(name) for name in names]
+    return [name for name in results if name is not None]
+
+
+def collect_garbage(grace_period=GARBAGE_GRACE_PERIOD, dry_run=False, workers=1, batch_size=500):
+    """
+    Delete stored files unreferenced for longer than grace_period, batch_size blobs at a
+    time with up to `workers` files deleted in parallel. Returns the deleted FileBlobs.
+    """
+    from .models import Document, DocumentVersion, FileBlob, UploadSession
+
+    storage = get_blob_storage()
+    deleted = []
+    candidates = FileBlob.objects.filter(liczba_odwolan=0, data_modyfikacji__lt=timezone.now() - grace_period)
+    candidate_ids = list(candidates.order_by('pk').values_list('pk', flat=True))
+    for start in range(0, len(candidate_ids), batch_size):
+        unreferenced = []
+        for blob in FileBlob.objects.filter(pk__in=candidate_ids[start:start + batch_size], liczba_odwolan=0):
+            # Counters are maintained by signals - double-check before deleting anything
+            references = Document.objects.filter(plik=blob.nazwa).count() + DocumentVersion.objects.filter(plik=blob.nazwa).count()
+            if references:
+                FileBlob.objects.filter(pk=blob.pk).update(liczba_odwolan=references)
+                continue
+            if UploadSession.objects.filter(plik=blob.nazwa).exists(): # Finished upload not attached yet
+                continue
+            unreferenced.append(blob)
+        if not dry_run and unreferenced:
+            removed = set(delete_files(storage, [blob.nazwa for blob in unreferenced], workers))
+            unreferenced = [blob for blob in unreferenced if blob.nazwa in removed]
+            FileBlob.objects.filter(pk__in=[blob.pk for blob in unreferenced]).delete()
+            _delete_derived_files({blob.hash_pliku for blob in unreferenced if blob.hash_pliku})
+        deleted.extend(unreferenced)
+    return deleted
+
+
+def _delete_derived_files(file_hashes):
+    """Delete the renditions and previews of contents no longer stored under any name."""
+    from .models import FileBlob
+    from .office_preview import delete_previews
+    from .renditions import delete_renditions
+
+    still_stored = set(FileBlob.objects.filter(hash_pliku__in=list(file_hashes)).values_list('hash_pliku', flat=True))
+    delete_renditions(file_hashes - still_stored)
+    delete_previews(file_hashes - still_stored)
@@ -0,0 +1,249 @@
+"""
+Resumable uploads of large files, sent in chunks.
+
+A multipart POST holds a worker for the whole transfer and must be sent again
+from the start when the connection drops. Instead the upload pages send files
+in short requests, following the tus protocol (https://tus.io) in spirit:
+
+    POST   uploads/        nazwa_pliku, rozmiar -> 201, Location of the session
+    HEAD   uploads/<id>/   Upload-Offset: bytes received so far, to resume
+    PATCH  uploads/<id>/   one chunk starting at Upload-Offset, optionally with
+                           Upload-Checksum: sha256 <base64 digest of the chunk>;
+                           an empty one at the full size retries a failed completion
+    DELETE uploads/<id>/   abandon the upload
+
+Chunks are written straight into a part file inside the blob storage
+directory. When the last one arrives the file is hashed once and renamed to
+its content-addressed blob name (documents.blobs) - it is never copied. The
+form of document_upload / document_version_upload then posts only the
+session id (field przeslanie) and attach_upload() uses the stored blob in the
+transaction that creates the Document or DocumentVersion.
+
+If completing fails (I/O or database error), the session keeps all bytes
+received and stays in progress; _complete() can be run again - it records the
+fingerprint before moving the part file, so a retry after the move only
+finishes the registration. The upload script retries with an empty PATCH.
+
+A chunk request claims its session (zapis_od), so two requests for the same
+offset cannot interleave their writes. Sessions expire
+UPLOAD_SESSION_EXPIRY_HOURS after their last chunk; purge_expired_sessions()
+(management command purge_uploads) removes them with their part files.
+"""
+import base64
+import binascii
+import hashlib
+import logging
+import os
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import timezone
+
+from . import blobs
+from .settings_cache import format_size, get_size
+from .uploadhandlers import SNIFF_SIZE, UPLOAD_CHUNK_SIZE, sniff_content_type, validate_content_type
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_PREFIX = blobs.TEMPORARY_PREFIX
+DEFAULT_MAX_UPLOAD_SIZE = 4 * 1024 * 1024 * 1024
+# A claim older than this belongs to a request that died mid-chunk
+CHUNK_CLAIM_TIMEOUT = timedelta(minutes=5)
+
+
+class UploadConflict(Exception):
+    """The chunk does not start at the current offset of the upload."""
+
+    def __init__(self, offset):
+        super().__init__(f"Przesyłanie jest na pozycji {offset}")
+        self.offset = offset
+
+
+def get_max_upload_size():
+    """Largest file accepted in chunks (MAX_CHUNKED_UPLOAD_SIZE system setting, cached)"""
+    return get_size('MAX_CHUNKED_UPLOAD_SIZE', DEFAULT_MAX_UPLOAD_SIZE)
+
+
+def get_max_chunk_size():
+    return getattr(settings, 'UPLOAD_MAX_CHUNK_SIZE', 16 * 1024 * 1024)
+
+
+def get_session_expiry():
+    return timedelta(hours=getattr(settings, 'UPLOAD_SESSION_EXPIRY_HOURS', 24))
+
+
+def _part_path(session):
+    return blobs.get_blob_storage().path(session.plik_czesciowy)
+
+
+def create_session(user, filename, size):
+    """Start an upload of `size` bytes. Raises ValidationError for files that would be refused anyway."""
+    from .models import Document, UploadSession
+
+    filename = os.path.basename(filename or '').strip()
+    extension = os.path.splitext(filename)[1].lower().lstrip('.')
+    if extension not in Document.ALLOWED_EXTENSIONS:
+        raise ValidationError(f"Nieobsługiwany format pliku. Dozwolone formaty: {', '.join(Document.ALLOWED_EXTENSIONS)}")
+    if size is None or size < 0:
+        raise ValidationError("Nieprawidłowy rozmiar pliku.")
+    max_size = get_max_upload_size()
+    if size > max_size:
+        raise ValidationError(f"Plik jest za duży! Maksymalny rozmiar to {format_size(max_size)}.")
+
+    session = UploadSession(
+        uzytkownik=user, nazwa_pliku=filename, rozmiar=size,
+        plik_czesciowy=f"{UPLOAD_PREFIX}{uuid.uuid4().hex}.part",
+        data_wygasniecia=timezone.now() + get_session_expiry(),
+    )
+    path = _part_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+    session.save()
+    if not size:
+        _complete(session)
+    return session
+
+
+def _parse_checksum(header):
+    """Expected SHA-256 digest from an Upload-Checksum header ("sha256 <base64>"), or None."""
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(' ')
+    if algorithm.lower() != 'sha256':
+        raise ValidationError(f"Nieobsługiwany algorytm sumy kontrolnej: {algorithm}")
+    try:
+        return base64.b64decode(value.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        raise ValidationError("Nieprawidłowa suma kontrolna fragmentu.")
+
+
+def append_chunk(session, offset, stream, length, checksum=None):
+    """
+    Write `length` bytes read from stream at `offset`. Returns the new offset. A chunk
+    with a checksum is kept only when it arrived whole and matches; without one, the
+    bytes received before a dropped connection are kept and the client resumes after them.
+    An empty chunk at the end of a fully received file retries completing it.
+    """
+    from .models import UploadSession
+
+    if not length and offset != session.rozmiar:
+        raise ValidationError("Pusty fragment lub brak nagłówka Content-Length.")
+    if length > get_max_chunk_size():
+        raise ValidationError(f"Fragment jest za duży. Maksymalny rozmiar fragmentu to {format_size(get_max_chunk_size())}.")
+    if offset + length > session.rozmiar:
+        raise ValidationError("Fragment wykracza poza zadeklarowany rozmiar pliku.")
+    expected_digest = _parse_checksum(checksum)
+
+    now = timezone.now()
+    claimed = UploadSession.objects.filter(
+        Q(zapis_od__isnull=True) | Q(zapis_od__lt=now - CHUNK_CLAIM_TIMEOUT),
+        pk=session.pk, status=UploadSession.STATUS_UPLOADING, przeslano=offset,
+    ).update(zapis_od=now)
+    if not claimed:
+        session.refresh_from_db(fields=['przeslano', 'status'])
+        raise UploadConflict(session.przeslano)
+
+    received = 0
+    try:
+        if length:
+            digest = hashlib.sha256()
+            with open(_part_path(session), 'r+b') as part:
+                part.seek(offset)
+                while received < length:
+                    data = stream.read(min(UPLOAD_CHUNK_SIZE, length - received))
+                    if not data: # Client went away
+                        break
+                    part.write(data)
+                    digest.update(data)
+                    received += len(data)
+                if expected_digest is not None and (received != length or digest.digest() != expected_digest):
+                    received = 0
+                part.truncate(offset + received) # Drops whatever a dead request left behind, too
+        session.przeslano = offset + received
+        if session.przeslano == session.rozmiar:
+            _complete(session) # Still claimed, so it runs once; on failure the bytes stay for a retry
+    finally:
+        session.przeslano = offset + received
+        session.data_wygasniecia = timezone.now() + get_session_expiry()
+        UploadSession.objects.filter(pk=session.pk).update(
+            przeslano=session.przeslano, zapis_od=None,
+            data_modyfikacji=timezone.now(), data_wygasniecia=session.data_wygasniecia,
+        )
+
+    if expected_digest is not None and length and not received:
+        raise ValidationError("Suma kontrolna fragmentu się nie zgadza. Wyślij go ponownie.")
+    return session.przeslano
+
+
+def _complete(session):
+    """
+    Hash the received file and move it into the blob storage under its content-addressed
+    name. Safe to run again after a failure, also one after the file was moved.
+    """
+    from .models import UploadSession
+
+    part_path = _part_path(session)
+    if not (session.plik and not os.path.exists(part_path)): # Otherwise moved by an earlier attempt
+        file_hash = hashlib.sha256()
+        head = b''
+        with open(part_path, 'rb') as part:
+            for data in iter(lambda: part.read(UPLOAD_CHUNK_SIZE), b''):
+                file_hash.update(data)
+                if len(head) < SNIFF_SIZE:
+                    head += data[:SNIFF_SIZE - len(head)]
+
+        session.hash_pliku = file_hash.hexdigest()
+        session.typ_mime = sniff_content_type(head, session.nazwa_pliku)
+        session.plik = blobs.blob_name(session.hash_pliku, session.nazwa_pliku)
+        # Recorded before the part file disappears, so a retry knows where it went
+        session.save(update_fields=['hash_pliku', 'typ_mime', 'plik', 'data_modyfikacji'])
+        blobs.move_into_place(part_path, session.plik)
+    blobs.register_blob(session.plik, session.hash_pliku, session.rozmiar)
+
+    session.status = UploadSession.STATUS_READY
+    session.save(update_fields=['status', 'data_modyfikacji'])
+
+
+def attach_upload(instance, session):
+    """
+    Point a Document or DocumentVersion at the file of a completed upload and end the
+    session - call inside the transaction that saves the instance.
+    """
+    from .models import UploadSession
+
+    # Deleting only a ready session makes a second form submission with the same id fail
+    if not UploadSession.objects.filter(pk=session.pk, status=UploadSession.STATUS_READY).delete()[0]:
+        raise ValidationError("Przesłany plik został już wykorzystany lub wygasł.")
+    validate_content_type(session.nazwa_pliku, session.typ_mime) # Rolls the deletion back with the transaction
+    instance.plik = session.plik
+    instance.hash_pliku = session.hash_pliku
+    instance.rozmiar_pliku = session.rozmiar
+    instance.typ_mime = session.typ_mime
+    return instance
+
+
+def abort_session(session):
+    """Delete an upload and whatever it received."""
+    if not session.is_complete:
+        try:
+            os.remove(_part_path(session))
+        except FileNotFoundError:
+            pass
+    session.delete() # A completed file stays an unreferenced blob until collect_blobs removes it
+
+
+def purge_expired_sessions(now=None):
+    """Delete sessions past their expiry date. Returns how many were deleted."""
+    from .models import UploadSession
+
+    expired = UploadSession.objects.filter(data_wygasniecia__lt=now or timezone.now())
+    count = 0
+    for session in expired.iterator():
+        abort_session(session)
+        count += 1
+    if count:
+        logger.info("Usunięto %d wygasłych sesji przesyłania", count)
+    return count
@@ -0,0 +1,78 @@
+"""
+Threaded comments of a document.
+
+load_comment_tree() fetches all active comments of a document in a single
+query (authors and their profiles joined) and links them into a tree in
+memory: every comment gets `replies` (its active direct replies, oldest
+first) and `depth`. Replies to an inactive comment are hidden with it, like
+Comment.get_children() does.
+
+Comment.liczba_odpowiedzi counts active direct replies; it is maintained by
+documents.signals, so collapsed views can show "3 odpowiedzi" without
+loading the replies.
+"""
+from django.db.models import F
+
+MAX_INDENT_DEPTH = 4
+
+
+def load_comment_tree(document):
+    """Top-level active comments of document with their replies attached - one query."""
+    from .models import Comment
+
+    comments = list(
+        Comment.objects.filter(dokument=document, aktywny=True)
+        .select_related('uzytkownik__profile')
+        .order_by('data_utworzenia', 'pk')
+    )
+    by_id = {comment.pk: comment for comment in comments}
+    roots = []
+    for comment in comments:
+        comment.replies = []
+    for comment in comments: # Oldest first, so replies keep chronological order
+        if comment.rodzic_id is None:
+            roots.append(comment)
+        elif comment.rodzic_id in by_id:
+            by_id[comment.rodzic_id].replies.append(comment)
+    return roots
+
+
+def flatten_comment_tree(roots):
+    """Comments of a tree in display order (each followed by its replies), with depth and indent set."""
+    flat = []
+    stack = [(comment, 0) for comment in reversed(roots)]
+    while stack:
+        comment, depth = stack.pop()
+        comment.depth = depth
+        comment.indent = min(depth, MAX_INDENT_DEPTH)
+        flat.append(comment)
+        stack.extend((reply, depth + 1) for reply in reversed(comment.replies))
+    return flat
+
+
+def _counted_parent(values):
+    """Parent id whose reply count includes a comment with these values, or None."""
+    return values.get('rodzic_id') if values.get('aktywny') else None
+
+
+def track_reply_change(comment, created):
+    """Move the comment between its parents' reply counts after a save."""
+    from .models import Comment
+
+    before = {} if created else getattr(comment, '_loaded_values', {})
+    old_parent = _counted_parent(before)
+    new_parent = _counted_parent({'aktywny': comment.aktywny, 'rodzic_id': comment.rodzic_id})
+    if old_parent == new_parent:
+        return
+    if old_parent:
+        Comment.objects.filter(pk=old_parent, liczba_odpowiedzi__gt=0).update(liczba_odpowiedzi=F('liczba_odpowiedzi') - 1)
+    if new_parent:
+        Comment.objects.filter(pk=new_parent).update(liczba_odpowiedzi=F('liczba_odpowiedzi') + 1)
+
+
+def track_reply_removal(comment):
+    from .models import Comment
+
+    parent = _counted_parent(getattr(comment, '_loaded_values', None) or {'aktywny': comment.aktywny, 'rodzic_id': comment.rodzic_id})
+    if parent:
+        Comment.objects.filter(pk=parent, liczba_odpowiedzi__gt=0).update(liczba_odpowiedzi=F('liczba_odpowiedzi') - 1)
@@ -0,0 +1,152 @@
+"""
+ZIP export of a folder subtree or of a selection of documents, streamed.
+
+export_response() returns a StreamingHttpResponse whose body is produced
+while it is sent: zipfile writes into ZipStreamBuffer, which the generator
+empties after every block read from storage. Nothing is written to disk and
+memory stays at about one read buffer (EXPORT_READ_BUFFER_SIZE) however big
+the export is, and the first bytes leave as soon as the first file is opened.
+
+The output is not seekable, so entries carry data descriptors and ZIP64
+records are added when sizes or offsets need them. Files are stored
+uncompressed (ZIP_STORED): PDFs, images and Office files are compressed
+already, and the export stays limited by disk and network rather than CPU.
+
+Documents are chosen set-based: the subtree with one range query on the
+materialized path (Folder.objects.subtree), permissions with one join on the
+access table (Document.objects.accessible_by), and the rows are read with an
+iterator, ordered by folder path, so the file list is never held in memory.
+"""
+import logging
+import os
+import zipfile
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+logger = logging.getLogger(__name__)
+
+MISSING_FILES_ENTRY = 'BRAKUJACE_PLIKI.txt'
+
+
+def get_read_buffer_size():
+    return getattr(settings, 'EXPORT_READ_BUFFER_SIZE', 1024 * 1024)
+
+
+class ZipStreamBuffer:
+    """Write-only, unseekable file object collecting what zipfile writes until it is taken."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def seekable(self):
+        return False
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _safe_name(name):
+    return (name or '').replace('/', '_').replace('\\', '_').strip() or 'bez_nazwy'
+
+
+def entry_name(document, folder_path, used):
+    """Path of a document inside the archive: folder path, name with extension, unique."""
+    name = _safe_name(document.nazwa)
+    extension = os.path.splitext(document.plik.name)[1].lower()
+    if extension and not name.lower().endswith(extension):
+        name += extension
+    path = f"{folder_path}/{name}" if folder_path else name
+    stem, extension = os.path.splitext(path)
+    number = 2
+    while path.lower() in used:
+        path = f"{stem} ({number}){extension}"
+        number += 1
+    used.add(path.lower())
+    return path
+
+
+def folder_paths(root):
+    """{folder id: path inside the archive} for the subtree of root - one query."""
+    from .models import Folder
+
+    paths = {}
+    for folder_id, parent_id, name in Folder.objects.subtree(root.sciezka).order_by('sciezka').values_list('pk', 'rodzic_id', 'nazwa'):
+        # Parents sort before their children, so their path is known already
+        paths[folder_id] = _safe_name(name) if folder_id == root.pk else f"{paths[parent_id]}/{_safe_name(name)}"
+    return paths
+
+
+def exportable_documents(user, folder=None, document_ids=None):
+    """Documents of the folder subtree (or with the given ids) user may view - a queryset."""
+    from .models import Document, Folder
+
+    documents = Document.objects.filter(usunieto=False).exclude(plik='').exclude(plik__isnull=True)
+    if folder is not None:
+        documents = documents.filter(folder__in=Folder.objects.subtree(folder.sciezka))
+    if document_ids is not None:
+        documents = documents.filter(pk__in=list(document_ids))
+    if not (user.is_superuser or (hasattr(user, 'profile') and user.profile.is_admin)):
+        documents = documents.accessible_by(user) # Owned or shared - what user_can_view_document allows
+    return documents
+
+
+def stream_zip(documents, paths=None):
+    """Generate a ZIP archive of documents block by block. paths maps folder ids to archive paths."""
+    from .blobs import get_blob_storage
+
+    storage = get_blob_storage()
+    buffer_size = get_read_buffer_size()
+    output = ZipStreamBuffer()
+    used = set()
+    missing = []
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for document in documents.iterator(chunk_size=500):
+            name = entry_name(document, (paths or {}).get(document.folder_id, ''), used)
+            try:
+                source = open(storage.path(document.plik.name), 'rb', buffering=0)
+            except OSError:
+                logger.warning("Eksport: brak pliku %s dokumentu %s", document.plik.name, document.pk)
+                missing.append(name)
+                continue
+            info = zipfile.ZipInfo(name, date_time=timezone.localtime(document.ostatnia_modyfikacja).timetuple()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            info.file_size = document.rozmiar_pliku or 0 # Lets zipfile choose ZIP64 up front
+            with source, archive.open(info, 'w', force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as target:
+                for block in iter(lambda: source.read(buffer_size), b''):
+                    target.write(block)
+                    yield output.take()
+        if missing:
+            archive.writestr(MISSING_FILES_ENTRY, "Nie znaleziono plików dokumentów:\n" + "\n".join(missing) + "\n")
+    yield output.take() # Central directory
+
+
+def export_response(documents, filename, paths=None):
+    """StreamingHttpResponse with the ZIP of documents, sent while it is generated."""
+    # Folder path first, so documents of one folder end up together in the archive
+    documents = documents.select_related(None).only(
+        'pk', 'nazwa', 'plik', 'rozmiar_pliku', 'folder_id', 'ostatnia_modyfikacja'
+    ).order_by('folder__sciezka', 'nazwa', 'pk')
+    response = StreamingHttpResponse(
+        (block for block in stream_zip(documents, paths) if block), content_type='application/zip'
+    )
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Cache-Control'] = 'no-store'
+    response['X-Accel-Buffering'] = 'no' # Let nginx pass blocks on instead of buffering the archive
+    return response
@@ -0,0 +1,191 @@
+"""
+Text extraction from uploaded files.
+
+After an upload (or a new version) schedule_extraction() queues a background
+task (documents.tasks) that streams the stored file, extracts its text and
+stores it in DocumentContent, keyed by document and version. The text of the
+current file is indexed by the search backend (documents.search).
+
+Extraction is keyed by the SHA-256 hash of the file: if the document/version
+already has content for the same hash nothing is done, and if any other
+document has the same file its text is reused without reading the file.
+
+Supported formats: txt, docx, xlsx (stdlib zip/XML parsing) and pdf (pypdf).
+"""
+import codecs
+import logging
+import os
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+from django.db import transaction
+
+from .tasks import run_in_background
+
+logger = logging.getLogger(__name__)
+
+# Upper bound of stored text per file - enough for search, bounded memory
+MAX_TEXT_LENGTH = 1_000_000
+CHUNK_SIZE = 64 * 1024
+
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+class UnsupportedFormat(Exception):
+    pass
+
+
+class TextCollector:
+    """Accumulate text fragments up to MAX_TEXT_LENGTH characters."""
+
+    def __init__(self, limit=MAX_TEXT_LENGTH):
+        self.parts = []
+        self.remaining = limit
+
+    @property
+    def full(self):
+        return self.remaining <= 0
+
+    def add(self, text):
+        if text and not self.full:
+            text = text[:self.remaining]
+            self.parts.append(text)
+            self.remaining -= len(text)
+
+    def text(self):
+        return ''.join(self.parts)
+
+
+def extract_txt(fileobj, collector):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    for chunk in iter(lambda: fileobj.read(CHUNK_SIZE), b''):
+        collector.add(decoder.decode(chunk))
+        if collector.full:
+            return
+    collector.add(decoder.decode(b'', final=True))
+
+
+def _iter_xml_text(stream, text_tags, break_tags=()):
+    for event, element in iterparse(stream, events=('end',)):
+        if element.tag in text_tags and element.text:
+            yield element.text
+        elif element.tag in break_tags:
+            yield '\n'
+        element.clear()
+
+
+def extract_docx(fileobj, collector):
+    with zipfile.ZipFile(fileobj) as archive, archive.open('word/document.xml') as stream:
+        for text in _iter_xml_text(stream, {WORD_NS + 't'}, {WORD_NS + 'p', WORD_NS + 'tab'}):
+            collector.add(text)
+            if collector.full:
+                return
+
+
+def extract_xlsx(fileobj, collector):
+    # Cell texts live in the shared strings table; inline strings in the sheets are rare
+    with zipfile.ZipFile(fileobj) as archive:
+        names = archive.namelist()
+        parts = [name for name in names if name == 'xl/sharedStrings.xml']
+        parts += sorted(name for name in names if name.startswith('xl/worksheets/') and name.endswith('.xml'))
+        for name in parts:
+            with archive.open(name) as stream:
+                for text in _iter_xml_text(stream, {SHEET_NS + 't'}, {SHEET_NS + 'si', SHEET_NS + 'row'}):
+                    collector.add(text)
+                    if collector.full:
+                        return
+
+
+def extract_pdf(fileobj, collector):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise UnsupportedFormat("Biblioteka pypdf nie jest zainstalowana")
+    for page in PdfReader(fileobj).pages:
+        collector.add(page.extract_text() or '')
+        collector.add('\n')
+        if collector.full:
+            return
+
+
+EXTRACTORS = {
+    'txt': extract_txt,
+    'docx': extract_docx,
+    'xlsx': extract_xlsx,
+    'pdf': extract_pdf,
+}
+
+
+def extract_text(file_field, extension):
+    """Extract text from a stored file; raises UnsupportedFormat for other formats."""
+    extractor = EXTRACTORS.get((extension or '').lower().lstrip('.'))
+    if extractor is None:
+        raise UnsupportedFormat(f"Brak ekstraktora dla formatu {extension}")
+    collector = TextCollector()
+    with file_field.open('rb') as fileobj:
+        extractor(fileobj, collector)
+    return collector.text()
+
+
+def extract_document_content(document_id, version_id=None):
+    """Extract text of a document's current file (or of one of its versions)."""
+    from .models import Document, DocumentContent, DocumentVersion
+    from .search import schedule_reindex
+
+    document = Document.objects.filter(pk=document_id).first()
+    if document is None:
+        return None
+    source = document
+    if version_id is not None:
+        source = DocumentVersion.objects.filter(pk=version_id, dokument=document).first()
+        if source is None:
+            return None
+    file_hash = source.hash_pliku
+    if not source.plik or not file_hash:
+        return None
+
+    content, _ = DocumentContent.objects.get_or_create(dokument=document, wersja_id=version_id, defaults={'hash_pliku': file_hash})
+    if content.hash_pliku == file_hash and content.status != 'pending':
+        return content # Same file already processed
+
+    content.hash_pliku = file_hash
+    content.blad = ''
+    duplicate = DocumentContent.objects.filter(hash_pliku=file_hash, status='done').exclude(pk=content.pk).first()
+    if duplicate is not None:
+        content.tekst, content.status = duplicate.tekst, 'done'
+    else:
+        try:
+            content.tekst = extract_text(source.plik, os.path.splitext(source.plik.name)[1])
+            content.status = 'done'
+        except UnsupportedFormat as exc:
+            content.tekst, content.status, content.blad = '', 'unsupported', str(exc)
+        except Exception as exc: # Corrupted or unreadable file
+            logger.warning("Ekstrakcja tekstu dokumentu %s nie powiodła się: %s", document_id, exc)
+            content.tekst, content.status, content.blad = '', 'failed', str(exc)
+    with transaction.atomic():
+        content.save()
+        schedule_reindex([document.pk])
+    return content
+
+
+def schedule_extraction(document, version=None):
+    """Queue text extraction once the current transaction commits."""
+    version_id = version.pk if version is not None else None
+    transaction.on_commit(lambda: run_in_background(extract_document_content, document.pk, version_id))
+
+
+def extract_many(document_ids):
+    """Extract the current files of documents one after another (a single background task)."""
+    for document_id in document_ids:
+        try:
+            extract_document_content(document_id)
+        except Exception: # One broken file must not stop the rest of the batch
+            logger.exception("Ekstrakcja tekstu dokumentu %s nie powiodła się", document_id)
+
+
+def schedule_bulk_extraction(document_ids):
+    """Queue extraction of many new documents as one task once the current transaction commits."""
+    document_ids = list(document_ids)
+    if document_ids:
+        transaction.on_commit(lambda: run_in_background(extract_many, document_ids))
@@ -0,0 +1,182 @@
+"""
+Deleting a folder with its whole subtree as a background job.
+
+Letting Folder.delete() cascade would walk every subfolder, document,
+version, comment and share in Python inside one request and one long
+transaction. Instead folder_delete creates a FolderDeletionJob and
+run_folder_deletion() works through the subtree (found with the
+materialized path range query, Folder.objects.subtree) in batches of
+FOLDER_DELETE_BATCH_SIZE, each in its own short transaction:
+
+1. documents of the subtree are moved to the trash and detached from their
+   folders - they stay restorable until purge_trash removes them. The path
+   of the folder they were in is kept in lokalizacja_przed_usunieciem (also
+   for documents that were in the trash already), shown in the trash, and a
+   restored document lands in the root folder,
+2. folders are deleted deepest first, so every batch is a set of leaves
+   whose cascade is cheap, together with their guardian permissions.
+
+Progress is stored on the job after every batch; the job page polls it.
+
+Jobs run in the in-process task pool, which does not survive a restart.
+Every progress update also refreshes the job's ostatni_postep heartbeat; a
+job silent for FOLDER_DELETE_STALE_AFTER seconds has lost its worker and is
+resumed - by get_active_job() and the job page when someone looks at it, and
+by the resume_folder_deletions management command. Resuming is safe because
+both steps work from what is left of the subtree, not from stored state.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.db.models.functions import Length
+from django.utils import timezone
+
+from . import access
+from .models import Document, Folder, FolderDeletionJob
+from .tasks import run_in_background
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = (FolderDeletionJob.STATUS_PENDING, FolderDeletionJob.STATUS_RUNNING)
+
+
+def get_batch_size():
+    return getattr(settings, 'FOLDER_DELETE_BATCH_SIZE', 200)
+
+
+def get_stale_cutoff(now=None):
+    """Jobs without progress since this moment lost their worker."""
+    return (now or timezone.now()) - timedelta(seconds=getattr(settings, 'FOLDER_DELETE_STALE_AFTER', 600))
+
+
+def get_active_job(folder):
+    """Unfinished deletion job of the folder, if any - resumed in the background when stale."""
+    job = FolderDeletionJob.objects.filter(folder=folder, status__in=ACTIVE_STATUSES).first()
+    if job is not None:
+        resume_if_stale(job)
+    return job
+
+
+def claim_stale_job(job, now=None):
+    """Take over a stale job; False when it is alive or another process took it first."""
+    now = now or timezone.now()
+    if job.is_finished or job.ostatni_postep >= get_stale_cutoff(now):
+        return False
+    # The heartbeat doubles as a lock: only one process moves it from the value it read
+    claimed = FolderDeletionJob.objects.filter(
+        pk=job.pk, status__in=ACTIVE_STATUSES, ostatni_postep=job.ostatni_postep,
+    ).update(ostatni_postep=now)
+    if claimed:
+        job.ostatni_postep = now
+        logger.warning("Wznawianie przerwanego usuwania folderu %s (zadanie %s)", job.nazwa_folderu, job.pk)
+    return bool(claimed)
+
+
+def resume_if_stale(job):
+    """Restart a stale job in the background. Returns True when it was restarted."""
+    if not claim_stale_job(job):
+        return False
+    transaction.on_commit(lambda: run_in_background(run_folder_deletion, job.pk))
+    return True
+
+
+def resume_stale_jobs():
+    """Run every stale job to the end in this process. Returns the resumed jobs."""
+    resumed = []
+    for job in FolderDeletionJob.objects.filter(status__in=ACTIVE_STATUSES, ostatni_postep__lt=get_stale_cutoff()):
+        if claim_stale_job(job):
+            resumed.append(run_folder_deletion(job.pk))
+    return resumed
+
+
+def start_folder_deletion(folder, user):
+    """Create a deletion job for folder and its subtree, started when the transaction commits."""
+    subtree = Folder.objects.subtree(folder.sciezka)
+    job = FolderDeletionJob.objects.create(
+        folder=folder,
+        nazwa_folderu=folder.nazwa,
+        sciezka=folder.sciezka,
+        rodzic_id=folder.rodzic_id,
+        uzytkownik=user,
+        liczba_folderow=subtree.count(),
+        liczba_dokumentow=Document.objects.filter(folder__in=subtree).count(),
+    )
+    transaction.on_commit(lambda: run_in_background(run_folder_deletion, job.pk))
+    return job
+
+
+def _record_progress(job, **changes):
+    changes['ostatni_postep'] = timezone.now()
+    for field, value in changes.items():
+        setattr(job, field, value)
+    FolderDeletionJob.objects.filter(pk=job.pk).update(**changes)
+
+
+def run_folder_deletion(job_id, batch_size=None):
+    """Process a deletion job to the end. Returns the job."""
+    job = FolderDeletionJob.objects.select_related('uzytkownik').get(pk=job_id)
+    if job.is_finished:
+        return job
+    batch_size = batch_size or get_batch_size()
+    _record_progress(job, status=FolderDeletionJob.STATUS_RUNNING)
+    try:
+        if not job.sciezka.startswith('/'): # An empty path would select every folder
+            raise ValueError(f"Nieprawidłowa ścieżka folderu: {job.sciezka!r}")
+        _trash_documents(job, batch_size)
+        _delete_folders(job, batch_size)
+    except Exception as e:
+        logger.exception("Usuwanie folderu %s (zadanie %s) nie powiodło się", job.nazwa_folderu, job.pk)
+        _record_progress(job, status=FolderDeletionJob.STATUS_FAILED, blad=str(e), data_zakonczenia=timezone.now())
+        return job
+    _record_progress(job, status=FolderDeletionJob.STATUS_DONE, data_zakonczenia=timezone.now())
+    return job
+
+
+def _folder_paths(folder_ids, names):
+    """{folder id: 'Projekty / 2024 / Umowy'}; names caches folder names between batches."""
+    paths = dict(Folder.objects.filter(pk__in=folder_ids).values_list('pk', 'sciezka'))
+    path_ids = {pk: [int(part) for part in path.strip('/').split('/') if part] for pk, path in paths.items()}
+    missing = {pk for ids in path_ids.values() for pk in ids} - set(names)
+    names.update(Folder.objects.filter(pk__in=missing).values_list('pk', 'nazwa'))
+    return {pk: ' / '.join(names.get(part, '?') for part in ids) for pk, ids in path_ids.items()}
+
+
+def _trash_documents(job, batch_size):
+    documents = Document.objects.filter(folder__in=Folder.objects.subtree(job.sciezka))
+    names = {}
+    while True:
+        with transaction.atomic():
+            rows = list(documents.order_by('pk').values_list('pk', 'folder_id')[:batch_size])
+            if not rows:
+                return
+            document_ids = [pk for pk, _ in rows]
+            paths = _folder_paths({folder_id for _, folder_id in rows}, names)
+            batch = Document.objects.filter(pk__in=document_ids)
+            batch.soft_delete(job.uzytkownik)
+            # Documents already in the trash are detached as well; all remember where they were
+            batch.update(folder=None, lokalizacja_przed_usunieciem=Case(
+                *[When(folder_id=folder_id, then=Value(path)) for folder_id, path in paths.items()], default=Value(''),
+            ))
+        _record_progress(job, usuniete_dokumenty=job.usuniete_dokumenty + len(document_ids))
+
+
+def _delete_folders(job, batch_size):
+    from guardian.utils import get_group_obj_perms_model, get_user_obj_perms_model
+
+    content_type = ContentType.objects.get_for_model(Folder)
+    # Subfolders have longer paths, so deepest first every batch holds only leaves (or whole branches)
+    folders = Folder.objects.subtree(job.sciezka).annotate(glebokosc=Length('sciezka')).order_by('-glebokosc', 'pk')
+    while True:
+        with transaction.atomic(), access.batch_sync():
+            folder_ids = list(folders.values_list('pk', flat=True)[:batch_size])
+            if not folder_ids:
+                return
+            object_pks = [str(folder_id) for folder_id in folder_ids]
+            for model in (get_user_obj_perms_model(), get_group_obj_perms_model()):
+                model.objects.filter(content_type=content_type, object_pk__in=object_pks).delete()
+            Folder.objects.filter(pk__in=folder_ids).delete()
+        _record_progress(job, usuniete_foldery=job.usuniete_foldery + len(folder_ids))
@@ -1,11 +1,40 @@
 from django import forms
 from django.core.validators import FileExtensionValidator
 from django.core.exceptions import ValidationError
-from .models import Document, Folder, Tag, Comment
+from .models import Document, Folder, Tag, Comment, UploadSession
+from .settings_cache import format_size
+from .uploadhandlers import file_content_type, validate_content_type
 import os
 
 
-class DocumentUploadForm(forms.ModelForm):
+class ChunkedUploadFormMixin:
+    """
+    Lets the file come from a finished chunked upload (documents.chunked_uploads): the page
+    sends the file in chunks first and then posts only the session id in przeslanie.
+    """
+
+    def _accept_chunked_upload(self, user):
+        self.upload_user = user
+        self.fields['przeslanie'] = forms.IntegerField(required=False, widget=forms.HiddenInput(attrs={'id': 'upload-session-input'}))
+        if self.data.get('przeslanie'):
+            self.fields['plik'].required = False
+
+    def has_chunked_upload(self):
+        return bool(self.data.get('przeslanie'))
+
+    def clean_przeslanie(self):
+        session_id = self.cleaned_data.get('przeslanie')
+        if not session_id:
+            return None
+        session = UploadSession.objects.filter(
+            pk=session_id, uzytkownik=self.upload_user, status=UploadSession.STATUS_READY
+        ).first() if self.upload_user else None
+        if session is None:
+            raise ValidationError("Przesyłanie pliku nie zostało ukończone lub wygasło. Wyślij plik ponownie.")
+        return session
+
+
+class DocumentUploadForm(ChunkedUploadFormMixin, forms.ModelForm):
     """Enhanced form for document upload with file handling"""
     
     plik = forms.FileField(
@@ -54,6 +83,7 @@ class DocumentUploadForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
+        self._accept_chunked_upload(user)
         
         if user:
             # Show only folders owned by user or with permissions
@@ -69,14 +99,16 @@ class DocumentUploadForm(forms.ModelForm):
     def clean_plik(self):
         """Validate uploaded file"""
         plik = self.cleaned_data.get('plik')
+        if not plik and self.has_chunked_upload():
+            return None # Validated when the upload session was created
         
         if not plik:
             raise ValidationError("Musisz wybrać plik do wgrania.")
         
-        # Check file size (50MB limit)
-        max_size = 50 * 1024 * 1024  # 50MB
+        # Check file size (MAX_UPLOAD_SIZE system setting, 50MB by default)
+        max_size = Document.get_max_file_size()
         if plik.size > max_size:
-            raise ValidationError(f"Plik jest za duży! Maksymalny rozmiar to 50MB. Twój plik ma {plik.size / 1024 / 1024:.1f}MB.")
+            raise ValidationError(f"Plik jest za duży! Maksymalny rozmiar to {format_size(max_size)}. Twój plik ma {plik.size / 1024 / 1024:.1f}MB.")
         
         # Check file extension
         allowed_extensions = ['pdf', 'docx', 'doc', 'xlsx', 'xls', 'txt', 'png', 'jpg', 'jpeg']
@@ -90,6 +122,7 @@ class DocumentUploadForm(forms.ModelForm):
         if ext in dangerous_extensions:
             raise ValidationError("Ze względów bezpieczeństwa, ten typ pliku nie jest dozwolony.")
         
+        validate_content_type(plik.name, file_content_type(plik))
         return plik
     
     def clean_nazwa(self):
@@ -117,10 +150,13 @@ class DocumentUploadForm(forms.ModelForm):
         cleaned_data = super().clean()
         plik = cleaned_data.get('plik')
         nazwa = cleaned_data.get('nazwa')
+        upload = cleaned_data.get('przeslanie')
         
         # If no name provided, set it from filename
         if plik and not nazwa:
             cleaned_data['nazwa'] = os.path.basename(plik.name)
+        elif upload and not nazwa:
+            cleaned_data['nazwa'] = upload.nazwa_pliku
         
         return cleaned_data
 
@@ -150,7 +186,7 @@ class DocumentUpdateForm(forms.ModelForm):
                 self.fields['folder'].queryset = Folder.objects.filter(wlasciciel=user)
 
 
-class DocumentVersionUploadForm(forms.Form):
+class DocumentVersionUploadForm(ChunkedUploadFormMixin, forms.Form):
     """Form for uploading new version of existing document"""
     
     plik = forms.FileField(
@@ -174,21 +210,86 @@ class DocumentVersionUploadForm(forms.Form):
         })
     )
     
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user', None)
+        super().__init__(*args, **kwargs)
+        self._accept_chunked_upload(user)
+
     def clean_plik(self):
         """Validate uploaded file"""
         plik = self.cleaned_data.get('plik')
+        if not plik and self.has_chunked_upload():
+            return None
         
         if not plik:
             raise ValidationError("Musisz wybrać plik.")
         
         # Check file size
-        max_size = 50 * 1024 * 1024  # 50MB
+        max_size = Document.get_max_file_size()
         if plik.size > max_size:
-            raise ValidationError("Plik jest za duży! Maksymalny rozmiar to 50MB.")
+            raise ValidationError(f"Plik jest za duży! Maksymalny rozmiar to {format_size(max_size)}.")
         
+        validate_content_type(plik.name, file_content_type(plik))
         return plik
 
 
+class MultipleFileInput(forms.FileInput):
+    allow_multiple_selected = True
+
+    def __init__(self, attrs=None):
+        super().__init__({**(attrs or {}), 'multiple': True})
+
+    def value_from_datadict(self, data, files, name):
+        return files.getlist(name)
+
+
+class MultipleFileField(forms.FileField):
+    """FileField accepting several files; cleans to a list"""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('widget', MultipleFileInput())
+        super().__init__(*args, **kwargs)
+
+    def clean(self, data, initial=None):
+        single_clean = super().clean
+        if isinstance(data, (list, tuple)):
+            return [single_clean(item, initial) for item in data]
+        return [single_clean(data, initial)] if data else single_clean(data, initial)
+
+
+class BatchUploadForm(forms.Form):
+    """Many files (or ZIP archives) uploaded as documents in one go, see documents.batch_upload"""
+
+    pliki = MultipleFileField(
+        label='Pliki',
+        widget=MultipleFileInput(attrs={
+            'class': 'form-control',
+            'accept': '.pdf,.docx,.doc,.xlsx,.xls,.txt,.png,.jpg,.jpeg,.zip',
+        }),
+        help_text="Wybierz wiele plików naraz lub archiwum ZIP - zostanie rozpakowane."
+    )
+    folder = forms.ModelChoiceField(
+        label='Folder', queryset=Folder.objects.none(), required=False,
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    tagi = forms.ModelMultipleChoiceField(
+        label='Tagi', queryset=Tag.objects.all(), required=False, widget=forms.CheckboxSelectMultiple()
+    )
+    status = forms.ChoiceField(
+        label='Status', choices=Document.STATUS_CHOICES, initial='draft',
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+
+    def __init__(self, *args, **kwargs):
+        user = kwargs.pop('user', None)
+        super().__init__(*args, **kwargs)
+        # The same folders as in DocumentUploadForm
+        if user and (user.is_superuser or (hasattr(user, 'profile') and user.profile.is_admin)):
+            self.fields['folder'].queryset = Folder.objects.all()
+        elif user:
+            self.fields['folder'].queryset = Folder.objects.filter(wlasciciel=user)
+
+
 class FolderCreateForm(forms.ModelForm):
     class Meta:
         model = Folder
@@ -372,24 +473,12 @@ class FolderUpdateForm(forms.ModelForm):
                 queryset = Folder.objects.filter(wlasciciel=user)
             
             # Exclude current folder and its descendants to prevent circular references
-            if instance:
-                descendants = self._get_descendants(instance)
-                exclude_ids = [instance.id] + list(descendants.values_list('id', flat=True))
-                queryset = queryset.exclude(id__in=exclude_ids)
+            if instance and instance.pk:
+                queryset = queryset.exclude(id__in=Folder.objects.subtree(instance.sciezka).values('id'))
             
             self.fields['rodzic'].queryset = queryset
             self.fields['rodzic'].empty_label = "Folder główny"
     
-    def _get_descendants(self, folder):
-        """Get all descendants of a folder to prevent circular references"""
-        descendants = Folder.objects.filter(rodzic=folder)
-        all_descendants = descendants
-        
-        for descendant in descendants:
-            all_descendants = all_descendants | self._get_descendants(descendant)
-        
-        return all_descendants
-    
     def clean_nazwa(self):
         """Validate folder name"""
         nazwa = self.cleaned_data.get('nazwa', '').strip()
@@ -452,9 +541,7 @@ class FolderDeleteForm(forms.Form):
                 queryset = Folder.objects.filter(wlasciciel=user)
             
             # Exclude the folder being deleted and its descendants
-            descendants = self._get_descendants(folder_to_delete)
-            exclude_ids = [folder_to_delete.id] + list(descendants.values_list('id', flat=True))
-            queryset = queryset.exclude(id__in=exclude_ids)
+            queryset = queryset.exclude(id__in=Folder.objects.subtree(folder_to_delete.sciezka).values('id'))
             
             self.fields['target_folder'].queryset = queryset
             
@@ -466,16 +553,6 @@ class FolderDeleteForm(forms.Form):
                 ]
                 self.fields['action'].initial = 'move_to_folder'
     
-    def _get_descendants(self, folder):
-        """Get all descendants of a folder"""
-        descendants = Folder.objects.filter(rodzic=folder)
-        all_descendants = descendants
-        
-        for descendant in descendants:
-            all_descendants = all_descendants | self._get_descendants(descendant)
-        
-        return all_descendants
-    
     def clean(self):
         cleaned_data = super().clean()
         action = cleaned_data.get('action')
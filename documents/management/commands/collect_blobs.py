@@ -0,0 +1,48 @@
+# documents/management/commands/collect_blobs.py
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from documents.blobs import GARBAGE_GRACE_PERIOD, collect_garbage, rebuild_reference_counts
+
+
+class Command(BaseCommand):
+    help = 'Delete stored files no longer referenced by any document or version'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recount',
+            action='store_true',
+            help='Recount references from the database first (registers files stored before the blob store)',
+        )
+        parser.add_argument(
+            '--grace-minutes',
+            type=int,
+            default=int(GARBAGE_GRACE_PERIOD.total_seconds() // 60),
+            help='Only delete files unreferenced for at least this many minutes',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Files deleted from storage in parallel',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only list files that would be deleted',
+        )
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.stdout.write('Przeliczanie odwołań do plików...')
+            rebuild_reference_counts()
+
+        deleted = collect_garbage(timedelta(minutes=options['grace_minutes']), dry_run=options['dry_run'], workers=options['workers'])
+        for blob in deleted:
+            self.stdout.write(f'  {blob.nazwa} ({blob.rozmiar} B)')
+
+        verb = 'Do usunięcia' if options['dry_run'] else 'Usunięto'
+        freed = sum(blob.rozmiar for blob in deleted)
+        self.stdout.write(self.style.SUCCESS(f'{verb} plików: {len(deleted)} ({freed} B)'))
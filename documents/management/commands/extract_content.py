@@ -0,0 +1,33 @@
+# documents/management/commands/extract_content.py
+
+from django.core.management.base import BaseCommand
+
+from documents.extraction import extract_document_content
+from documents.models import Document
+
+
+class Command(BaseCommand):
+    help = 'Extract text of document files for full-text search (skips files already processed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--document',
+            type=int,
+            action='append',
+            help='Only the document with this id (can be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        documents = Document.objects.exclude(plik='').exclude(plik__isnull=True)
+        if options.get('document'):
+            documents = documents.filter(pk__in=options['document'])
+
+        self.stdout.write('Ekstrakcja treści dokumentów...')
+        counts = {}
+        for document_id in documents.values_list('pk', flat=True).iterator():
+            content = extract_document_content(document_id)
+            status = content.status if content else 'skipped'
+            counts[status] = counts.get(status, 0) + 1
+
+        summary = ', '.join(f'{status}: {count}' for status, count in sorted(counts.items())) or 'brak dokumentów'
+        self.stdout.write(self.style.SUCCESS(f'Zakończono ({summary})'))
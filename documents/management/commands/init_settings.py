@@ -32,6 +32,24 @@ class Command(BaseCommand):
                 'value': 'Document Manager - System Zarządzania Dokumentami',
                 'description': 'Tytuł systemu wyświetlany w przeglądarce',
                 'category': 'general'
+            },
+            {
+                'key': 'MAX_UPLOAD_SIZE',
+                'value': '50MB',
+                'description': 'Maksymalny rozmiar wgrywanego pliku (np. 50MB, 512KB)',
+                'category': 'uploads'
+            },
+            {
+                'key': 'MAX_CHUNKED_UPLOAD_SIZE',
+                'value': '4GB',
+                'description': 'Maksymalny rozmiar pliku wgrywanego we fragmentach ze strony (np. 4GB, 500MB)',
+                'category': 'uploads'
+            },
+            {
+                'key': 'TRASH_RETENTION_DAYS',
+                'value': '30',
+                'description': 'Liczba dni, po których dokumenty z kosza są trwale usuwane (purge_trash)',
+                'category': 'storage'
             }
         ]
         
@@ -40,27 +58,27 @@ class Command(BaseCommand):
         
         for setting_data in default_settings:
             setting, created = SystemSettings.objects.get_or_create(
-                key=setting_data['key'],
+                klucz=setting_data['key'],
                 defaults={
-                    'value': setting_data['value'],
-                    'description': setting_data['description'],
-                    'category': setting_data['category']
+                    'wartosc': setting_data['value'],
+                    'opis': setting_data['description'],
+                    'kategoria': setting_data['category']
                 }
             )
             
             if created:
                 created_count += 1
-                self.stdout.write(f'✓ Utworzono: {setting.key} = {setting.value}')
+                self.stdout.write(f'✓ Utworzono: {setting.klucz} = {setting.wartosc}')
             else:
                 # Update description if empty
-                if not setting.description and setting_data['description']:
-                    setting.description = setting_data['description']
-                    setting.category = setting_data['category']
+                if not setting.opis and setting_data['description']:
+                    setting.opis = setting_data['description']
+                    setting.kategoria = setting_data['category']
                     setting.save()
                     updated_count += 1
-                    self.stdout.write(f'↻ Zaktualizowano opis: {setting.key}')
+                    self.stdout.write(f'↻ Zaktualizowano opis: {setting.klucz}')
                 else:
-                    self.stdout.write(f'- Już istnieje: {setting.key} = {setting.value}')
+                    self.stdout.write(f'- Już istnieje: {setting.klucz} = {setting.wartosc}')
         
         self.stdout.write(
             self.style.SUCCESS(
@@ -72,8 +90,8 @@ class Command(BaseCommand):
         
         if created_count > 0 or updated_count > 0:
             self.stdout.write('\n📋 Dostępne ustawienia:')
-            for setting in SystemSettings.objects.all().order_by('category', 'key'):
-                self.stdout.write(f'   {setting.category}/{setting.key}: {setting.value}')
+            for setting in SystemSettings.objects.all().order_by('kategoria', 'klucz'):
+                self.stdout.write(f'   {setting.kategoria}/{setting.klucz}: {setting.wartosc}')
             
             self.stdout.write(f'\n🔧 Możesz je edytować w: /admin/documents/systemsettings/')
         
@@ -0,0 +1,57 @@
+# documents/management/commands/purge_trash.py
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from documents.blobs import GARBAGE_GRACE_PERIOD
+from documents.models import Document
+from documents.trash import PURGE_BATCH_SIZE, PURGE_WORKERS, purge_expired
+
+
+class Command(BaseCommand):
+    help = ('Permanently delete documents kept in the trash longer than TRASH_RETENTION_DAYS, finish purges '
+            'interrupted by a restart and free their files')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=PURGE_BATCH_SIZE,
+            help='Documents deleted per transaction',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=PURGE_WORKERS,
+            help='Files deleted from storage in parallel',
+        )
+        parser.add_argument(
+            '--grace-minutes',
+            type=int,
+            default=int(GARBAGE_GRACE_PERIOD.total_seconds() // 60),
+            help='Only delete files unreferenced for at least this many minutes',
+        )
+        parser.add_argument(
+            '--no-collect',
+            action='store_true',
+            help='Only delete documents, leave unreferenced files to collect_blobs',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only count what would be deleted',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Okres przechowywania w koszu: {Document.get_trash_retention_days()} dni')
+        purged, blobs = purge_expired(
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            dry_run=options['dry_run'],
+            collect=not options['no_collect'],
+            grace_period=timedelta(minutes=options['grace_minutes']),
+        )
+        verb = 'Do usunięcia' if options['dry_run'] else 'Usunięto'
+        freed = sum(blob.rozmiar for blob in blobs)
+        self.stdout.write(self.style.SUCCESS(f'{verb} dokumentów: {purged}, plików: {len(blobs)} ({freed} B)'))
@@ -0,0 +1,13 @@
+# documents/management/commands/purge_uploads.py
+
+from django.core.management.base import BaseCommand
+
+from documents.chunked_uploads import purge_expired_sessions
+
+
+class Command(BaseCommand):
+    help = 'Delete chunked uploads left unfinished for longer than UPLOAD_SESSION_EXPIRY_HOURS, with their partial files'
+
+    def handle(self, *args, **options):
+        purged = purge_expired_sessions()
+        self.stdout.write(self.style.SUCCESS(f'Usunięto wygasłych sesji przesyłania: {purged}'))
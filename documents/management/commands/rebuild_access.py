@@ -0,0 +1,17 @@
+# documents/management/commands/rebuild_access.py
+
+from django.core.management.base import BaseCommand
+
+from documents.access import rebuild_access
+from documents.models import ObjectAccess
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized access table from owners and guardian permissions'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Przebudowa tabeli dostępów...')
+        rebuild_access()
+        self.stdout.write(
+            self.style.SUCCESS(f'Wpisów dostępu: {ObjectAccess.objects.count()}')
+        )
@@ -0,0 +1,18 @@
+# documents/management/commands/rebuild_search_index.py
+
+from django.core.management.base import BaseCommand
+
+from documents.models import Document
+from documents.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of documents'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        self.stdout.write(f'Przebudowa indeksu wyszukiwania ({backend.__class__.__name__})...')
+        backend.rebuild()
+        self.stdout.write(
+            self.style.SUCCESS(f'Zaindeksowano dokumentów: {Document.objects.count()}')
+        )
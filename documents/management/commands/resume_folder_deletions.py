@@ -0,0 +1,15 @@
+# documents/management/commands/resume_folder_deletions.py
+
+from django.core.management.base import BaseCommand
+
+from documents.folder_deletion import resume_stale_jobs
+
+
+class Command(BaseCommand):
+    help = ('Finish folder deletions whose background job stopped (e.g. with a restart) '
+            'and made no progress for FOLDER_DELETE_STALE_AFTER seconds')
+
+    def handle(self, *args, **options):
+        for job in resume_stale_jobs():
+            self.stdout.write(f'{job}: {job.usuniete_foldery} folderów, {job.usuniete_dokumenty} dokumentów')
+        self.stdout.write(self.style.SUCCESS('Zakończono wznawianie zadań usuwania folderów'))
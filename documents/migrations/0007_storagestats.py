@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-18 20:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('documents', '0006_alter_activitylog_options_alter_document_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('liczba_dokumentow', models.IntegerField(default=0)),
+                ('liczba_folderow', models.IntegerField(default=0)),
+                ('rozmiar_calkowity', models.BigIntegerField(default=0)),
+                ('data_modyfikacji', models.DateTimeField(auto_now=True)),
+                ('uzytkownik', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='storage_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Statystyki przechowywania',
+                'verbose_name_plural': 'Statystyki przechowywania',
+                'db_table': 'statystyki_przechowywania',
+            },
+        ),
+        migrations.AlterField(
+            model_name='folder',
+            name='tagi',
+            field=models.ManyToManyField(blank=True, related_name='folders', to='documents.tag', verbose_name='Tagi'),
+        ),
+        migrations.DeleteModel(
+            name='DocumentTag',
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+def populate_folder_paths(apps, schema_editor):
+    """Build materialized paths for existing folders, parents before children"""
+    Folder = apps.get_model('documents', 'Folder')
+    children = {}
+    for folder_id, parent_id in Folder.objects.values_list('id', 'rodzic_id'):
+        children.setdefault(parent_id, []).append(folder_id)
+
+    paths = {}
+    pending = [(folder_id, '/') for folder_id in children.get(None, [])]
+    while pending:
+        folder_id, parent_path = pending.pop()
+        paths[folder_id] = f"{parent_path}{folder_id}/"
+        pending.extend((child_id, paths[folder_id]) for child_id in children.get(folder_id, []))
+
+    for folder_id, path in paths.items():
+        Folder.objects.filter(pk=folder_id).update(sciezka=path)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_storagestats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='sciezka',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_folder_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 4.2 on 2026-10-18 20:40
+
+from django.db import migrations
+from django.db.utils import OperationalError
+
+CREATE_INDEX = """
+CREATE VIRTUAL TABLE IF NOT EXISTS dokument_fts USING fts5(
+    nazwa, opis, tagi, metadane, komentarze,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+# unicode61 strips diacritics by decomposing characters; ł has no decomposition
+FOLD = "replace(replace({}, 'ł', 'l'), 'Ł', 'L')"
+
+POPULATE_INDEX = """
+INSERT INTO dokument_fts (rowid, nazwa, opis, tagi, metadane, komentarze)
+SELECT d.id, {}, {}, {}, {}, {}
+FROM dokument d
+""".format(
+    FOLD.format("d.nazwa"),
+    FOLD.format("COALESCE(d.opis, '')"),
+    FOLD.format("""COALESCE((SELECT group_concat(t.nazwa, ' ') FROM dokument_tagi dt
+                 JOIN tag t ON t.id = dt.tag_id WHERE dt.document_id = d.id), '')"""),
+    FOLD.format("""COALESCE((SELECT group_concat(m.klucz || ' ' || m.wartosc, ' ') FROM metadane m
+                 WHERE m.dokument_id = d.id), '')"""),
+    FOLD.format("""COALESCE((SELECT group_concat(c.tresc, ' ') FROM documents_comment c
+                 WHERE c.dokument_id = d.id AND c.aktywny), '')"""),
+)
+
+
+def create_search_index(apps, schema_editor):
+    """FTS5 index is SQLite only; other engines use the icontains backend"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(CREATE_INDEX)
+    except OperationalError: # SQLite built without FTS5
+        return
+    schema_editor.execute(POPULATE_INDEX)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS dokument_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0008_folder_sciezka'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
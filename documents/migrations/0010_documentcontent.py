@@ -0,0 +1,70 @@
+# Generated by Django 4.2 on 2026-10-18 20:20
+
+from django.db import migrations, models
+from django.db.utils import OperationalError
+import django.db.models.deletion
+
+COLUMNS = 'nazwa, opis, tagi, metadane, komentarze'
+
+CREATE_INDEX = """
+CREATE VIRTUAL TABLE dokument_fts USING fts5(
+    {columns},
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+)
+"""
+
+
+def rebuild_index_table(schema_editor, old_columns, new_columns):
+    """FTS5 tables cannot be altered - copy rows into a table with the new columns"""
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite' or 'dokument_fts' not in connection.introspection.table_names():
+        return
+    copied = ', '.join(column if column in old_columns.split(', ') else "''" for column in new_columns.split(', '))
+    schema_editor.execute('ALTER TABLE dokument_fts RENAME TO dokument_fts_old')
+    schema_editor.execute(CREATE_INDEX.format(columns=new_columns))
+    schema_editor.execute(
+        f'INSERT INTO dokument_fts (rowid, {new_columns}) SELECT rowid, {copied} FROM dokument_fts_old'
+    )
+    schema_editor.execute('DROP TABLE dokument_fts_old')
+
+
+def add_content_column(apps, schema_editor):
+    try:
+        rebuild_index_table(schema_editor, COLUMNS, COLUMNS + ', tresc')
+    except OperationalError: # SQLite built without FTS5
+        pass
+
+
+def remove_content_column(apps, schema_editor):
+    rebuild_index_table(schema_editor, COLUMNS + ', tresc', COLUMNS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0009_dokument_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentContent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hash_pliku', models.CharField(db_index=True, max_length=64)),
+                ('tekst', models.TextField(blank=True)),
+                ('status', models.CharField(choices=[('pending', 'Oczekuje'), ('done', 'Wyodrębniono'), ('unsupported', 'Nieobsługiwany format'), ('failed', 'Błąd')], default='pending', max_length=20)),
+                ('blad', models.TextField(blank=True)),
+                ('data_ekstrakcji', models.DateTimeField(auto_now=True)),
+                ('dokument', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tresci', to='documents.document')),
+                ('wersja', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='tresci', to='documents.documentversion')),
+            ],
+            options={
+                'verbose_name': 'Treść dokumentu',
+                'verbose_name_plural': 'Treści dokumentów',
+                'db_table': 'tresc_dokumentu',
+                'unique_together': {('dokument', 'wersja')},
+            },
+        ),
+        migrations.RunPython(add_content_column, remove_content_column),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2 on 2026-10-18 20:24
+
+import django.core.validators
+from django.db import migrations, models
+import documents.blobs
+
+
+def register_stored_files(apps, schema_editor):
+    """Create reference-counted FileBlob rows for files uploaded before the blob store"""
+    FileBlob = apps.get_model('documents', 'FileBlob')
+    blobs = {}
+    for model_name in ('Document', 'DocumentVersion'):
+        model = apps.get_model('documents', model_name)
+        rows = model.objects.exclude(plik='').exclude(plik__isnull=True).values_list('plik', 'hash_pliku', 'rozmiar_pliku')
+        for name, file_hash, size in rows:
+            blob = blobs.setdefault(name, FileBlob(nazwa=name, hash_pliku=file_hash or '', rozmiar=size or 0))
+            blob.liczba_odwolan += 1
+    FileBlob.objects.bulk_create(blobs.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0011_typ_mime'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nazwa', models.CharField(help_text='Nazwa pliku w magazynie', max_length=255, unique=True)),
+                ('hash_pliku', models.CharField(blank=True, db_index=True, max_length=64)),
+                ('rozmiar', models.BigIntegerField(default=0)),
+                ('liczba_odwolan', models.PositiveIntegerField(default=0)),
+                ('data_utworzenia', models.DateTimeField(auto_now_add=True)),
+                ('data_modyfikacji', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Plik w magazynie',
+                'verbose_name_plural': 'Pliki w magazynie',
+                'db_table': 'blob_pliku',
+            },
+        ),
+        migrations.AlterField(
+            model_name='document',
+            name='plik',
+            field=models.FileField(blank=True, help_text='Obsługiwane formaty: PDF, DOCX, DOC, XLSX, XLS, TXT, PNG, JPG, JPEG', null=True, storage=documents.blobs.get_blob_storage, upload_to=documents.blobs.blob_upload_path, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['pdf', 'docx', 'doc', 'xlsx', 'xls', 'txt', 'png', 'jpg', 'jpeg'])]),
+        ),
+        migrations.AlterField(
+            model_name='documentversion',
+            name='plik',
+            field=models.FileField(blank=True, null=True, storage=documents.blobs.get_blob_storage, upload_to=documents.blobs.blob_upload_path),
+        ),
+        migrations.RunPython(register_stored_files, migrations.RunPython.noop),
+    ]
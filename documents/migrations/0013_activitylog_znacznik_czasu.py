@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-18 20:27
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0012_fileblob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activitylog',
+            name='znacznik_czasu',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
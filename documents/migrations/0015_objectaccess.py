@@ -0,0 +1,85 @@
+# Generated by Django 4.2 on 2026-10-18 20:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import documents.models
+
+OWNER, BROWSE = 1 << 15, 1
+PERMISSION_BITS = {
+    'document': {'browse_document': 1, 'change_document': 2, 'delete_document': 4,
+                 'share_document': 8, 'download_document': 16, 'comment_document': 32},
+    'folder': {'browse_folder': 1, 'change_folder': 2, 'delete_folder': 4,
+               'add_document_to_folder': 8, 'add_subfolder_to_folder': 16},
+}
+
+
+def fill_access_table(apps, schema_editor):
+    """Access rows for existing owners and guardian permissions (same rules as documents.access)"""
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    UserObjectPermission = apps.get_model('guardian', 'UserObjectPermission')
+    GroupObjectPermission = apps.get_model('guardian', 'GroupObjectPermission')
+    ObjectAccess = apps.get_model('documents', 'ObjectAccess')
+
+    for model_name, field in (('document', 'dokument'), ('folder', 'folder')):
+        model = apps.get_model('documents', model_name)
+        bits = PERMISSION_BITS[model_name]
+        masks = {}
+        owners = dict(model.objects.values_list('pk', 'wlasciciel_id'))
+        for object_id, owner_id in owners.items():
+            masks[(owner_id, object_id)] = OWNER | BROWSE
+        ctype = ContentType.objects.filter(app_label='documents', model=model_name).first()
+        if ctype is not None:
+            filters = {'content_type': ctype, 'permission__codename__in': list(bits)}
+            rows = list(UserObjectPermission.objects.filter(**filters).values_list('user_id', 'object_pk', 'permission__codename'))
+            rows += GroupObjectPermission.objects.filter(group__user__isnull=False, **filters).values_list('group__user', 'object_pk', 'permission__codename')
+            for user_id, object_pk, codename in rows:
+                if object_pk.isdigit() and int(object_pk) in owners:
+                    key = (user_id, int(object_pk))
+                    masks[key] = masks.get(key, 0) | bits[codename]
+        ObjectAccess.objects.bulk_create(
+            [ObjectAccess(uzytkownik_id=user_id, uprawnienia=mask, **{f'{field}_id': object_id})
+             for (user_id, object_id), mask in masks.items()],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('documents', '0014_settingsversion'),
+        ('guardian', '0002_generic_permissions_index'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObjectAccess',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uprawnienia', documents.models.PermissionMaskField(default=0)),
+                ('dokument', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dostepy', to='documents.document')),
+                ('folder', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='dostepy', to='documents.folder')),
+                ('uzytkownik', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='dostepy', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Dostęp do obiektu',
+                'verbose_name_plural': 'Dostępy do obiektów',
+                'db_table': 'dostep_obiektu',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='objectaccess',
+            constraint=models.UniqueConstraint(fields=('uzytkownik', 'dokument'), name='dostep_uzytkownik_dokument'),
+        ),
+        migrations.AddConstraint(
+            model_name='objectaccess',
+            constraint=models.UniqueConstraint(fields=('uzytkownik', 'folder'), name='dostep_uzytkownik_folder'),
+        ),
+        migrations.AddConstraint(
+            model_name='objectaccess',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('dokument__isnull', False), ('folder__isnull', True)), models.Q(('dokument__isnull', True), ('folder__isnull', False)), _connector='OR'), name='dostep_dokument_albo_folder'),
+        ),
+        migrations.RunPython(fill_access_table, migrations.RunPython.noop),
+    ]
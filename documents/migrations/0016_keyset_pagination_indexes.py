@@ -0,0 +1,21 @@
+# Generated by Django 4.2 on 2026-10-18 20:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0015_objectaccess'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['znacznik_czasu', 'id'], name='log_znacznik_czasu_id'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['ostatnia_modyfikacja', 'id'], name='dokument_modyfikacja_id'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2 on 2026-10-18 20:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0016_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='document',
+            name='dokument_modyfikacja_id',
+        ),
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['typ_aktywnosci', 'znacznik_czasu', 'id'], name='log_typ_znacznik_czasu_id'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('aktywny', True), ('rodzic', None)), fields=['dokument', 'data_utworzenia'], name='komentarz_dokument_data'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('aktywny', True), ('rodzic__isnull', False)), fields=['rodzic', 'data_utworzenia'], name='komentarz_rodzic_data'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('usunieto', False)), fields=['ostatnia_modyfikacja', 'id'], name='dokument_modyfikacja_id'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('usunieto', False)), fields=['folder', 'nazwa'], name='dokument_folder_nazwa'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('usunieto', False)), fields=['wlasciciel', 'rozmiar_pliku'], name='dokument_wlasciciel_rozmiar'),
+        ),
+        migrations.AddIndex(
+            model_name='documentshare',
+            index=models.Index(condition=models.Q(('aktywne', True)), fields=['udostepnione_dla', 'data_wygasniecia'], name='udostepnienie_dla_wygasniecie'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['rodzic', 'nazwa'], name='folder_rodzic_nazwa'),
+        ),
+    ]
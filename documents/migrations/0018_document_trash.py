@@ -0,0 +1,41 @@
+# Generated by Django 4.2 on 2026-10-18 20:47
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def date_existing_trash(apps, schema_editor):
+    # Documents deleted before the trash existed start their retention at their last change
+    Document = apps.get_model('documents', 'Document')
+    Document.objects.filter(usunieto=True, data_usuniecia__isnull=True).update(data_usuniecia=models.F('ostatnia_modyfikacja'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('documents', '0017_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='data_usuniecia',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='usuniety_przez',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(date_existing_trash, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('usunieto', True)), fields=['data_usuniecia', 'id'], name='dokument_kosz'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(condition=models.Q(('usunieto', True)), fields=['wlasciciel', 'data_usuniecia', 'id'], name='dokument_kosz_wlasciciel'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2 on 2026-10-18 20:50
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('documents', '0018_document_trash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FolderDeletionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nazwa_folderu', models.CharField(max_length=255)),
+                ('sciezka', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('oczekuje', 'Oczekuje'), ('w_toku', 'W toku'), ('zakonczone', 'Zakończone'), ('blad', 'Błąd')], default='oczekuje', max_length=20)),
+                ('liczba_folderow', models.PositiveIntegerField(default=0)),
+                ('liczba_dokumentow', models.PositiveIntegerField(default=0)),
+                ('usuniete_foldery', models.PositiveIntegerField(default=0)),
+                ('usuniete_dokumenty', models.PositiveIntegerField(default=0)),
+                ('blad', models.TextField(blank=True)),
+                ('data_utworzenia', models.DateTimeField(auto_now_add=True)),
+                ('data_zakonczenia', models.DateTimeField(blank=True, null=True)),
+                ('folder', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='zadania_usuwania', to='documents.folder')),
+                ('rodzic', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='documents.folder')),
+                ('uzytkownik', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='zadania_usuwania_folderow', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Zadanie usuwania folderu',
+                'verbose_name_plural': 'Zadania usuwania folderów',
+                'db_table': 'zadanie_usuwania_folderu',
+                'ordering': ['-data_utworzenia'],
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-18 20:52
+
+from django.db import migrations, models
+
+
+def count_replies(apps, schema_editor):
+    Comment = apps.get_model('documents', 'Comment')
+    counts = (
+        Comment.objects.filter(aktywny=True, rodzic__isnull=False).order_by()
+        .values('rodzic').annotate(count=models.Count('pk')).values_list('rodzic', 'count')
+    )
+    for parent_id, count in counts:
+        Comment.objects.filter(pk=parent_id).update(liczba_odpowiedzi=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0019_folderdeletionjob'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='komentarz_dokument_data',
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='liczba_odpowiedzi',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Liczba odpowiedzi'),
+        ),
+        migrations.RunPython(count_replies, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(condition=models.Q(('aktywny', True)), fields=['dokument', 'data_utworzenia'], name='komentarz_dokument_data'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2 on 2026-10-18 20:58
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('documents', '0020_comment_reply_count'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='rozmiar_pliku',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='documentversion',
+            name='rozmiar_pliku',
+            field=models.PositiveBigIntegerField(blank=True, default=0, null=True),
+        ),
+        migrations.CreateModel(
+            name='UploadSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nazwa_pliku', models.CharField(max_length=255)),
+                ('rozmiar', models.PositiveBigIntegerField()),
+                ('przeslano', models.PositiveBigIntegerField(default=0)),
+                ('status', models.CharField(choices=[('przesylanie', 'Przesyłanie'), ('gotowe', 'Gotowe')], default='przesylanie', max_length=20)),
+                ('plik_czesciowy', models.CharField(max_length=255)),
+                ('plik', models.CharField(blank=True, max_length=255)),
+                ('hash_pliku', models.CharField(blank=True, max_length=64)),
+                ('typ_mime', models.CharField(blank=True, max_length=100)),
+                ('zapis_od', models.DateTimeField(blank=True, null=True)),
+                ('data_utworzenia', models.DateTimeField(auto_now_add=True)),
+                ('data_modyfikacji', models.DateTimeField(auto_now=True)),
+                ('data_wygasniecia', models.DateTimeField()),
+                ('uzytkownik', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sesje_przesylania', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Sesja przesyłania',
+                'verbose_name_plural': 'Sesje przesyłania',
+                'db_table': 'sesja_przesylania',
+                'ordering': ['-data_utworzenia'],
+            },
+        ),
+    ]
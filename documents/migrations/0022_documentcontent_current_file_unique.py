@@ -0,0 +1,30 @@
+# Generated by Django 4.2 on 2026-10-18 21:20
+
+from django.db import migrations, models
+
+
+def remove_duplicates(apps, schema_editor):
+    # Concurrent extractions could store the current file's text twice - keep the newest row
+    DocumentContent = apps.get_model('documents', 'DocumentContent')
+    duplicated = (
+        DocumentContent.objects.filter(wersja__isnull=True).order_by()
+        .values('dokument').annotate(count=models.Count('pk')).filter(count__gt=1).values_list('dokument', flat=True)
+    )
+    for document_id in list(duplicated):
+        rows = DocumentContent.objects.filter(dokument_id=document_id, wersja__isnull=True).order_by('-data_ekstrakcji', '-pk')
+        DocumentContent.objects.filter(pk__in=list(rows.values_list('pk', flat=True)[1:])).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0021_upload_session'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='documentcontent',
+            constraint=models.UniqueConstraint(condition=models.Q(('wersja__isnull', True)), fields=('dokument',), name='tresc_dokument_biezacy_plik'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2 on 2026-10-18 21:22
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+def remove_duplicate_global_rows(apps, schema_editor):
+    # Concurrent first reads could create the global row twice - keep the oldest, it is the one that was read
+    StorageStats = apps.get_model('documents', 'StorageStats')
+    rows = StorageStats.objects.filter(uzytkownik__isnull=True).order_by('pk')
+    StorageStats.objects.filter(pk__in=list(rows.values_list('pk', flat=True)[1:])).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0022_documentcontent_current_file_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_global_rows, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='storagestats',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Coalesce('uzytkownik', models.Value(0)), condition=models.Q(('uzytkownik__isnull', True)), name='statystyki_jeden_globalny'),
+        ),
+    ]
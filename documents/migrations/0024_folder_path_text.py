@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 21:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0023_storagestats_single_global_row'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='folder',
+            name='sciezka',
+            field=models.TextField(blank=True, db_index=True, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='folderdeletionjob',
+            name='sciezka',
+            field=models.TextField(),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 21:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0024_folder_path_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='do_usuniecia',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2 on 2026-10-18 21:56
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0025_document_purge_requested'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folderdeletionjob',
+            name='ostatni_postep',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
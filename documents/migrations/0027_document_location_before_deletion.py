@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 21:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0026_folder_deletion_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='lokalizacja_przed_usunieciem',
+            field=models.TextField(blank=True),
+        ),
+    ]
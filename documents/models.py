@@ -3,13 +3,19 @@ from django.contrib.auth.models import User # Direct import is fine if User is n
 from django.core.validators import FileExtensionValidator
 from django.core.exceptions import ValidationError
 from django.conf import settings
+from django.utils import timezone
+from django.db.models.functions import Coalesce, Concat, Substr
 import os
 import uuid
+from datetime import timedelta
 # Ensure users.models is loaded or use string references if circular dependency arises
 # For now, direct import is assumed to work based on your project structure.
 from users.models import Role, UserProfile
 
+from .blobs import blob_upload_path, get_blob_storage
 
+
+# Upload path used before the blob store (documents.blobs), still referenced by old migrations
 def document_upload_path(instance, filename):
     ext = filename.split('.')[-1]
     filename = f"{uuid.uuid4().hex}.{ext}"
@@ -19,6 +25,29 @@ def document_upload_path(instance, filename):
 
     return f"documents/{instance.wlasciciel.id}/{now.year}/{now.month:02d}/{filename}"
 
+class LoadedValuesMixin:
+    """Remember field values loaded from the database, to compute changes on save"""
+    TRACKED_FIELDS = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_loaded_values()
+        return instance
+
+    def remember_loaded_values(self):
+        self._loaded_values = {
+            # File fields are remembered by name - FieldFile objects change in place
+            name: getattr(self.__dict__[name], 'name', self.__dict__[name])
+            for name in self.TRACKED_FIELDS if name in self.__dict__
+        }
+
+    def load_stored_values(self):
+        """Remember the values stored in the database, for instances built by hand with a pk"""
+        stored = type(self)._base_manager.filter(pk=self.pk).values(*self.TRACKED_FIELDS).first()
+        self._loaded_values = stored or {}
+
+
 class Tag(models.Model):
     """Tags for document categorization"""
     nazwa = models.CharField(max_length=50, unique=True)
@@ -34,26 +63,109 @@ class Tag(models.Model):
         ordering = ['nazwa']
 
 
-class Folder(models.Model):
+class FolderQuerySet(models.QuerySet):
+    def accessible_by(self, user, bits=None):
+        """Folders user has access to (browse by default) - one join with the access table"""
+        bits = ObjectAccess.BROWSE if bits is None else bits
+        return self.filter(dostepy__uzytkownik=user, dostepy__uprawnienia__hasbits=bits)
+
+    def subtree(self, path):
+        """Folders whose materialized path starts with path (the folder itself and all descendants)"""
+        # Paths contain only digits and '/', so every path below '/1/5/' sorts between
+        # '/1/5/' and '/1/50' ('0' follows '/'). A range scan uses the sciezka index,
+        # unlike LIKE 'prefix%' on SQLite.
+        return self.filter(sciezka__gte=path, sciezka__lt=path[:-1] + '0')
+
+    def with_counts(self):
+        """Annotate doc_count (non-deleted documents) and subfolder_count in the same query"""
+        documents = Document.objects.filter(folder=models.OuterRef('pk'), usunieto=False).order_by().values('folder')
+        subfolders = Folder.objects.filter(rodzic=models.OuterRef('pk')).order_by().values('rodzic')
+        return self.annotate(
+            doc_count=Coalesce(
+                models.Subquery(documents.annotate(count=models.Count('pk')).values('count'), output_field=models.IntegerField()), 0
+            ),
+            subfolder_count=Coalesce(
+                models.Subquery(subfolders.annotate(count=models.Count('pk')).values('count'), output_field=models.IntegerField()), 0
+            ),
+        )
+
+
+class Folder(LoadedValuesMixin, models.Model):
     """Folder structure for documents"""
+    TRACKED_FIELDS = ('wlasciciel_id', 'rodzic_id')
+
     nazwa = models.CharField(max_length=255)
     opis = models.TextField(blank=True)
     data_utworzenia = models.DateTimeField(auto_now_add=True)
     rodzic = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='podkatalogi')
     wlasciciel = models.ForeignKey(User, on_delete=models.CASCADE, related_name='folders_owned') # Changed related_name for clarity
     tagi = models.ManyToManyField(Tag, blank=True, verbose_name='Tagi', related_name='folders')
+    # Materialized path of folder ids from the root, e.g. '/3/17/42/' (maintained in save).
+    # A TextField: the path grows with the depth of the tree and the size of the ids.
+    sciezka = models.TextField(blank=True, db_index=True, editable=False)
+
+    objects = FolderQuerySet.as_manager()
 
     def __str__(self):
         return self.nazwa
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if not self.sciezka or getattr(self, '_loaded_values', {}).get('rodzic_id') != self.rodzic_id:
+            self._update_path()
+        self.remember_loaded_values()
+
+    def _build_path(self):
+        parent_path = '/'
+        if self.rodzic_id:
+            parent_path = Folder.objects.filter(pk=self.rodzic_id).values_list('sciezka', flat=True).get()
+        return f"{parent_path}{self.pk}/"
+
+    def _update_path(self):
+        """Store the materialized path and rewrite the paths of the whole subtree when moved"""
+        old_path = self.sciezka
+        new_path = self._build_path()
+        if new_path == old_path:
+            return
+        Folder.objects.filter(pk=self.pk).update(sciezka=new_path)
+        if old_path:
+            Folder.objects.subtree(old_path).exclude(pk=self.pk).update(
+                sciezka=Concat(models.Value(new_path), Substr('sciezka', len(old_path) + 1))
+            )
+        self.sciezka = new_path
+
+    def move_children_to(self, target):
+        """Move direct subfolders under target (None = root), keeping subtree paths valid"""
+        new_prefix = target.sciezka if target else '/'
+        moved = self.podkatalogi.update(rodzic=target)
+        if moved:
+            Folder.objects.subtree(self.sciezka).exclude(pk=self.pk).update(
+                sciezka=Concat(models.Value(new_prefix), Substr('sciezka', len(self.sciezka) + 1))
+            )
+        return moved
+
+    def get_ancestor_ids(self):
+        """Ids from the root down to the parent of this folder"""
+        return [int(pk) for pk in self.sciezka.strip('/').split('/') if pk][:-1]
+
+    def get_ancestors(self, include_self=False):
+        """Ancestors ordered from the root, loaded with a single query"""
+        ancestor_ids = self.get_ancestor_ids()
+        folders = Folder.objects.in_bulk(ancestor_ids) if ancestor_ids else {}
+        ancestors = [folders[pk] for pk in ancestor_ids if pk in folders]
+        if include_self:
+            ancestors.append(self)
+        return ancestors
+
+    def get_descendants(self):
+        """All folders below this one (any depth) as a single indexed query"""
+        return Folder.objects.subtree(self.sciezka).exclude(pk=self.pk)
+
     def get_full_path(self):
         """Get full folder path"""
-        path_parts = [self.nazwa]
-        parent = self.rodzic
-        while parent:
-            path_parts.insert(0, parent.nazwa)
-            parent = parent.rodzic
-        return ' / '.join(path_parts)
+        if not self.sciezka:
+            return self.nazwa
+        return ' / '.join(folder.nazwa for folder in self.get_ancestors(include_self=True))
 
     class Meta:
         db_table = 'folder'
@@ -61,6 +173,10 @@ class Folder(models.Model):
         verbose_name_plural = "Foldery"
         unique_together = ['nazwa', 'rodzic', 'wlasciciel']
         ordering = ['nazwa']
+        indexes = [
+            # Subfolders of a folder by name (home, folder_list, with_counts)
+            models.Index(fields=['rodzic', 'nazwa'], name='folder_rodzic_nazwa'),
+        ]
         # Django automatically creates add_folder, change_folder, delete_folder, view_folder
         # We only define permissions that are *additional* to these.
         permissions = (
@@ -72,9 +188,39 @@ class Folder(models.Model):
         )
 
 
-class Document(models.Model):
+class DocumentQuerySet(models.QuerySet):
+    def accessible_by(self, user, bits=None):
+        """Documents user has access to (browse by default) - one join with the access table"""
+        bits = ObjectAccess.BROWSE if bits is None else bits
+        return self.filter(dostepy__uzytkownik=user, dostepy__uprawnienia__hasbits=bits)
+
+    def soft_delete(self, user=None):
+        """Move documents to the trash (usunieto=True) keeping storage statistics in sync"""
+        from .stats import track_bulk_soft_delete
+        track_bulk_soft_delete(self)
+        return self.filter(usunieto=False).update(usunieto=True, data_usuniecia=timezone.now(), usuniety_przez=user)
+
+    def in_trash(self):
+        """Documents in the trash, except ones already being purged"""
+        return self.filter(usunieto=True, do_usuniecia=False)
+
+    def purge_requested(self):
+        """Trashed documents a user asked to purge (see documents.trash)"""
+        return self.filter(usunieto=True, do_usuniecia=True)
+
+    def trash_expired(self, now=None):
+        """Documents in the trash for longer than the retention period (TRASH_RETENTION_DAYS)"""
+        cutoff = (now or timezone.now()) - timedelta(days=Document.get_trash_retention_days())
+        return self.filter(usunieto=True, data_usuniecia__lt=cutoff)
+
+
+class Document(LoadedValuesMixin, models.Model):
     """Main document model"""
+    TRACKED_FIELDS = ('usunieto', 'rozmiar_pliku', 'wlasciciel_id', 'plik', 'hash_pliku')
+
     ALLOWED_EXTENSIONS = ['pdf', 'docx', 'doc', 'xlsx', 'xls', 'txt', 'png', 'jpg', 'jpeg']
+    DEFAULT_MAX_FILE_SIZE = 50 * 1024 * 1024
+    DEFAULT_TRASH_RETENTION_DAYS = 30
 
     STATUS_CHOICES = [
         ('draft', 'Szkic'),
@@ -87,10 +233,11 @@ class Document(models.Model):
     # typ_pliku should ideally be determined on save or be a choice field if limited
     typ_pliku = models.CharField(max_length=100, blank=True) # Made blank=True as it's auto-set
     # rozmiar_pliku should also be auto-set or allow null/blank if plik can be null
-    rozmiar_pliku = models.PositiveIntegerField(null=True, blank=True) # Allowed null/blank
+    rozmiar_pliku = models.PositiveBigIntegerField(null=True, blank=True) # Chunked uploads may exceed 2 GB
 
     plik = models.FileField(
-        upload_to=document_upload_path,
+        upload_to=blob_upload_path,
+        storage=get_blob_storage,
         validators=[FileExtensionValidator(allowed_extensions=ALLOWED_EXTENSIONS)],
         help_text="Obsługiwane formaty: PDF, DOCX, DOC, XLSX, XLS, TXT, PNG, JPG, JPEG",
         blank=True,
@@ -103,20 +250,42 @@ class Document(models.Model):
     # Consider on_delete=models.SET_NULL for folder if you want documents to remain if folder is deleted
     folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='documents', null=True, blank=True)
     usunieto = models.BooleanField(default=False)
+    data_usuniecia = models.DateTimeField(null=True, blank=True) # When the document was moved to the trash
+    usuniety_przez = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    do_usuniecia = models.BooleanField(default=False) # Purge requested, finished by purge_trash if interrupted
+    # Folder path ('Projekty / 2024') of a trashed document whose folder was deleted with it - restored to the root
+    lokalizacja_przed_usunieciem = models.TextField(blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
 
     tagi = models.ManyToManyField(Tag, blank=True, related_name='documents') # Changed related_name
 
     opis = models.TextField(blank=True, help_text="Opcjonalny opis dokumentu")
     hash_pliku = models.CharField(max_length=64, blank=True, help_text="SHA-256 hash for file integrity")
+    typ_mime = models.CharField(max_length=100, blank=True, help_text="MIME type sniffed from the file content")
+
+    objects = DocumentQuerySet.as_manager()
 
     def __str__(self):
         return self.nazwa
 
+    @classmethod
+    def get_max_file_size(cls):
+        """Upload limit in bytes (MAX_UPLOAD_SIZE system setting, cached)"""
+        from .settings_cache import get_size
+        return get_size('MAX_UPLOAD_SIZE', cls.DEFAULT_MAX_FILE_SIZE)
+
+    @classmethod
+    def get_trash_retention_days(cls):
+        """Days a deleted document stays in the trash (TRASH_RETENTION_DAYS system setting, cached)"""
+        from .settings_cache import get_int
+        return max(get_int('TRASH_RETENTION_DAYS', cls.DEFAULT_TRASH_RETENTION_DAYS), 0)
+
     def clean(self):
         super().clean()
-        if self.plik and hasattr(self.plik, 'size') and self.plik.size > 50 * 1024 * 1024:
-            raise ValidationError({"plik": "Plik nie może być większy niż 50MB."})
+        max_size = self.get_max_file_size()
+        if self.plik and hasattr(self.plik, 'size') and self.plik.size > max_size:
+            from .settings_cache import format_size
+            raise ValidationError({"plik": f"Plik nie może być większy niż {format_size(max_size)}."})
 
     def save(self, *args, **kwargs):
         if self.plik and hasattr(self.plik, 'name'): # Check if plik exists and has a name
@@ -127,46 +296,55 @@ class Document(models.Model):
             _, extension = os.path.splitext(self.plik.name)
             self.typ_pliku = extension.lower().lstrip('.')
 
-            if hasattr(self.plik, 'size'):
-                 self.rozmiar_pliku = self.plik.size
+            if self._file_changed():
+                self._update_file_fingerprint()
 
-            # Calculate file hash only if plik is present and hash_pliku is not already set or changed
-            # This check avoids re-hashing on every save if the file hasn't changed.
-            # A more robust way would be to check if self.plik has changed.
-            try:
-                # To ensure we only hash if the file content might have changed or is new
-                # This is a simplification; robust change detection is harder.
-                current_hash = self.hash_pliku
-                new_hash_needed = True
-                if self.pk: # if instance exists
-                    try:
-                        old_instance = Document.objects.get(pk=self.pk)
-                        if old_instance.plik == self.plik and self.hash_pliku:
-                             new_hash_needed = False # if file field is same and hash exists, assume no change
-                    except Document.DoesNotExist:
-                        pass # new instance, hash it
-
-                if new_hash_needed and self.plik.file: # Ensure file is openable
-                    import hashlib
-                    self.plik.seek(0)
-                    file_hash = hashlib.sha256()
-                    for chunk in iter(lambda: self.plik.read(4096), b""):
-                        file_hash.update(chunk)
-                    self.hash_pliku = file_hash.hexdigest()
-                    self.plik.seek(0)
-            except Exception: # Catch potential errors during hashing (e.g. file not found)
-                self.hash_pliku = "" # Or handle error as appropriate
+        # The trash is ordered and purged by data_usuniecia (also when usunieto is set by hand, e.g. in the admin)
+        if self.usunieto and self.data_usuniecia is None:
+            self.data_usuniecia = timezone.now()
+        elif not self.usunieto:
+            self.data_usuniecia = self.usuniety_przez = None
+            self.do_usuniecia = False
 
         super().save(*args, **kwargs)
-
-    def delete(self, *args, **kwargs):
-        if self.plik and hasattr(self.plik, 'path'):
-            try:
-                if os.path.isfile(self.plik.path):
-                    os.remove(self.plik.path)
-            except (ValueError, OSError, AttributeError): # Added AttributeError
-                pass
-        super().delete(*args, **kwargs)
+        self.remember_loaded_values()
+
+    def move_to_trash(self, user=None):
+        self.usunieto = True
+        self.data_usuniecia = timezone.now()
+        self.usuniety_przez = user
+        self.save()
+
+    def restore(self):
+        """Take the document out of the trash (to the root when its folder was deleted, see lokalizacja_przed_usunieciem)"""
+        self.usunieto = False
+        self.lokalizacja_przed_usunieciem = ''
+        self.save()
+
+    def trash_expires_at(self):
+        if self.data_usuniecia is None:
+            return None
+        return self.data_usuniecia + timedelta(days=self.get_trash_retention_days())
+
+    def _file_changed(self):
+        """True for a new file (or one never hashed) - checked without querying the database"""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None or 'plik' not in loaded:
+            return True
+        return self.plik.name != loaded['plik'] or not self.hash_pliku
+
+    def _update_file_fingerprint(self):
+        """Set hash, size and MIME type of a new file, reusing values computed during upload"""
+        from .uploadhandlers import file_content_type, file_digest
+
+        loaded = getattr(self, '_loaded_values', {})
+        if self.hash_pliku and self.hash_pliku != loaded.get('hash_pliku'):
+            return # Fingerprint supplied by the caller (e.g. copied from a DocumentVersion)
+        try:
+            self.hash_pliku, self.rozmiar_pliku = file_digest(self.plik.file)
+            self.typ_mime = file_content_type(self.plik.file)
+        except (OSError, ValueError): # File missing in storage or closed
+            self.hash_pliku = ""
 
     def get_file_size_display(self):
         """Return human readable file size"""
@@ -207,7 +385,28 @@ class Document(models.Model):
         return self.typ_pliku in ['png', 'jpg', 'jpeg']
 
     def can_preview(self):
-        return self.plik and self.typ_pliku in ['pdf', 'txt', 'png', 'jpg', 'jpeg']
+        return self.plik and self.typ_pliku in ['pdf', 'txt', 'png', 'jpg', 'jpeg', 'docx', 'xlsx']
+
+    def has_html_preview(self):
+        """Office files previewed as HTML rendered on the server (documents.office_preview)"""
+        from .office_preview import has_preview
+        return bool(self.plik and self.hash_pliku) and has_preview(self.typ_pliku)
+
+    def has_renditions(self):
+        from .renditions import has_renditions
+        return bool(self.plik and self.hash_pliku) and has_renditions(self.typ_pliku)
+
+    @property
+    def rendition_urls(self):
+        """{size name: URL} of the downscaled renditions; the hash makes the URLs cacheable"""
+        from django.urls import reverse
+        from .renditions import get_sizes, rendition_version
+        if not self.has_renditions():
+            return {}
+        return {
+            size: f"{reverse('documents:document_rendition', args=[self.id, size])}?v={rendition_version(self.hash_pliku)}"
+            for size in get_sizes()
+        }
 
     @property
     def download_url(self): # This should be handled by reverse in templates
@@ -224,6 +423,18 @@ class Document(models.Model):
         verbose_name = "Dokument"
         verbose_name_plural = "Dokumenty"
         ordering = ['-ostatnia_modyfikacja']
+        # Listings only ever show documents that are not deleted - partial indexes skip the rest
+        indexes = [
+            # Keyset pagination of document_list (see documents/pagination.py)
+            models.Index(fields=['ostatnia_modyfikacja', 'id'], name='dokument_modyfikacja_id', condition=models.Q(usunieto=False)),
+            # Folder contents by name (home) and Folder.with_counts() document counts
+            models.Index(fields=['folder', 'nazwa'], name='dokument_folder_nazwa', condition=models.Q(usunieto=False)),
+            # Per-owner totals (documents.stats) without reading the table
+            models.Index(fields=['wlasciciel', 'rozmiar_pliku'], name='dokument_wlasciciel_rozmiar', condition=models.Q(usunieto=False)),
+            # The trash: purge of expired documents and per-owner listings, only over deleted rows
+            models.Index(fields=['data_usuniecia', 'id'], name='dokument_kosz', condition=models.Q(usunieto=True)),
+            models.Index(fields=['wlasciciel', 'data_usuniecia', 'id'], name='dokument_kosz_wlasciciel', condition=models.Q(usunieto=True)),
+        ]
         # Django automatically creates add_document, change_document, delete_document, view_document
         # We only define permissions that are *additional* to these.
         permissions = (
@@ -241,10 +452,11 @@ class DocumentVersion(models.Model):
     numer_wersji = models.PositiveIntegerField()
     data_utworzenia = models.DateTimeField(auto_now_add=True)
     utworzony_przez = models.ForeignKey(User, on_delete=models.CASCADE)
-    plik = models.FileField(upload_to='document_versions/%Y/%m/%d/', blank=True, null=True)
+    plik = models.FileField(upload_to=blob_upload_path, storage=get_blob_storage, blank=True, null=True)
     komentarz = models.TextField(blank=True)
-    rozmiar_pliku = models.PositiveIntegerField(default=0, null=True, blank=True)
+    rozmiar_pliku = models.PositiveBigIntegerField(default=0, null=True, blank=True)
     hash_pliku = models.CharField(max_length=64, blank=True)
+    typ_mime = models.CharField(max_length=100, blank=True)
 
     def __str__(self):
         return f"{self.dokument.nazwa} v{self.numer_wersji}"
@@ -262,17 +474,11 @@ class DocumentVersion(models.Model):
         return f"{size:.1f} PB"
 
     def save(self, *args, **kwargs):
-        if self.plik and hasattr(self.plik, 'size') and not self.rozmiar_pliku:
-            self.rozmiar_pliku = self.plik.size
-
-            if self.plik.file:
-                import hashlib
-                self.plik.seek(0)
-                file_hash = hashlib.sha256()
-                for chunk in iter(lambda: self.plik.read(4096), b""):
-                    file_hash.update(chunk)
-                self.hash_pliku = file_hash.hexdigest()
-                self.plik.seek(0)
+        if self.plik and not self.rozmiar_pliku:
+            from .uploadhandlers import file_content_type, file_digest
+
+            self.hash_pliku, self.rozmiar_pliku = file_digest(self.plik.file)
+            self.typ_mime = file_content_type(self.plik.file)
         super().save(*args, **kwargs)
 
     class Meta:
@@ -280,6 +486,55 @@ class DocumentVersion(models.Model):
         unique_together = ['dokument', 'numer_wersji']
         ordering = ['-numer_wersji']
 
+
+class FileBlob(models.Model):
+    """Stored file content shared by documents and versions, with a reference count (see documents.blobs)"""
+    nazwa = models.CharField(max_length=255, unique=True, help_text="Nazwa pliku w magazynie")
+    hash_pliku = models.CharField(max_length=64, blank=True, db_index=True)
+    rozmiar = models.BigIntegerField(default=0)
+    liczba_odwolan = models.PositiveIntegerField(default=0)
+    data_utworzenia = models.DateTimeField(auto_now_add=True)
+    data_modyfikacji = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.nazwa} ({self.liczba_odwolan})"
+
+    class Meta:
+        db_table = 'blob_pliku'
+        verbose_name = "Plik w magazynie"
+        verbose_name_plural = "Pliki w magazynie"
+
+
+class DocumentContent(models.Model):
+    """Text extracted from a document file (current file or a version), see documents.extraction"""
+    STATUS_CHOICES = [
+        ('pending', 'Oczekuje'),
+        ('done', 'Wyodrębniono'),
+        ('unsupported', 'Nieobsługiwany format'),
+        ('failed', 'Błąd'),
+    ]
+
+    dokument = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='tresci')
+    wersja = models.ForeignKey(DocumentVersion, on_delete=models.CASCADE, null=True, blank=True, related_name='tresci')
+    hash_pliku = models.CharField(max_length=64, db_index=True)
+    tekst = models.TextField(blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    blad = models.TextField(blank=True)
+    data_ekstrakcji = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Treść {self.dokument_id} ({self.get_status_display()})"
+
+    class Meta:
+        db_table = 'tresc_dokumentu'
+        unique_together = ['dokument', 'wersja']
+        constraints = [
+            # NULLs never collide in unique_together - one row for the current file needs its own constraint
+            models.UniqueConstraint(fields=['dokument'], condition=models.Q(wersja__isnull=True), name='tresc_dokument_biezacy_plik'),
+        ]
+        verbose_name = "Treść dokumentu"
+        verbose_name_plural = "Treści dokumentów"
+
 class DocumentMetadata(models.Model):
     """Custom metadata for documents"""
     dokument = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='metadane')
@@ -296,7 +551,9 @@ class DocumentMetadata(models.Model):
         verbose_name_plural = "Metadane dokumentów"
 
 
-class Comment(models.Model):
+class Comment(LoadedValuesMixin, models.Model):
+    TRACKED_FIELDS = ('aktywny', 'rodzic_id')
+
     dokument = models.ForeignKey(
         Document,
         on_delete=models.CASCADE,
@@ -319,9 +576,16 @@ class Comment(models.Model):
         verbose_name='Komentarz nadrzędny'
     )
     aktywny = models.BooleanField(default=True, verbose_name='Aktywny')
+    # Active direct replies, maintained by documents.signals (see documents.comments)
+    liczba_odpowiedzi = models.PositiveIntegerField(default=0, editable=False, verbose_name='Liczba odpowiedzi')
 
     class Meta:
         ordering = ['data_utworzenia']
+        indexes = [
+            # Comment tree of a document (documents.comments) and replies to a comment
+            models.Index(fields=['dokument', 'data_utworzenia'], name='komentarz_dokument_data', condition=models.Q(aktywny=True)),
+            models.Index(fields=['rodzic', 'data_utworzenia'], name='komentarz_rodzic_data', condition=models.Q(aktywny=True, rodzic__isnull=False)),
+        ]
         verbose_name = "Komentarz"
         verbose_name_plural = "Komentarze"
 
@@ -330,7 +594,12 @@ class Comment(models.Model):
         doc_name = self.dokument.nazwa if self.dokument else "N/A"
         return f'Komentarz {username} do {doc_name}'
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.remember_loaded_values()
+
     def get_children(self):
+        """Active replies - one query per call, use documents.comments.load_comment_tree() for whole threads"""
         return Comment.objects.filter(rodzic=self, aktywny=True)
 
 
@@ -354,7 +623,7 @@ class ActivityLog(models.Model):
     dokument = models.ForeignKey(Document, on_delete=models.SET_NULL, null=True, blank=True) # SET_NULL for document
     folder = models.ForeignKey(Folder, on_delete=models.SET_NULL, null=True, blank=True)     # SET_NULL for folder
     szczegoly = models.TextField(blank=True)
-    znacznik_czasu = models.DateTimeField(auto_now_add=True)
+    znacznik_czasu = models.DateTimeField(default=timezone.now, editable=False) # Time of the event, not of the write
     adres_ip = models.GenericIPAddressField(null=True, blank=True) # Allow null for IP
 
     def __str__(self):
@@ -365,6 +634,12 @@ class ActivityLog(models.Model):
         verbose_name = "Log aktywności"
         verbose_name_plural = "Logi aktywności"
         ordering = ['-znacznik_czasu']
+        indexes = [
+            # Keyset pagination of the activity log (see documents/pagination.py)
+            models.Index(fields=['znacznik_czasu', 'id'], name='log_znacznik_czasu_id'),
+            # The same filtered by activity type
+            models.Index(fields=['typ_aktywnosci', 'znacznik_czasu', 'id'], name='log_typ_znacznik_czasu_id'),
+        ]
 
 
 class DocumentShare(models.Model):
@@ -390,6 +665,10 @@ class DocumentShare(models.Model):
     class Meta:
         db_table = 'document_share'
         unique_together = ['dokument', 'udostepnione_dla'] # A user should only have one type of share per document
+        indexes = [
+            # Active shares received by a user, by expiry
+            models.Index(fields=['udostepnione_dla', 'data_wygasniecia'], name='udostepnienie_dla_wygasniecie', condition=models.Q(aktywne=True)),
+        ]
         verbose_name = "Udostępnienie dokumentu"
         verbose_name_plural = "Udostępnienia dokumentów"
 
@@ -409,11 +688,9 @@ class SystemSettings(models.Model):
 
     @classmethod
     def get_setting(cls, klucz, default=None):
-        try:
-            setting = cls.objects.get(klucz=klucz)
-            return setting.wartosc
-        except cls.DoesNotExist:
-            return default
+        """Value of a setting, served from the in-process cache (documents.settings_cache)"""
+        from .settings_cache import get_str
+        return get_str(klucz, default)
 
     @classmethod
     def set_setting(cls, klucz, wartosc, opis='', kategoria='general'):
@@ -436,4 +713,182 @@ class SystemSettings(models.Model):
         db_table = 'system_settings'
         verbose_name = 'Ustawienie systemowe'
         verbose_name_plural = 'Ustawienia systemowe'
-        ordering = ['kategoria', 'klucz']
\ No newline at end of file
+        ordering = ['kategoria', 'klucz']
+
+
+class SettingsVersion(models.Model):
+    """Version stamp of SystemSettings, bumped on every change to invalidate caches in all processes"""
+    wersja = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'wersja_ustawien'
+
+
+class PermissionMaskField(models.PositiveIntegerField):
+    """Bitmask of permissions, filtered with the hasbits lookup"""
+
+
+@PermissionMaskField.register_lookup
+class HasBits(models.Lookup):
+    """mask__hasbits=bits - all given bits are set"""
+    lookup_name = 'hasbits'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"({lhs} & {rhs}) = {rhs}", [*lhs_params, *rhs_params, *rhs_params]
+
+
+class ObjectAccess(models.Model):
+    """Denormalized access of a user to a document or folder (maintained by documents.access)"""
+    # Bits of guardian object permissions; documents and folders share the low bits
+    BROWSE = 1          # browse_document / browse_folder
+    CHANGE = 2          # change_document / change_folder
+    DELETE = 4          # delete_document / delete_folder
+    SHARE = 8           # share_document
+    ADD_DOCUMENT = 8    # add_document_to_folder
+    DOWNLOAD = 16       # download_document
+    ADD_SUBFOLDER = 16  # add_subfolder_to_folder
+    COMMENT = 32        # comment_document
+    OWNER = 1 << 15     # uzytkownik is the owner (owners can always browse)
+
+    # No separate index on uzytkownik - both unique constraints below start with it
+    uzytkownik = models.ForeignKey(User, on_delete=models.CASCADE, related_name='dostepy', db_index=False)
+    dokument = models.ForeignKey(Document, on_delete=models.CASCADE, null=True, blank=True, related_name='dostepy')
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, null=True, blank=True, related_name='dostepy')
+    uprawnienia = PermissionMaskField(default=0)
+
+    def __str__(self):
+        return f"{self.uzytkownik_id} -> {self.dokument_id or self.folder_id}: {self.uprawnienia:b}"
+
+    class Meta:
+        db_table = 'dostep_obiektu'
+        verbose_name = 'Dostęp do obiektu'
+        verbose_name_plural = 'Dostępy do obiektów'
+        constraints = [
+            # Also the indexes of "what can this user see" joins (NULLs never collide)
+            models.UniqueConstraint(fields=['uzytkownik', 'dokument'], name='dostep_uzytkownik_dokument'),
+            models.UniqueConstraint(fields=['uzytkownik', 'folder'], name='dostep_uzytkownik_folder'),
+            models.CheckConstraint(
+                check=models.Q(dokument__isnull=False, folder__isnull=True) | models.Q(dokument__isnull=True, folder__isnull=False),
+                name='dostep_dokument_albo_folder',
+            ),
+        ]
+
+
+class StorageStats(models.Model):
+    """Running totals of documents, folders and storage used (global row has uzytkownik=None)"""
+    uzytkownik = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True, related_name='storage_stats')
+    liczba_dokumentow = models.IntegerField(default=0)
+    liczba_folderow = models.IntegerField(default=0)
+    rozmiar_calkowity = models.BigIntegerField(default=0)
+    data_modyfikacji = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        owner = self.uzytkownik.username if self.uzytkownik else 'globalne'
+        return f"Statystyki ({owner}): {self.liczba_dokumentow} dok., {self.rozmiar_calkowity} B"
+
+    class Meta:
+        db_table = 'statystyki_przechowywania'
+        verbose_name = 'Statystyki przechowywania'
+        verbose_name_plural = 'Statystyki przechowywania'
+        constraints = [
+            # NULLs never collide in the OneToOne index; every global row maps to the same value here
+            models.UniqueConstraint(
+                Coalesce('uzytkownik', models.Value(0)),
+                condition=models.Q(uzytkownik__isnull=True),
+                name='statystyki_jeden_globalny',
+            ),
+        ]
+
+
+class FolderDeletionJob(models.Model):
+    """Background deletion of a folder with its whole subtree (see documents.folder_deletion)"""
+    STATUS_PENDING = 'oczekuje'
+    STATUS_RUNNING = 'w_toku'
+    STATUS_DONE = 'zakonczone'
+    STATUS_FAILED = 'blad'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Oczekuje'),
+        (STATUS_RUNNING, 'W toku'),
+        (STATUS_DONE, 'Zakończone'),
+        (STATUS_FAILED, 'Błąd'),
+    ]
+
+    folder = models.ForeignKey(Folder, on_delete=models.SET_NULL, null=True, blank=True, related_name='zadania_usuwania')
+    nazwa_folderu = models.CharField(max_length=255) # Kept after the folder is gone
+    sciezka = models.TextField() # Materialized path of the deleted subtree
+    rodzic = models.ForeignKey(Folder, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    uzytkownik = models.ForeignKey(User, on_delete=models.CASCADE, related_name='zadania_usuwania_folderow')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    liczba_folderow = models.PositiveIntegerField(default=0)
+    liczba_dokumentow = models.PositiveIntegerField(default=0)
+    usuniete_foldery = models.PositiveIntegerField(default=0)
+    usuniete_dokumenty = models.PositiveIntegerField(default=0)
+    blad = models.TextField(blank=True)
+    data_utworzenia = models.DateTimeField(auto_now_add=True)
+    data_zakonczenia = models.DateTimeField(null=True, blank=True)
+    ostatni_postep = models.DateTimeField(default=timezone.now) # Heartbeat - a job silent for long lost its worker
+
+    def __str__(self):
+        return f"Usuwanie folderu {self.nazwa_folderu} ({self.get_status_display()})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_DONE, self.STATUS_FAILED)
+
+    def get_progress(self):
+        """Percent of folders and documents processed so far"""
+        total = self.liczba_folderow + self.liczba_dokumentow
+        if self.status == self.STATUS_DONE or not total:
+            return 100 if self.status == self.STATUS_DONE else 0
+        return min(99, (self.usuniete_foldery + self.usuniete_dokumenty) * 100 // total)
+
+    class Meta:
+        db_table = 'zadanie_usuwania_folderu'
+        verbose_name = 'Zadanie usuwania folderu'
+        verbose_name_plural = 'Zadania usuwania folderów'
+        ordering = ['-data_utworzenia']
+
+
+class UploadSession(models.Model):
+    """Resumable upload of one file sent in chunks (see documents.chunked_uploads)"""
+    STATUS_UPLOADING = 'przesylanie'
+    STATUS_READY = 'gotowe'
+    STATUS_CHOICES = [
+        (STATUS_UPLOADING, 'Przesyłanie'),
+        (STATUS_READY, 'Gotowe'),
+    ]
+
+    uzytkownik = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sesje_przesylania')
+    nazwa_pliku = models.CharField(max_length=255)
+    rozmiar = models.PositiveBigIntegerField() # Declared by the client up front
+    przeslano = models.PositiveBigIntegerField(default=0) # Offset of the next chunk
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_UPLOADING)
+    plik_czesciowy = models.CharField(max_length=255) # Chunks are appended here, in the blob storage
+    plik = models.CharField(max_length=255, blank=True) # Stored blob name once complete
+    hash_pliku = models.CharField(max_length=64, blank=True)
+    typ_mime = models.CharField(max_length=100, blank=True)
+    zapis_od = models.DateTimeField(null=True, blank=True) # A chunk is being written since then
+    data_utworzenia = models.DateTimeField(auto_now_add=True)
+    data_modyfikacji = models.DateTimeField(auto_now=True)
+    data_wygasniecia = models.DateTimeField()
+
+    def __str__(self):
+        return f"Przesyłanie {self.nazwa_pliku} ({self.przeslano}/{self.rozmiar} B)"
+
+    @property
+    def is_complete(self):
+        return self.status == self.STATUS_READY
+
+    def get_progress(self):
+        """Percent of the file received so far"""
+        if not self.rozmiar:
+            return 100 if self.is_complete else 0
+        return self.przeslano * 100 // self.rozmiar
+
+    class Meta:
+        db_table = 'sesja_przesylania'
+        verbose_name = 'Sesja przesyłania'
+        verbose_name_plural = 'Sesje przesyłania'
+        ordering = ['-data_utworzenia']
\ No newline at end of file
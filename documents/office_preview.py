@@ -0,0 +1,276 @@
+"""
+HTML previews of Word and Excel files.
+
+document_preview shows docx and xlsx files as lightweight HTML instead of
+making users download them: the first OFFICE_PREVIEW_MAX_PAGES pages of a
+document (counted at the page breaks Word saves in the file), or the first
+OFFICE_PREVIEW_MAX_ROWS rows and OFFICE_PREVIEW_MAX_COLUMNS columns of every
+sheet of a workbook.
+
+Both renderers stream: docx XML is read with iterparse straight from the
+archive, like in documents.extraction, and workbooks are opened with openpyxl
+in read-only mode, which reads rows on demand. Rendering stops at the limits,
+so memory and time do not grow with the size of the file.
+
+A preview is rendered once per content (SHA-256 hash) and cached in the blob
+storage (previews/ab/cd/<hash>.html); documents and versions with the same
+file share it. collect_garbage() deletes the previews of content no longer
+stored. The legacy binary formats (doc, xls) are not supported.
+"""
+import datetime
+import html
+import logging
+import os
+import re
+import uuid
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+from django.conf import settings
+
+from . import blobs
+from .extraction import WORD_NS
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_PREFIX = 'previews/'
+PREVIEW_EXTENSIONS = ('docx', 'xlsx')
+MAX_SHEETS = 10
+# Text of a document preview without page breaks in the file stops here
+MAX_DOCUMENT_CHARACTERS = 200_000
+HEADING_STYLE_RE = re.compile(r'^(?:heading|nag[lł]?[oó]?wek)\s*(\d)$', re.IGNORECASE)
+
+
+class PreviewUnavailable(Exception):
+    pass
+
+
+def get_max_pages():
+    return getattr(settings, 'OFFICE_PREVIEW_MAX_PAGES', 10)
+
+
+def get_max_rows():
+    return getattr(settings, 'OFFICE_PREVIEW_MAX_ROWS', 200)
+
+
+def get_max_columns():
+    return getattr(settings, 'OFFICE_PREVIEW_MAX_COLUMNS', 30)
+
+
+def has_preview(extension):
+    return (extension or '').lower().lstrip('.') in PREVIEW_EXTENSIONS
+
+
+def preview_name(file_hash):
+    """previews/ab/cd/<sha256>.html"""
+    return f"{PREVIEW_PREFIX}{file_hash[:2]}/{file_hash[2:4]}/{file_hash}.html"
+
+
+def _truncation_note(text):
+    return f'<p class="text-muted fst-italic mt-3">{html.escape(text)}</p>'
+
+
+class _DocxRenderer:
+    """Paragraphs, headings, bold/italic runs and tables of word/document.xml, as HTML."""
+
+    def __init__(self, max_pages):
+        self.max_pages = max_pages
+        self.parts = []
+        self.characters = 0
+        self.pages = 1
+        self.open_tags = [] # Tables, rows and cells not closed yet
+        self.paragraph = None # Runs of the paragraph being read
+        self.heading = None
+        self.run = None
+        self.bold = self.italic = False
+
+    @property
+    def full(self):
+        return self.pages > self.max_pages or self.characters >= MAX_DOCUMENT_CHARACTERS
+
+    def start(self, tag):
+        if tag == 'tbl':
+            self._open('table', '<table class="table table-sm table-bordered">')
+        elif tag == 'tr':
+            self._open('tr', '<tr>')
+        elif tag == 'tc':
+            self._open('td', '<td>')
+        elif tag == 'p':
+            self.paragraph, self.heading = [], None
+        elif tag == 'r':
+            self.run, self.bold, self.italic = [], False, False
+
+    def end(self, tag, element):
+        if tag in ('tbl', 'tr', 'tc'):
+            self.parts.append(f'</{self.open_tags.pop()}>')
+        elif tag == 't' and element.text:
+            self.run.append(html.escape(element.text))
+            self.characters += len(element.text)
+        elif tag == 'tab':
+            self.run.append('&emsp;')
+        elif tag == 'br':
+            if element.get(WORD_NS + 'type') == 'page':
+                self.pages += 1
+            else:
+                self.run.append('<br>')
+        elif tag == 'lastRenderedPageBreak': # Where Word broke the page when it saved the file
+            self.pages += 1
+        elif tag in ('b', 'i') and element.get(WORD_NS + 'val') not in ('0', 'false'):
+            if tag == 'b':
+                self.bold = True
+            else:
+                self.italic = True
+        elif tag == 'pStyle':
+            match = HEADING_STYLE_RE.match(element.get(WORD_NS + 'val') or '')
+            if match:
+                self.heading = min(int(match.group(1)) + 1, 6) # The page title is the h1
+        elif tag == 'r':
+            self._close_run()
+        elif tag == 'p':
+            self._close_paragraph()
+
+    def _close_run(self):
+        text = ''.join(self.run)
+        if text and self.italic:
+            text = f'<em>{text}</em>'
+        if text and self.bold:
+            text = f'<strong>{text}</strong>'
+        if self.paragraph is not None:
+            self.paragraph.append(text)
+        self.run = None
+
+    def _close_paragraph(self):
+        element_tag = f'h{self.heading}' if self.heading else 'p'
+        self.parts.append(f"<{element_tag}>{''.join(self.paragraph) or '&nbsp;'}</{element_tag}>")
+        self.paragraph = None
+
+    def _open(self, closing_tag, html_tag):
+        self.open_tags.append(closing_tag)
+        self.parts.append(html_tag)
+
+    def html(self):
+        # Rendering stopped at a page break: the text before it is kept
+        if self.run is not None:
+            self._close_run()
+        if self.paragraph is not None:
+            self._close_paragraph()
+        self.parts.extend(f'</{tag}>' for tag in reversed(self.open_tags))
+        self.open_tags = []
+        return ''.join(self.parts)
+
+
+def render_docx(fileobj, max_pages=None):
+    max_pages = max_pages or get_max_pages()
+    renderer = _DocxRenderer(max_pages)
+    with zipfile.ZipFile(fileobj) as archive, archive.open('word/document.xml') as stream:
+        for event, element in iterparse(stream, events=('start', 'end')):
+            if not element.tag.startswith(WORD_NS):
+                continue
+            tag = element.tag[len(WORD_NS):]
+            if event == 'start':
+                renderer.start(tag)
+                continue
+            renderer.end(tag, element)
+            if tag in ('p', 'tbl'):
+                element.clear() # Paragraphs already rendered are not kept
+            if renderer.full:
+                return renderer.html() + _truncation_note(f"Podgląd obejmuje pierwsze {max_pages} stron dokumentu.")
+    return renderer.html()
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%d.%m.%Y %H:%M') if value.time() != datetime.time() else value.strftime('%d.%m.%Y')
+    if isinstance(value, datetime.date):
+        return value.strftime('%d.%m.%Y')
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def render_xlsx(fileobj, max_rows=None, max_columns=None):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise PreviewUnavailable("Biblioteka openpyxl nie jest zainstalowana")
+    max_rows = max_rows or get_max_rows()
+    max_columns = max_columns or get_max_columns()
+
+    parts = []
+    # read_only: rows are parsed while they are iterated; data_only: cached results instead of formulas
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        sheets = workbook.worksheets
+        for sheet in sheets[:MAX_SHEETS]:
+            rows = [
+                [_cell_text(value) for value in row]
+                for row in sheet.iter_rows(max_row=max_rows, max_col=max_columns, values_only=True)
+            ]
+            width = max((index + 1 for row in rows for index, text in enumerate(row) if text), default=0)
+            while rows and not any(rows[-1]):
+                rows.pop()
+            parts.append(f'<h2 class="h5 mt-3">{html.escape(sheet.title)}</h2>')
+            if not width:
+                parts.append('<p class="text-muted">Pusty arkusz</p>')
+                continue
+            parts.append('<div class="table-responsive"><table class="table table-sm table-bordered">')
+            for row in rows:
+                cells = ''.join(f'<td>{html.escape(text)}</td>' for text in row[:width])
+                parts.append(f'<tr>{cells}{"<td></td>" * (width - len(row))}</tr>')
+            parts.append('</table></div>')
+            if (sheet.max_row or 0) > max_rows or (sheet.max_column or 0) > max_columns:
+                parts.append(_truncation_note(f"Arkusz pokazany do {max_rows} wiersza i {max_columns} kolumny."))
+        if len(sheets) > MAX_SHEETS:
+            parts.append(_truncation_note(f"Pokazano {MAX_SHEETS} z {len(sheets)} arkuszy."))
+    finally:
+        workbook.close() # Read-only workbooks keep the archive open
+    return ''.join(parts)
+
+
+RENDERERS = {
+    'docx': render_docx,
+    'xlsx': render_xlsx,
+}
+
+
+def render_preview(file_field, extension):
+    """HTML fragment previewing a stored file; raises PreviewUnavailable for other formats."""
+    renderer = RENDERERS.get((extension or '').lower().lstrip('.'))
+    if renderer is None:
+        raise PreviewUnavailable(f"Brak podglądu dla formatu {extension}")
+    with file_field.open('rb') as fileobj:
+        return renderer(fileobj)
+
+
+def get_preview_html(file_field, file_hash):
+    """Cached HTML preview of a stored file, rendered now if it is not cached yet."""
+    storage = blobs.get_blob_storage()
+    path = storage.path(preview_name(file_hash))
+    try:
+        with open(path, encoding='utf-8') as cached:
+            return cached.read()
+    except FileNotFoundError:
+        pass
+    try:
+        fragment = render_preview(file_field, os.path.splitext(file_field.name)[1])
+    except PreviewUnavailable:
+        raise
+    except Exception as exc: # Damaged or unreadable file
+        logger.warning("Nie udało się przygotować podglądu pliku %s: %s", file_field.name, exc)
+        raise PreviewUnavailable("Nie udało się odczytać pliku.")
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{uuid.uuid4().hex}.part"
+    with open(temporary_path, 'w', encoding='utf-8') as target:
+        target.write(fragment)
+    os.replace(temporary_path, path) # Concurrent renderings of the same file cannot clash
+    return fragment
+
+
+def delete_previews(file_hashes):
+    """Delete the cached previews of the given contents."""
+    storage = blobs.get_blob_storage()
+    names = [preview_name(file_hash) for file_hash in set(file_hashes)]
+    return blobs.delete_files(storage, [name for name in names if storage.exists(name)])
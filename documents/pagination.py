@@ -0,0 +1,202 @@
+"""
+Cursor (keyset) pagination for long listings.
+
+Page-number pagination (Paginator) costs an exact COUNT(*) on every page
+and an OFFSET that makes the database walk all preceding rows, so deep
+pages of the document list or of the activity log get slower the further
+you go. KeysetPaginator instead remembers the sort key of the last (or
+first) row shown and asks for the rows after (before) it:
+
+    WHERE (ostatnia_modyfikacja, id) < (:t, :id) ORDER BY ostatnia_modyfikacja DESC, id DESC LIMIT 21
+
+which the composite (ostatnia_modyfikacja, id) / (znacznik_czasu, id)
+indexes answer in constant time on any page. The cursor is an opaque token
+put in the ?cursor= query parameter:
+
+    paginator = KeysetPaginator(Document.objects.all(), 20, ('ostatnia_modyfikacja', 'id'))
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+
+Listings ordered by something else (search results ranked by relevance)
+use OffsetPaginator, which takes the same cursors carrying an offset.
+
+The page header uses approximate_count(): the number of rows is counted up
+to PAGINATION_COUNT_LIMIT and shown as "ponad N" above that, so the count
+is bounded too.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.db.models import Q
+
+
+def encode_cursor(kind, values):
+    data = json.dumps([kind] + list(values), separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """(kind, values) of a cursor, None when it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(data, list) or not data or not isinstance(data[0], str):
+        return None
+    return data[0], data[1:]
+
+
+def approximate_count(queryset, limit=None):
+    """(count, exact): the number of rows counted up to limit, exact=False when there are more."""
+    if limit is None:
+        limit = getattr(settings, 'PAGINATION_COUNT_LIMIT', 1000)
+    count = queryset.order_by()[:limit + 1].count()
+    if count > limit:
+        return limit, False
+    return count, True
+
+
+class CursorPage:
+    """One page of results with cursors of the neighbouring pages."""
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self.object_list)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def count(self):
+        return self.paginator.count
+
+    @property
+    def count_exact(self):
+        return self.paginator.count_exact
+
+
+class BasePaginator:
+    def __init__(self, queryset, per_page, count_limit=None):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.count_limit = count_limit
+        self._count = None
+
+    def _counted(self):
+        if self._count is None:
+            self._count = approximate_count(self.queryset, self.count_limit)
+        return self._count
+
+    @property
+    def count(self):
+        return self._counted()[0]
+
+    @property
+    def count_exact(self):
+        return self._counted()[1]
+
+    def get_page(self, cursor=None):
+        raise NotImplementedError
+
+
+class KeysetPaginator(BasePaginator):
+    """
+    Pages of queryset in descending (default) or ascending order of keys, which
+    must identify rows uniquely - end them with the primary key.
+    """
+
+    def __init__(self, queryset, per_page, keys, descending=True, count_limit=None):
+        super().__init__(queryset, per_page, count_limit)
+        self.keys = tuple(keys)
+        self.descending = descending
+        self.fields = [queryset.model._meta.get_field('id' if key == 'pk' else key) for key in self.keys]
+
+    def _ordering(self, reverse=False):
+        prefix = '-' if self.descending != reverse else ''
+        return [prefix + key for key in self.keys]
+
+    def _seek(self, values, forward):
+        """Q of rows after (forward) or before the row with the given key values, in page order."""
+        lookup = 'lt' if self.descending == forward else 'gt'
+        condition = Q()
+        for position, key in enumerate(self.keys):
+            step = Q(**{f'{key}__{lookup}': values[position]})
+            for previous_key, value in zip(self.keys[:position], values):
+                step &= Q(**{previous_key: value})
+            condition |= step
+        # Redundant bound on the first key, so the database seeks in the index instead of scanning from the top
+        return Q(**{f'{self.keys[0]}__{lookup}e': values[0]}) & condition
+
+    def _key_values(self, obj):
+        return [getattr(obj, 'pk' if key == 'pk' else field.attname) for key, field in zip(self.keys, self.fields)]
+
+    def _parse(self, values):
+        if len(values) != len(self.keys):
+            return None
+        try:
+            return [field.to_python(value) for field, value in zip(self.fields, values)]
+        except Exception: # ValidationError or a value of a wrong type
+            return None
+
+    def get_page(self, cursor=None):
+        """The page the cursor points at; the first page for no or an invalid cursor."""
+        decoded = decode_cursor(cursor)
+        values = self._parse(decoded[1]) if decoded and decoded[0] in ('n', 'p') else None
+        if values is not None and decoded[0] == 'p':
+            rows = list(self.queryset.filter(self._seek(values, forward=False)).order_by(*self._ordering(reverse=True))[:self.per_page + 1])
+            if len(rows) > self.per_page:
+                rows = rows[:self.per_page][::-1]
+                return self._page(rows, has_next=True, has_previous=True)
+            # Reached the beginning - show a full first page instead of a short one
+            values = None
+        if values is None:
+            rows = list(self.queryset.order_by(*self._ordering())[:self.per_page + 1])
+            return self._page(rows[:self.per_page], has_next=len(rows) > self.per_page, has_previous=False)
+        rows = list(self.queryset.filter(self._seek(values, forward=True)).order_by(*self._ordering())[:self.per_page + 1])
+        return self._page(rows[:self.per_page], has_next=len(rows) > self.per_page, has_previous=True)
+
+    def _page(self, rows, has_next, has_previous):
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor('n', self._key_values(rows[-1]))
+        if rows and has_previous:
+            previous_cursor = encode_cursor('p', self._key_values(rows[0]))
+        return CursorPage(rows, self, next_cursor, previous_cursor)
+
+
+class OffsetPaginator(BasePaginator):
+    """Pages of a queryset in its own order (e.g. by relevance), with offset cursors."""
+
+    def get_page(self, cursor=None):
+        decoded = decode_cursor(cursor)
+        offset = 0
+        if decoded and decoded[0] == 'o' and len(decoded[1]) == 1 and isinstance(decoded[1][0], int):
+            offset = max(decoded[1][0], 0)
+        rows = list(self.queryset[offset:offset + self.per_page + 1])
+        if not rows and offset:
+            return self.get_page()
+        next_cursor = encode_cursor('o', [offset + self.per_page]) if len(rows) > self.per_page else None
+        previous_cursor = encode_cursor('o', [max(offset - self.per_page, 0)]) if offset else None
+        return CursorPage(rows[:self.per_page], self, next_cursor, previous_cursor)
@@ -0,0 +1,168 @@
+"""
+Downscaled renditions (thumbnails) of image documents.
+
+Grid tiles and the document page show a rendition instead of the original:
+a few kilobytes of WebP (JPEG where Pillow lacks WebP support) instead of a
+multi-megabyte photo. DOCUMENT_RENDITION_SIZES names the sizes - the longest
+side in pixels, images are never enlarged.
+
+Renditions are keyed by the SHA-256 hash of the original, like the blobs
+themselves (renditions/ab/cd/<hash>-<size>.webp in the blob storage), so
+documents and versions with the same content share them and a new version
+gets new ones. schedule_renditions() generates them in the background after
+an upload; a rendition still missing when it is requested (files uploaded
+before renditions existed, a task not finished yet) is generated then.
+All sizes come from one decode of the original, each downscaled from the
+next larger one, and JPEGs are decoded at reduced scale (Image.draft).
+
+The URLs carry the hash (?v=...), so rendition responses can be cached by
+the browser for a year. collect_garbage() deletes the renditions of content
+no longer stored.
+"""
+import logging
+import os
+import uuid
+
+from django.conf import settings
+from django.db import transaction
+
+from . import blobs
+from .tasks import run_in_background
+
+logger = logging.getLogger(__name__)
+
+RENDITION_PREFIX = 'renditions/'
+RENDITION_EXTENSIONS = ('png', 'jpg', 'jpeg')
+DEFAULT_SIZES = {'miniatura': 320, 'srednia': 800, 'duza': 1600}
+CONTENT_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+def get_sizes():
+    """{size name: longest side in pixels}"""
+    return getattr(settings, 'DOCUMENT_RENDITION_SIZES', DEFAULT_SIZES)
+
+
+def get_format():
+    """'webp', or 'jpeg' when configured so or when Pillow was built without WebP"""
+    from PIL import features
+
+    image_format = getattr(settings, 'DOCUMENT_RENDITION_FORMAT', 'webp')
+    if image_format == 'webp' and not features.check('webp'):
+        return 'jpeg'
+    return image_format
+
+
+def content_type():
+    return CONTENT_TYPES[get_format()]
+
+
+def has_renditions(extension):
+    return (extension or '').lower().lstrip('.') in RENDITION_EXTENSIONS
+
+
+def rendition_version(file_hash):
+    """?v= of rendition URLs - a prefix of the hash, so the URL changes with the content"""
+    return file_hash[:16]
+
+
+def rendition_name(file_hash, size_name, image_format=None):
+    """renditions/ab/cd/<sha256>-<size name>.<format>"""
+    extension = 'jpg' if (image_format or get_format()) == 'jpeg' else 'webp'
+    return f"{RENDITION_PREFIX}{file_hash[:2]}/{file_hash[2:4]}/{file_hash}-{size_name}.{extension}"
+
+
+def _prepare(image, image_format):
+    """Image in a mode the rendition format can store (JPEG has no alpha channel)."""
+    from PIL import Image
+
+    if image.mode == 'P' or image.mode == 'LA' or (image.mode == 'RGB' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+    if image.mode == 'RGBA':
+        if image_format == 'webp':
+            return image
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image if image.mode in ('RGB', 'L') else image.convert('RGB')
+
+
+def _save(image, path, image_format):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{uuid.uuid4().hex}.part"
+    try:
+        if image_format == 'webp':
+            image.save(temporary_path, 'WEBP', quality=80, method=4)
+        else:
+            image.save(temporary_path, 'JPEG', quality=82, optimize=True, progressive=True)
+        os.replace(temporary_path, path) # Concurrent generations of the same rendition cannot clash
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def generate_renditions(file_hash, name):
+    """Create the missing renditions of the stored file `name`. Returns True when all exist."""
+    from PIL import Image, ImageOps
+
+    storage = blobs.get_blob_storage()
+    image_format = get_format()
+    sizes = sorted(get_sizes().items(), key=lambda item: item[1], reverse=True)
+    missing = {size_name for size_name, _ in sizes if not storage.exists(rendition_name(file_hash, size_name, image_format))}
+    if not missing:
+        return True
+    try:
+        with Image.open(storage.path(name)) as original:
+            largest = max(pixels for size_name, pixels in sizes if size_name in missing)
+            original.draft('RGB', (largest, largest)) # JPEG only: decode at 1/2, 1/4 or 1/8 scale
+            image = _prepare(ImageOps.exif_transpose(original), image_format)
+            for size_name, pixels in sizes: # Largest first, each downscaled from the previous one
+                image.thumbnail((pixels, pixels), Image.Resampling.LANCZOS, reducing_gap=3.0)
+                if size_name in missing:
+                    _save(image, storage.path(rendition_name(file_hash, size_name, image_format)), image_format)
+    except (OSError, ValueError, Image.DecompressionBombError) as exc: # Damaged, unsupported or huge image
+        logger.warning("Nie udało się utworzyć miniatur pliku %s: %s", name, exc)
+        return False
+    return True
+
+
+def get_rendition_path(file_hash, name, size_name):
+    """Absolute path of a rendition, generated now if missing; None if it cannot be generated."""
+    storage = blobs.get_blob_storage()
+    rendition = rendition_name(file_hash, size_name)
+    if not storage.exists(rendition) and not generate_renditions(file_hash, name):
+        return None
+    return storage.path(rendition)
+
+
+def generate_many(files):
+    """generate_renditions() for (hash, name) pairs, each distinct content once (a single background task)."""
+    for file_hash, name in dict(files).items():
+        try:
+            generate_renditions(file_hash, name)
+        except Exception: # One broken file must not stop the rest of the batch
+            logger.exception("Tworzenie miniatur pliku %s nie powiodło się", name)
+
+
+def schedule_renditions(documents):
+    """Queue rendition generation for the image documents once the current transaction commits."""
+    files = [
+        (document.hash_pliku, document.plik.name) for document in documents
+        if document.plik and document.hash_pliku and has_renditions(os.path.splitext(document.plik.name)[1])
+    ]
+    if files:
+        transaction.on_commit(lambda: run_in_background(generate_many, files))
+
+
+def delete_renditions(file_hashes):
+    """Delete all renditions of the given contents (in any size and format)."""
+    storage = blobs.get_blob_storage()
+    names = []
+    for file_hash in set(file_hashes):
+        directory = f"{RENDITION_PREFIX}{file_hash[:2]}/{file_hash[2:4]}"
+        try:
+            _, files = storage.listdir(directory)
+        except FileNotFoundError:
+            continue
+        names += [f"{directory}/{file}" for file in files if file.startswith(f"{file_hash}-")]
+    return blobs.delete_files(storage, names)
@@ -0,0 +1,184 @@
+"""
+Full-text search for documents.
+
+Searchable text (name, description, tags, metadata, comments and the text
+extracted from the file by documents.extraction) is kept in an
+inverted index that is updated incrementally by the signals in
+documents.signals. The index lives behind a small backend interface; the
+backend is chosen with the DOCUMENT_SEARCH_BACKEND setting:
+
+    DOCUMENT_SEARCH_BACKEND = 'documents.search.SQLiteFTSBackend'
+
+SQLiteFTSBackend stores the index in an FTS5 virtual table and returns results
+ranked with bm25. DatabaseSearchBackend is the old icontains filter and is used
+automatically when FTS5 is not available (e.g. on another database engine).
+"""
+import functools
+import re
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection, transaction
+from django.db.models import FloatField, Q
+from django.db.models.expressions import RawSQL
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+DEFAULT_BACKEND = 'documents.search.SQLiteFTSBackend'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# unicode61 strips diacritics by decomposing characters; ł has no decomposition
+FOLD_TABLE = str.maketrans('łŁ', 'lL')
+
+
+def get_document_text(document):
+    """Collect searchable text of a document, one entry per indexed column."""
+    text = {
+        'nazwa': document.nazwa or '',
+        'opis': document.opis or '',
+        'tagi': ' '.join(tag.nazwa for tag in document.tagi.all()),
+        'metadane': ' '.join(f"{meta.klucz} {meta.wartosc}" for meta in document.metadane.all()),
+        'komentarze': ' '.join(comment.tresc for comment in document.komentarze.all() if comment.aktywny),
+        'tresc': next((
+            content.tekst for content in document.tresci.all()
+            if content.hash_pliku == document.hash_pliku and content.status == 'done'
+        ), ''),
+    }
+    return {column: value.translate(FOLD_TABLE) for column, value in text.items()}
+
+
+class BaseSearchBackend:
+    """Interface of a search backend."""
+
+    def search(self, queryset, query):
+        """Restrict queryset to documents matching query, best matches first."""
+        raise NotImplementedError
+
+    def index_documents(self, document_ids):
+        """(Re)index the given documents; ids that no longer exist are removed."""
+
+    def remove_documents(self, document_ids):
+        """Remove the given documents from the index."""
+
+    def rebuild(self):
+        """Rebuild the whole index from the database."""
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """Substring search with icontains - no index, no ranking."""
+
+    def search(self, queryset, query):
+        return queryset.filter(
+            Q(nazwa__icontains=query) | Q(opis__icontains=query) | Q(tagi__nazwa__icontains=query)
+        ).distinct()
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """
+    SQLite FTS5 index (table dokument_fts, rowid = document id).
+
+    Every word of the query must match (as a prefix, ignoring Polish diacritics)
+    in any of the indexed columns. Matches in the name weigh the most.
+    """
+    table = 'dokument_fts'
+    columns = ('nazwa', 'opis', 'tagi', 'metadane', 'komentarze', 'tresc')
+    weights = (10.0, 4.0, 6.0, 2.0, 1.0, 1.0)
+
+    @classmethod
+    def is_available(cls):
+        if connection.vendor != 'sqlite':
+            return False
+        return cls.table in connection.introspection.table_names()
+
+    @staticmethod
+    def build_match_expression(query):
+        """Turn user input into an FTS5 expression of quoted prefix terms."""
+        return ' '.join(f'"{token}"*' for token in TOKEN_RE.findall(query.translate(FOLD_TABLE)))
+
+    def search(self, queryset, query):
+        expression = self.build_match_expression(query)
+        if not expression:
+            return queryset.none()
+        document_table = queryset.model._meta.db_table
+        weights = ', '.join(str(weight) for weight in self.weights)
+        # One FTS query selects the matches; the rank of each row returned is a rowid lookup in the index
+        matches = RawSQL(f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s', [expression])
+        rank = RawSQL(
+            f'SELECT bm25({self.table}, {weights}) FROM {self.table} '
+            f'WHERE {self.table} MATCH %s AND {self.table}.rowid = "{document_table}"."id"',
+            [expression], output_field=FloatField(),
+        )
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank).order_by('search_rank', '-ostatnia_modyfikacja')
+
+    def index_documents(self, document_ids):
+        from .models import Document
+
+        document_ids = list(document_ids)
+        if not document_ids:
+            return
+        documents = Document.objects.filter(pk__in=document_ids).prefetch_related('tagi', 'metadane', 'komentarze', 'tresci')
+        column_list = ', '.join(self.columns)
+        placeholders = ', '.join(['%s'] * (len(self.columns) + 1))
+        with transaction.atomic(), connection.cursor() as cursor:
+            self._delete(cursor, document_ids)
+            for document in documents:
+                text = get_document_text(document)
+                cursor.execute(
+                    f'INSERT INTO {self.table} (rowid, {column_list}) VALUES ({placeholders})',
+                    [document.pk] + [text[column] for column in self.columns],
+                )
+
+    def remove_documents(self, document_ids):
+        document_ids = list(document_ids)
+        if document_ids:
+            with connection.cursor() as cursor:
+                self._delete(cursor, document_ids)
+
+    def rebuild(self):
+        from .models import Document
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {self.table}')
+            ids = list(Document.objects.values_list('pk', flat=True))
+            for start in range(0, len(ids), 500):
+                self.index_documents(ids[start:start + 500])
+            with connection.cursor() as cursor:
+                cursor.execute(f"INSERT INTO {self.table} ({self.table}) VALUES ('optimize')")
+
+    def _delete(self, cursor, document_ids):
+        placeholders = ', '.join(['%s'] * len(document_ids))
+        cursor.execute(f'DELETE FROM {self.table} WHERE rowid IN ({placeholders})', document_ids)
+
+
+@functools.lru_cache(maxsize=None)
+def get_search_backend():
+    backend_class = import_string(getattr(settings, 'DOCUMENT_SEARCH_BACKEND', DEFAULT_BACKEND))
+    if hasattr(backend_class, 'is_available') and not backend_class.is_available():
+        backend_class = DatabaseSearchBackend
+    return backend_class()
+
+
+@receiver(setting_changed)
+def reset_search_backend(setting, **kwargs):
+    if setting == 'DOCUMENT_SEARCH_BACKEND':
+        get_search_backend.cache_clear()
+
+
+def search_queryset(queryset, query):
+    """Restrict a Document queryset to matches of query, ranked best first."""
+    return get_search_backend().search(queryset, query)
+
+
+def schedule_reindex(document_ids):
+    """Reindex documents once the current transaction commits."""
+    document_ids = [pk for pk in document_ids if pk]
+    if document_ids:
+        transaction.on_commit(lambda: get_search_backend().index_documents(document_ids))
+
+
+def schedule_removal(document_ids):
+    document_ids = [pk for pk in document_ids if pk]
+    if document_ids:
+        transaction.on_commit(lambda: get_search_backend().remove_documents(document_ids))
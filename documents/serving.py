@@ -0,0 +1,169 @@
+"""
+File serving for downloads and previews.
+
+serve_file() answers conditional GETs (If-None-Match / If-Range) using the
+SHA-256 hash of the file as a strong ETag, and single byte ranges (HTTP
+Range) so resumed downloads and PDF viewers fetch only what they need.
+
+The transfer itself can be offloaded to the front web server with the
+DOCUMENT_SERVE_MODE setting:
+
+    'direct'            - served by Django (default). Whole files and ranges
+                          up to the end of the file go through FileResponse,
+                          which WSGI servers send with sendfile()
+    'x-sendfile'        - X-Sendfile header with the absolute path (Apache
+                          mod_xsendfile, lighttpd)
+    'x-accel-redirect'  - X-Accel-Redirect header with the file name under
+                          DOCUMENT_ACCEL_REDIRECT_PREFIX (nginx internal location)
+
+With offloading the front server handles Range itself; permission checks,
+activity logging and conditional GET still run in Django. Django then always
+answers 200, so is_new_transfer() looks at the Range the request carried.
+
+The Content-Type comes from the extension of the stored file, validated on
+upload, through a fixed map (CONTENT_TYPES). The type sniffed from the
+content (typ_mime) is never served: a .txt file holding HTML or a .png
+holding SVG would otherwise run its scripts in the application's origin.
+"""
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+CONTENT_TYPES = {
+    'pdf': 'application/pdf',
+    'txt': 'text/plain; charset=utf-8',
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'doc': 'application/msword',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'xls': 'application/vnd.ms-excel',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def served_content_type(name):
+    """Content-Type of a stored file, from its extension only."""
+    return CONTENT_TYPES.get(os.path.splitext(name)[1].lower().lstrip('.'), 'application/octet-stream')
+
+
+class RangeReader:
+    """File-like object returning at most `length` bytes of an already positioned file."""
+
+    def __init__(self, fileobj, length):
+        self.fileobj = fileobj
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.fileobj.close()
+
+
+def parse_range(header, size):
+    """(start, end) of a single satisfiable 'bytes=' range, 'unsatisfiable', or None to serve everything."""
+    match = RANGE_RE.match(header.strip()) if header else None
+    if match is None: # No header, multiple ranges or another unit - send the whole file
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first: # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            return 'unsatisfiable'
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return 'unsatisfiable'
+    return start, end
+
+
+def requested_range(request, size, etag):
+    """parse_range() of the request's Range header, ignored when If-Range names another version."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and not (etag and if_range == etag):
+        return None
+    return parse_range(request.META.get('HTTP_RANGE'), size)
+
+
+def file_etag(file_hash):
+    return f'"{file_hash}"' if file_hash else None
+
+
+def serve_file(request, field_file, file_hash, filename, as_attachment=True):
+    """Response serving a stored file (Document.plik / DocumentVersion.plik)."""
+    content_type = served_content_type(field_file.name) # Not from filename - document names are free text
+    etag = file_etag(file_hash)
+    if etag:
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            return response
+
+    mode = getattr(settings, 'DOCUMENT_SERVE_MODE', 'direct')
+    if mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = field_file.path
+    elif mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'DOCUMENT_ACCEL_REDIRECT_PREFIX', '/protected/')
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(field_file.name)
+    else:
+        response = _serve_directly(request, field_file, etag, content_type)
+    if mode in ('x-sendfile', 'x-accel-redirect'):
+        # The front server answers the range; remember where it starts for is_new_transfer()
+        requested = requested_range(request, field_file.size, etag)
+        response.range_start = None if requested == 'unsatisfiable' else (requested or (0,))[0]
+
+    response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    response['Cache-Control'] = 'private, no-cache' # Revalidate - permissions may change
+    if etag:
+        response['ETag'] = etag
+    return response
+
+
+def _serve_directly(request, field_file, etag, content_type):
+    size = field_file.size
+    requested = requested_range(request, size, etag)
+
+    if requested == 'unsatisfiable':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    fileobj = field_file.storage.open(field_file.name, 'rb')
+    if requested is None:
+        response = FileResponse(fileobj, content_type=content_type)
+    else:
+        start, end = requested
+        fileobj.seek(start)
+        if end == size - 1:
+            # Up to the end of file: the positioned file still qualifies for sendfile()
+            response = FileResponse(fileobj, content_type=content_type, status=206)
+        else:
+            response = FileResponse(RangeReader(fileobj, end - start + 1), content_type=content_type, status=206)
+        response['Content-Length'] = end - start + 1
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response.range_start = start
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def is_new_transfer(response):
+    """True for responses starting a transfer (not 304s, 416s or continuations of ranged downloads)."""
+    return response.status_code in (200, 206) and getattr(response, 'range_start', 0) == 0
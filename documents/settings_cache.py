@@ -0,0 +1,134 @@
+"""
+In-process cache of SystemSettings with typed accessors.
+
+All settings are loaded with a single query and kept in memory. Every change
+(SystemSettings.set_setting, admin saves, deletes - see documents.signals)
+bumps a version stamp stored in the database (SettingsVersion). Each process
+compares its cached stamp with the database at most once every
+SYSTEM_SETTINGS_CHECK_INTERVAL seconds (a primary key lookup), so other
+workers pick up changes within that interval; reads in between cost nothing.
+Queryset .update() bypasses the signals - call bump_version() after it.
+
+    from documents.settings_cache import get_int, get_size
+    max_size = get_size('MAX_UPLOAD_SIZE', 50 * 1024 * 1024)
+"""
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+TRUE_VALUES = {'1', 'true', 'yes', 'on', 'tak', 't', 'y'}
+FALSE_VALUES = {'0', 'false', 'no', 'off', 'nie', 'f', 'n', ''}
+
+SIZE_RE = re.compile(r'^\s*(\d+(?:[.,]\d+)?)\s*([kmgt]?i?b?)\s*$', re.IGNORECASE)
+SIZE_UNITS = {'': 1, 'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+
+class SettingsCache:
+    def __init__(self):
+        self._values = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _database_version(self):
+        from .models import SettingsVersion
+        return SettingsVersion.objects.filter(pk=1).values_list('wersja', flat=True).first() or 0
+
+    def get_all(self):
+        """{klucz: wartosc} of all settings, reloaded when the version stamp changed."""
+        interval = getattr(settings, 'SYSTEM_SETTINGS_CHECK_INTERVAL', 5)
+        now = time.monotonic()
+        values = self._values
+        if values is not None and now - self._checked_at < interval:
+            return values
+        with self._lock:
+            version = self._database_version()
+            if self._values is None or version != self._version:
+                from .models import SystemSettings
+                # Version read first: a change in between only causes one extra reload
+                self._values = dict(SystemSettings.objects.values_list('klucz', 'wartosc'))
+                self._version = version
+            self._checked_at = now
+            return self._values
+
+    def invalidate(self):
+        with self._lock:
+            self._values = None
+
+
+_cache = SettingsCache()
+
+
+def bump_version():
+    """Mark settings as changed for every process."""
+    from .models import SettingsVersion
+
+    if not SettingsVersion.objects.filter(pk=1).update(wersja=F('wersja') + 1):
+        try:
+            with transaction.atomic():
+                SettingsVersion.objects.create(pk=1, wersja=1)
+        except IntegrityError: # Created concurrently
+            SettingsVersion.objects.filter(pk=1).update(wersja=F('wersja') + 1)
+    _cache.invalidate()
+
+
+def get_all():
+    return _cache.get_all()
+
+
+def get_str(klucz, default=None):
+    return _cache.get_all().get(klucz, default)
+
+
+def get_int(klucz, default=0):
+    value = get_str(klucz)
+    try:
+        return int(value.strip())
+    except (AttributeError, ValueError):
+        return default
+
+
+def get_bool(klucz, default=False):
+    value = get_str(klucz)
+    if value is None:
+        return default
+    value = value.strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    return default
+
+
+def parse_size(value):
+    """'50MB', '512 KB', '1.5G', '1048576' -> bytes (binary units); None if not a size."""
+    match = SIZE_RE.match(value or '')
+    if match is None:
+        return None
+    number, unit = match.groups()
+    return int(float(number.replace(',', '.')) * SIZE_UNITS[unit[:1].lower()])
+
+
+def get_size(klucz, default=0):
+    size = parse_size(get_str(klucz))
+    return default if size is None else size
+
+
+def get_list(klucz, default=None):
+    """Comma separated value as a list of stripped, non-empty items."""
+    value = get_str(klucz)
+    if value is None:
+        return list(default or [])
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def format_size(size):
+    """Bytes as a short label used in messages, e.g. 50MB."""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:g}{unit}" if unit == 'B' else f"{round(size, 1):g}{unit}"
+        size /= 1024
@@ -0,0 +1,169 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
+from django.dispatch import receiver
+from guardian.models import GroupObjectPermission, UserObjectPermission
+
+from . import access, blobs, comments, search, settings_cache, stats
+from .models import Comment, Document, DocumentMetadata, DocumentVersion, Folder, SystemSettings, Tag
+
+
+@receiver(pre_save, sender=Document)
+def load_stored_document(sender, instance, raw=False, **kwargs):
+    """Instances not loaded from the database (built by hand with a pk) get the stored state, so saves are tracked as deltas"""
+    if not raw and instance.pk is not None and not hasattr(instance, '_loaded_values'):
+        instance.load_stored_values()
+
+
+@receiver(post_save, sender=Document)
+def update_stats_on_document_save(sender, instance, created, raw=False, **kwargs):
+    """Keep storage statistics in sync with created, versioned and soft-deleted documents"""
+    if raw:
+        return
+    stats.track_document_change(instance, created)
+
+
+@receiver(post_delete, sender=Document)
+def update_stats_on_document_delete(sender, instance, **kwargs):
+    stats.track_document_removal(instance)
+
+
+@receiver(post_save, sender=Folder)
+def update_stats_on_folder_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        stats.apply_delta(instance.wlasciciel_id, folders=1)
+        return
+    old_owner = getattr(instance, '_loaded_values', {}).get('wlasciciel_id')
+    if old_owner and old_owner != instance.wlasciciel_id:
+        stats.apply_delta(old_owner, folders=-1)
+        stats.apply_delta(instance.wlasciciel_id, folders=1)
+
+
+@receiver(post_delete, sender=Folder)
+def update_stats_on_folder_delete(sender, instance, **kwargs):
+    stats.apply_delta(instance.wlasciciel_id, folders=-1)
+
+
+# Search index
+
+@receiver(post_save, sender=Document)
+def index_document_on_save(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.schedule_reindex([instance.pk])
+
+
+@receiver(post_delete, sender=Document)
+def remove_document_from_index(sender, instance, **kwargs):
+    search.schedule_removal([instance.pk])
+
+
+@receiver(m2m_changed, sender=Document.tagi.through)
+def index_document_on_tags_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            search.schedule_reindex([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        search.schedule_reindex(pk_set)
+    elif action == 'pre_clear': # Tag removed from all its documents
+        search.schedule_reindex(list(instance.documents.values_list('pk', flat=True)))
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(post_save, sender=Tag)
+def index_documents_on_tag_change(sender, instance, raw=False, created=False, **kwargs):
+    if not raw and not created:
+        search.schedule_reindex(list(instance.documents.values_list('pk', flat=True)))
+
+
+@receiver(post_save, sender=DocumentMetadata)
+@receiver(post_delete, sender=DocumentMetadata)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def index_document_on_related_change(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search.schedule_reindex([instance.dokument_id])
+
+
+# Comment reply counts
+
+@receiver(post_save, sender=Comment)
+def update_reply_count_on_comment_save(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        comments.track_reply_change(instance, created)
+
+
+@receiver(post_delete, sender=Comment)
+def update_reply_count_on_comment_delete(sender, instance, **kwargs):
+    comments.track_reply_removal(instance)
+
+
+# Blob reference counts
+
+@receiver(post_save, sender=Document)
+def update_blob_references_on_document_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_name = None if created else getattr(instance, '_loaded_values', {}).get('plik')
+    new_name = instance.plik.name if instance.plik else None
+    if old_name != new_name:
+        blobs.add_reference(new_name, instance.hash_pliku, instance.rozmiar_pliku)
+        blobs.remove_reference(old_name)
+
+
+@receiver(post_save, sender=DocumentVersion)
+def update_blob_references_on_version_save(sender, instance, created, raw=False, **kwargs):
+    if created and not raw and instance.plik:
+        blobs.add_reference(instance.plik.name, instance.hash_pliku, instance.rozmiar_pliku)
+
+
+@receiver(post_delete, sender=Document)
+@receiver(post_delete, sender=DocumentVersion)
+def update_blob_references_on_delete(sender, instance, **kwargs):
+    if instance.plik:
+        blobs.remove_reference(instance.plik.name)
+
+
+# System settings cache
+
+@receiver(post_save, sender=SystemSettings)
+@receiver(post_delete, sender=SystemSettings)
+def invalidate_settings_cache(sender, raw=False, **kwargs):
+    settings_cache.bump_version()
+
+
+# Access table (documents.access)
+
+@receiver(post_save, sender=Document)
+@receiver(post_save, sender=Folder)
+def update_access_on_owner_change(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created or getattr(instance, '_loaded_values', {}).get('wlasciciel_id') != instance.wlasciciel_id:
+        access.sync_access(sender, [instance.pk])
+
+
+@receiver(post_save, sender=UserObjectPermission)
+@receiver(post_save, sender=GroupObjectPermission)
+@receiver(post_delete, sender=UserObjectPermission)
+@receiver(post_delete, sender=GroupObjectPermission)
+def update_access_on_permission_change(sender, instance, raw=False, created=None, **kwargs):
+    model = access.tracked_model(instance.content_type_id)
+    object_pk = str(instance.object_pk)
+    if raw or model is None or not object_pk.isdigit():
+        return
+    # created is None for deletions: a grant went away, rows can only shrink
+    access.request_sync(model, [int(object_pk)], create=created is not None)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def update_access_on_group_membership(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse: # user.groups.add(...)
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            access.sync_user_access([instance.pk])
+    elif action == 'pre_clear': # group.user_set.clear()
+        instance._access_members = list(instance.user_set.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        access.sync_user_access(getattr(instance, '_access_members', []))
+    elif action in ('post_add', 'post_remove'):
+        access.sync_user_access(list(pk_set))
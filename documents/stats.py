@@ -0,0 +1,126 @@
+"""
+Storage statistics for the dashboard.
+
+Totals are computed with SQL aggregates and kept as running totals in
+StorageStats (one global row with uzytkownik=None and one row per user).
+Rows are updated incrementally by the signals in documents.signals whenever a
+document is created, versioned, soft-deleted or removed, so reading them on the
+dashboard costs a single indexed lookup regardless of corpus size.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+
+
+def compute_totals(user=None):
+    """Compute totals with SQL aggregates (global when user is None)."""
+    from .models import Document, Folder
+
+    documents = Document.objects.filter(usunieto=False)
+    folders = Folder.objects.all()
+    if user is not None:
+        documents = documents.filter(wlasciciel=user)
+        folders = folders.filter(wlasciciel=user)
+
+    aggregates = documents.aggregate(count=Count('pk'), size=Sum('rozmiar_pliku'))
+    return {
+        'liczba_dokumentow': aggregates['count'] or 0,
+        'rozmiar_calkowity': aggregates['size'] or 0,
+        'liczba_folderow': folders.count(),
+    }
+
+
+def get_totals(user=None):
+    """Return running totals, computing and storing them on first access."""
+    from .models import StorageStats
+
+    stats = StorageStats.objects.filter(uzytkownik=user).first()
+    if stats is None:
+        try:
+            with transaction.atomic():
+                stats = StorageStats.objects.create(uzytkownik=user, **compute_totals(user))
+        except IntegrityError: # Created concurrently by another request (one row per user, one global row)
+            stats = StorageStats.objects.get(uzytkownik=user)
+    return {
+        'liczba_dokumentow': stats.liczba_dokumentow,
+        'rozmiar_calkowity': stats.rozmiar_calkowity,
+        'liczba_folderow': stats.liczba_folderow,
+    }
+
+
+def get_dashboard_stats(user):
+    """Totals shown on the dashboard: global for admins, own items for everybody else."""
+    if user.is_superuser or (hasattr(user, 'profile') and user.profile.is_admin):
+        return get_totals()
+    return get_totals(user)
+
+
+def apply_delta(owner_id, documents=0, size=0, folders=0):
+    """
+    Add deltas to the global totals and to the totals of owner_id.
+
+    Rows that do not exist yet are left alone - they are computed from
+    aggregates on first read, which already includes this change.
+    """
+    from .models import StorageStats
+
+    if not (documents or size or folders):
+        return
+    changes = {
+        'liczba_dokumentow': F('liczba_dokumentow') + documents,
+        'rozmiar_calkowity': F('rozmiar_calkowity') + size,
+        'liczba_folderow': F('liczba_folderow') + folders,
+    }
+    StorageStats.objects.filter(uzytkownik__isnull=True).update(**changes)
+    if owner_id:
+        StorageStats.objects.filter(uzytkownik_id=owner_id).update(**changes)
+
+
+def track_document_change(document, created):
+    """Apply the difference between the loaded and the saved state of a document."""
+    # Instances built by hand with a pk get the stored state in pre_save (signals.load_stored_document)
+    before = {} if created else getattr(document, '_loaded_values', {})
+    was_counted = bool(before) and not before.get('usunieto', False)
+    is_counted = not document.usunieto
+    old_owner = before.get('wlasciciel_id')
+    old_size = before.get('rozmiar_pliku') or 0
+    new_size = document.rozmiar_pliku or 0
+
+    if was_counted and old_owner != document.wlasciciel_id:
+        apply_delta(old_owner, documents=-1, size=-old_size)
+        was_counted = False
+
+    apply_delta(
+        document.wlasciciel_id,
+        documents=int(is_counted) - int(was_counted),
+        size=(new_size if is_counted else 0) - (old_size if was_counted else 0),
+    )
+
+
+def track_document_removal(document):
+    """Subtract a hard-deleted document from the totals."""
+    before = getattr(document, '_loaded_values', None) or {
+        'usunieto': document.usunieto,
+        'rozmiar_pliku': document.rozmiar_pliku,
+        'wlasciciel_id': document.wlasciciel_id,
+    }
+    if not before.get('usunieto', False):
+        apply_delta(before.get('wlasciciel_id'), documents=-1, size=-(before.get('rozmiar_pliku') or 0))
+
+
+def track_bulk_soft_delete(queryset):
+    """Subtract documents about to be soft-deleted with a queryset update()."""
+    per_owner = queryset.filter(usunieto=False).order_by().values('wlasciciel').annotate(
+        count=Count('pk'), size=Sum('rozmiar_pliku')
+    )
+    for row in per_owner:
+        apply_delta(row['wlasciciel'], documents=-row['count'], size=-(row['size'] or 0))
+
+
+def rebuild_totals():
+    """Recompute every stored row from aggregates."""
+    from .models import StorageStats
+
+    for stats in StorageStats.objects.select_related('uzytkownik'):
+        for field, value in compute_totals(stats.uzytkownik).items():
+            setattr(stats, field, value)
+        stats.save(update_fields=['liczba_dokumentow', 'rozmiar_calkowity', 'liczba_folderow', 'data_modyfikacji'])
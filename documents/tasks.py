@@ -0,0 +1,48 @@
+"""
+Background tasks run off the request path.
+
+Tasks are executed by a small in-process thread pool. Each task gets its own
+database connection, which is closed when the task finishes. Set
+DOCUMENT_TASKS_SYNC = True to run tasks inline instead (tests, management
+commands, debugging). DOCUMENT_TASK_WORKERS controls the size of the pool.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'DOCUMENT_TASK_WORKERS', 2),
+                thread_name_prefix='documents-task',
+            )
+        return _executor
+
+
+def _run_task(func, args, kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception("Zadanie w tle %s zakończyło się błędem", func.__name__)
+        raise
+    finally:
+        connection.close()
+
+
+def run_in_background(func, *args, **kwargs):
+    """Run func(*args, **kwargs) in the worker pool (inline with DOCUMENT_TASKS_SYNC)."""
+    if getattr(settings, 'DOCUMENT_TASKS_SYNC', False):
+        return func(*args, **kwargs)
+    return get_executor().submit(_run_task, func, args, kwargs)
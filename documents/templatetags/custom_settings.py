@@ -6,5 +6,5 @@ register = template.Library()
 
 @register.simple_tag
 def get_setting(key, default=None):
-    """Template tag do pobierania ustawień systemowych"""
+    """Template tag do pobierania ustawień systemowych (z pamięci podręcznej, bez zapytań)"""
     return SystemSettings.get_setting(key, default)
\ No newline at end of file
@@ -1,3 +1,1318 @@
-from django.test import TestCase
+import base64
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import Group, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from guardian.models import UserObjectPermission
+from guardian.shortcuts import assign_perm, remove_perm
+
+from users.models import Role
+from users.permissions import DOCUMENT_PERMISSIONS
+
+from . import access, activity, batch_upload, blobs, chunked_uploads, comments, export, folder_deletion, office_preview, search, settings_cache, trash, views
+from .models import (
+    ActivityLog, Comment, Document, DocumentContent, DocumentShare, FileBlob, Folder, FolderDeletionJob, ObjectAccess, StorageStats,
+    SystemSettings, Tag, UploadSession,
+)
+from .pagination import KeysetPaginator, OffsetPaginator, approximate_count, decode_cursor, encode_cursor
+from .stats import compute_totals, get_totals
+
+
+def query_plan(sql, params=()):
+    """SQLite's EXPLAIN QUERY PLAN of a statement as one string."""
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return ' | '.join(row[-1] for row in cursor.fetchall())
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'Query plans are checked on SQLite')
+class ListingQueryPlanTests(TestCase):
+    """The hot listing queries must be answered from the indexes declared in documents.models."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('plan', 'plan@example.com', 'haslo')
+        cls.folder = Folder.objects.create(nazwa='Folder', wlasciciel=cls.user)
+        cls.document = Document.objects.create(nazwa='Dokument', wlasciciel=cls.user, folder=cls.folder)
+
+    def assertUsesIndex(self, queryset, index_name):
+        sql, params = queryset.query.sql_with_params()
+        plan = query_plan(sql, params)
+        self.assertIn(f'USING INDEX {index_name}', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_document_list_pages(self):
+        paginator = KeysetPaginator(Document.objects.filter(usunieto=False), 20, ('ostatnia_modyfikacja', 'id'))
+        first_page = paginator.queryset.order_by(*paginator._ordering())[:21]
+        next_page = paginator.queryset.filter(
+            paginator._seek([timezone.now(), self.document.pk], forward=True)
+        ).order_by(*paginator._ordering())[:21]
+        self.assertUsesIndex(first_page, 'dokument_modyfikacja_id')
+        self.assertUsesIndex(next_page, 'dokument_modyfikacja_id')
+        self.assertIn('SEARCH dokument USING INDEX dokument_modyfikacja_id (ostatnia_modyfikacja<?)', query_plan(*next_page.query.sql_with_params()))
+
+    def test_folder_contents(self):
+        documents = Document.objects.filter(folder=self.folder, usunieto=False).order_by('nazwa')
+        self.assertUsesIndex(documents, 'dokument_folder_nazwa')
+        self.assertUsesIndex(Folder.objects.filter(rodzic=self.folder).order_by('nazwa'), 'folder_rodzic_nazwa')
+        plan = query_plan(*Folder.objects.with_counts().filter(rodzic=None).query.sql_with_params())
+        self.assertNotIn('SCAN', plan) # Counts look documents up by folder, whichever folder index
+
+    def test_owner_totals(self):
+        with CaptureQueriesContext(connection) as queries:
+            compute_totals(self.user)
+        document_queries = [query['sql'] for query in queries if '"dokument"' in query['sql']]
+        self.assertTrue(document_queries)
+        for sql in document_queries:
+            self.assertIn('USING INDEX dokument_wlasciciel_rozmiar', query_plan(sql))
+
+    def test_activity_log(self):
+        self.assertUsesIndex(ActivityLog.objects.order_by('-znacznik_czasu', '-id')[:51], 'log_znacznik_czasu_id')
+        self.assertUsesIndex(
+            ActivityLog.objects.filter(typ_aktywnosci='edycja').order_by('-znacznik_czasu', '-id')[:51],
+            'log_typ_znacznik_czasu_id',
+        )
+
+    def test_comments(self):
+        tree = Comment.objects.filter(dokument=self.document, aktywny=True).order_by('data_utworzenia', 'pk')
+        self.assertUsesIndex(tree, 'komentarz_dokument_data')
+        self.assertUsesIndex(Comment.objects.filter(rodzic=1, aktywny=True).order_by('data_utworzenia'), 'komentarz_rodzic_data')
+
+    def test_received_shares(self):
+        shares = DocumentShare.objects.filter(udostepnione_dla=self.user, aktywne=True, data_wygasniecia__gt=timezone.now())
+        self.assertUsesIndex(shares, 'udostepnienie_dla_wygasniecie')
+
+
+class PaginationTests(TestCase):
+    """Cursor pages cover a listing exactly once in both directions, equal sort keys included."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('strony', 'strony@example.com', 'haslo')
+        start = timezone.now()
+        documents = []
+        for i in range(7):
+            document = Document.objects.create(nazwa=f'Dokument {i}', wlasciciel=cls.user)
+            # Pairs of equal timestamps, told apart by id
+            Document.objects.filter(pk=document.pk).update(ostatnia_modyfikacja=start - timedelta(minutes=i // 2))
+            documents.append(document.pk)
+        cls.expected = [documents[i] for i in (1, 0, 3, 2, 5, 4, 6)] # Newest first, then the higher id
+
+    def paginator(self, per_page=3, **kwargs):
+        return KeysetPaginator(Document.objects.all(), per_page, ('ostatnia_modyfikacja', 'id'), **kwargs)
+
+    def pks(self, page):
+        return [document.pk for document in page]
+
+    def test_cursor_round_trip(self):
+        now = timezone.now()
+        cursor = encode_cursor('n', [now, 15])
+        self.assertNotIn('=', cursor)
+        self.assertEqual(decode_cursor(cursor), ('n', [str(now), 15]))
+        for cursor in (None, '', 'nie-base64!', base64.urlsafe_b64encode(b'{"a": 1}').decode()):
+            self.assertIsNone(decode_cursor(cursor), cursor)
+        self.assertIsNone(decode_cursor(base64.urlsafe_b64encode(b'[1, 2]').decode()))
+
+    def test_forward_and_back(self):
+        paginator = self.paginator()
+        pages = [paginator.get_page()]
+        while pages[-1].has_next():
+            pages.append(paginator.get_page(pages[-1].next_cursor))
+        self.assertEqual([self.pks(page) for page in pages], [self.expected[0:3], self.expected[3:6], self.expected[6:]])
+        self.assertFalse(pages[0].has_previous())
+        self.assertTrue(pages[-1].has_previous())
+
+        back = paginator.get_page(pages[-1].previous_cursor)
+        self.assertEqual(self.pks(back), self.expected[3:6])
+        self.assertTrue(back.has_next() and back.has_previous())
+        first = paginator.get_page(back.previous_cursor)
+        self.assertEqual(self.pks(first), self.expected[:3])
+        self.assertFalse(first.has_previous())
+
+    def test_previous_near_the_beginning_shows_a_full_first_page(self):
+        paginator = self.paginator()
+        second = paginator.get_page(encode_cursor('n', paginator._key_values(Document.objects.get(pk=self.expected[0]))))
+        self.assertEqual(self.pks(second), self.expected[1:4])
+        first = paginator.get_page(second.previous_cursor) # Only one row before it
+        self.assertEqual(self.pks(first), self.expected[:3])
+        self.assertFalse(first.has_previous())
+        self.assertEqual(first.next_cursor, paginator.get_page().next_cursor)
+
+    def test_page_boundaries(self):
+        exact = self.paginator(per_page=7).get_page()
+        self.assertEqual(self.pks(exact), self.expected)
+        self.assertFalse(exact.has_other_pages())
+        paginator = self.paginator(per_page=6)
+        last = paginator.get_page(paginator.get_page().next_cursor)
+        self.assertEqual(self.pks(last), self.expected[6:])
+        self.assertFalse(last.has_next())
+        empty = KeysetPaginator(Document.objects.none(), 3, ('ostatnia_modyfikacja', 'id')).get_page()
+        self.assertEqual((len(empty), empty.has_other_pages()), (0, False))
+
+    def test_ascending(self):
+        paginator = self.paginator(descending=False)
+        first = paginator.get_page()
+        second = paginator.get_page(first.next_cursor)
+        self.assertEqual(self.pks(first) + self.pks(second), self.expected[::-1][:6])
+
+    def test_invalid_cursors_show_the_first_page(self):
+        first = self.pks(self.paginator().get_page())
+        for cursor in ('zepsuty', encode_cursor('x', [1, 2]), encode_cursor('n', [1]), encode_cursor('n', ['wczoraj', 'abc'])):
+            self.assertEqual(self.pks(self.paginator().get_page(cursor)), first, cursor)
+
+    def test_offset_paginator(self):
+        paginator = OffsetPaginator(Document.objects.order_by('nazwa'), 3)
+        first = paginator.get_page()
+        self.assertEqual([document.nazwa for document in first], ['Dokument 0', 'Dokument 1', 'Dokument 2'])
+        self.assertFalse(first.has_previous())
+        second = paginator.get_page(first.next_cursor)
+        self.assertEqual(decode_cursor(second.previous_cursor), ('o', [0]))
+        last = paginator.get_page(second.next_cursor)
+        self.assertEqual([document.nazwa for document in last], ['Dokument 6'])
+        self.assertFalse(last.has_next())
+        self.assertEqual(decode_cursor(paginator.get_page(encode_cursor('o', [1])).previous_cursor), ('o', [0]))
+        for cursor in (encode_cursor('o', [100]), encode_cursor('o', ['3']), encode_cursor('o', [-5])):
+            self.assertEqual(len(paginator.get_page(cursor)), 3, cursor)
+            self.assertFalse(paginator.get_page(cursor).has_previous())
+
+    def test_approximate_count(self):
+        self.assertEqual(approximate_count(Document.objects.all(), limit=10), (7, True))
+        self.assertEqual(approximate_count(Document.objects.all(), limit=5), (5, False))
+        paginator = self.paginator(count_limit=7)
+        self.assertEqual((paginator.count, paginator.count_exact), (7, True))
+
+
+class FolderCountsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('liczniki', 'liczniki@example.com', 'haslo')
+        self.folder = Folder.objects.create(nazwa='Folder', wlasciciel=self.user)
+
+    def test_counts(self):
+        Folder.objects.create(nazwa='Podfolder', wlasciciel=self.user, rodzic=self.folder)
+        Document.objects.create(nazwa='Dokument', wlasciciel=self.user, folder=self.folder)
+        Document.objects.create(nazwa='W koszu', wlasciciel=self.user, folder=self.folder, usunieto=True)
+        folder = Folder.objects.with_counts().get(pk=self.folder.pk)
+        self.assertEqual((folder.doc_count, folder.subfolder_count), (1, 1))
+        empty = Folder.objects.with_counts().get(nazwa='Podfolder')
+        self.assertEqual((empty.doc_count, empty.subfolder_count), (0, 0))
+
+    def test_one_query_for_any_number_of_folders(self):
+        for i in range(5):
+            child = Folder.objects.create(nazwa=f'Podfolder {i}', wlasciciel=self.user, rodzic=self.folder)
+            Document.objects.create(nazwa=f'Dokument {i}', wlasciciel=self.user, folder=child)
+        with self.assertNumQueries(1):
+            counts = [(folder.doc_count, folder.subfolder_count) for folder in Folder.objects.with_counts()]
+        self.assertEqual(sorted(counts), [(0, 5)] + [(1, 0)] * 5)
+
+    def test_folder_list_queries_do_not_grow(self):
+        # Called directly - its URL (admin/folders/) is taken by the Django admin
+        def count_queries():
+            request = RequestFactory().get('/')
+            request.user = User.objects.get(pk=self.user.pk)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(views.folder_list(request).status_code, 200)
+            return len(queries)
+
+        Folder.objects.create(nazwa='Podfolder', wlasciciel=self.user, rodzic=self.folder)
+        count_queries()
+        before = count_queries()
+        for i in range(4):
+            root = Folder.objects.create(nazwa=f'Główny {i}', wlasciciel=self.user)
+            Folder.objects.create(nazwa=f'Podfolder {i}', wlasciciel=self.user, rodzic=root)
+        self.assertEqual(count_queries(), before)
+
+
+class FolderPathTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('sciezki', 'sciezki@example.com', 'haslo')
+
+    def folder(self, name, parent=None, **kwargs):
+        return Folder.objects.create(nazwa=name, wlasciciel=self.user, rodzic=parent, **kwargs)
+
+    def test_moving_a_subtree_rewrites_its_paths(self):
+        a, d = self.folder('A'), self.folder('D')
+        b = self.folder('B', a)
+        c = self.folder('C', b)
+        self.assertEqual(c.sciezka, f'/{a.pk}/{b.pk}/{c.pk}/')
+
+        b.rodzic = d
+        b.save()
+        c.refresh_from_db()
+        self.assertEqual(b.sciezka, f'/{d.pk}/{b.pk}/')
+        self.assertEqual(c.sciezka, f'/{d.pk}/{b.pk}/{c.pk}/')
+        self.assertEqual(c.get_ancestor_ids(), [d.pk, b.pk])
+        self.assertEqual(list(a.get_descendants()), [])
+
+        b.rodzic = None
+        b.save()
+        c.refresh_from_db()
+        self.assertEqual(c.sciezka, f'/{b.pk}/{c.pk}/')
+
+    def test_subtree_boundaries(self):
+        root = self.folder('Główny', pk=1)
+        five = self.folder('Piąty', root, pk=5)
+        fifty = self.folder('Pięćdziesiąty', root, pk=50)
+        below_five = self.folder('Pod piątym', five, pk=51)
+        self.assertEqual(set(Folder.objects.subtree('/1/5/')), {five, below_five})
+        self.assertEqual(set(Folder.objects.subtree('/1/50/')), {fifty})
+        self.assertEqual(set(Folder.objects.subtree('/1/')), {root, five, fifty, below_five})
+
+    def test_deep_trees(self):
+        parent = None
+        for depth in range(80):
+            parent = self.folder(f'Poziom {depth}', parent, pk=1_000_000 + depth)
+        parent.refresh_from_db()
+        self.assertGreater(len(parent.sciezka), 255)
+        self.assertEqual(len(parent.get_ancestor_ids()), 79)
+        self.assertEqual(Folder.objects.subtree(Folder.objects.get(pk=1_000_000).sciezka).count(), 80)
+
+
+class CommentTreeTests(TestCase):
+    """Comment threads load in one query and keep their reply counts in step with saves and deletes."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('komentujacy', 'komentujacy@example.com', 'haslo')
+        self.document = Document.objects.create(nazwa='Dokument', wlasciciel=self.user)
+
+    def comment(self, tresc, rodzic=None, **kwargs):
+        return Comment.objects.create(dokument=self.document, uzytkownik=self.user, tresc=tresc, rodzic=rodzic, **kwargs)
+
+    def replies(self, comment):
+        return Comment.objects.values_list('liczba_odpowiedzi', flat=True).get(pk=comment.pk)
+
+    def test_tree_in_one_query(self):
+        first = self.comment('Pierwszy')
+        second = self.comment('Drugi')
+        reply_a = self.comment('Odpowiedź A', first)
+        self.comment('Odpowiedź B', first)
+        hidden = self.comment('Ukryta', second, aktywny=False)
+        self.comment('Pod ukrytą', hidden)
+        deep = reply_a
+        for level in range(5):
+            deep = self.comment(f'Poziom {level + 2}', deep)
+        Comment.objects.create(dokument=Document.objects.create(nazwa='Inny', wlasciciel=self.user), uzytkownik=self.user, tresc='Obcy')
+
+        with self.assertNumQueries(1):
+            roots = comments.load_comment_tree(self.document)
+            flat = comments.flatten_comment_tree(roots)
+            self.assertEqual(roots[0].uzytkownik.profile.user_id, self.user.pk) # Joined, no extra query
+        self.assertEqual([comment.tresc for comment in roots], ['Pierwszy', 'Drugi'])
+        self.assertEqual([reply.tresc for reply in roots[0].replies], ['Odpowiedź A', 'Odpowiedź B'])
+        self.assertEqual(roots[1].replies, []) # Replies below an inactive comment are hidden with it
+        self.assertEqual(
+            [(comment.tresc, comment.depth, comment.indent) for comment in flat],
+            [('Pierwszy', 0, 0), ('Odpowiedź A', 1, 1)]
+            + [(f'Poziom {level}', level, min(level, comments.MAX_INDENT_DEPTH)) for level in range(2, 7)]
+            + [('Odpowiedź B', 1, 1), ('Drugi', 0, 0)],
+        )
+
+    def test_reply_counts(self):
+        parent = self.comment('Rodzic')
+        other = self.comment('Inny rodzic')
+        replies = [self.comment(f'Odpowiedź {i}', parent) for i in range(3)]
+        self.assertEqual(self.replies(parent), 3)
+
+        replies[0].aktywny = False
+        replies[0].save()
+        self.assertEqual(self.replies(parent), 2)
+        replies[0].aktywny = True
+        replies[0].save()
+        self.assertEqual(self.replies(parent), 3)
+
+        replies[1].rodzic = other
+        replies[1].save()
+        self.assertEqual((self.replies(parent), self.replies(other)), (2, 1))
+
+        replies[2].delete()
+        self.assertEqual(self.replies(parent), 1)
+        inactive = self.comment('Nieaktywna', parent, aktywny=False)
+        self.assertEqual(self.replies(parent), 1)
+        inactive.delete()
+        self.assertEqual(self.replies(parent), 1)
+
+        # An instance built by hand (not loaded) still counts as a reply when deleted
+        Comment(pk=replies[0].pk, dokument=self.document, uzytkownik=self.user, rodzic=parent, aktywny=True).delete()
+        self.assertEqual(self.replies(parent), 0)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('szukajacy', 'szukajacy@example.com', 'haslo')
+
+    def document(self, name, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True): # The index is updated on commit
+            return Document.objects.create(nazwa=name, wlasciciel=self.user, **kwargs)
+
+    def names(self, query):
+        return [document.nazwa for document in search.search_queryset(Document.objects.all(), query)]
+
+    def skip_without_fts(self):
+        if not search.SQLiteFTSBackend.is_available():
+            self.skipTest('SQLite built without FTS5')
+
+    def test_name_matches_rank_first(self):
+        self.skip_without_fts()
+        self.document('Notatka', opis='Budżet wspomniany tylko w opisie')
+        self.document('Budżet 2024')
+        self.assertEqual(self.names('budżet'), ['Budżet 2024', 'Notatka'])
+        self.assertIsInstance(search.get_search_backend(), search.SQLiteFTSBackend)
+
+    def test_prefixes_and_every_word(self):
+        self.skip_without_fts()
+        self.document('Sprawozdanie finansowe')
+        self.document('Sprawozdanie kadrowe')
+        self.assertEqual(len(self.names('spraw')), 2)
+        self.assertEqual(self.names('spraw fin'), ['Sprawozdanie finansowe'])
+        self.assertEqual(self.names('"*)'), []) # Punctuation only - no FTS syntax reaches MATCH
+
+    def test_diacritics_are_folded(self):
+        self.skip_without_fts()
+        self.document('Żółta łódź')
+        self.assertEqual(self.names('zolta lodz'), ['Żółta łódź'])
+        self.assertEqual(self.names('ŁÓDŹ'), ['Żółta łódź'])
+        self.assertEqual(self.names('Żół'), ['Żółta łódź'])
+
+    def test_database_backend_fallback(self):
+        search.get_search_backend.cache_clear()
+        self.addCleanup(search.get_search_backend.cache_clear)
+        with mock.patch.object(search.SQLiteFTSBackend, 'is_available', return_value=False):
+            self.assertIsInstance(search.get_search_backend(), search.DatabaseSearchBackend)
+        self.document('Umowa najmu', opis='lokal przy ul. Długiej')
+        self.document('Faktura')
+        with self.settings(DOCUMENT_SEARCH_BACKEND='documents.search.DatabaseSearchBackend'):
+            self.assertEqual(self.names('najmu'), ['Umowa najmu'])
+            self.assertEqual(self.names('DŁUGIEJ'.lower()), ['Umowa najmu'])
+
+
+class SettingsCacheTests(TestCase):
+    def setUp(self):
+        settings_cache._cache.invalidate()
+        self.addCleanup(settings_cache._cache.invalidate)
+
+    def test_parse_size(self):
+        cases = {
+            '1048576': 1048576, '50MB': 50 * 1024 ** 2, '512 KB': 512 * 1024, '1.5G': int(1.5 * 1024 ** 3),
+            '1,5 g': int(1.5 * 1024 ** 3), '10MiB': 10 * 1024 ** 2, '2t': 2 * 1024 ** 4, ' 7b ': 7,
+        }
+        for value, expected in cases.items():
+            self.assertEqual(settings_cache.parse_size(value), expected, value)
+        for value in ('', None, 'dużo', '-1', '5 XB', '1.2.3M'):
+            self.assertIsNone(settings_cache.parse_size(value), value)
+
+    def test_typed_accessors(self):
+        SystemSettings.set_setting('LIMIT', ' 12 ')
+        SystemSettings.set_setting('WLACZONE', 'Tak')
+        SystemSettings.set_setting('ROZMIAR', 'za duży')
+        SystemSettings.set_setting('LISTA', 'pdf, ,txt ')
+        self.assertEqual(settings_cache.get_int('LIMIT'), 12)
+        self.assertTrue(settings_cache.get_bool('WLACZONE'))
+        self.assertEqual(settings_cache.get_size('ROZMIAR', 99), 99)
+        self.assertEqual(settings_cache.get_list('LISTA'), ['pdf', 'txt'])
+        self.assertEqual(settings_cache.get_int('BRAK', 3), 3)
+
+    @override_settings(SYSTEM_SETTINGS_CHECK_INTERVAL=3600)
+    def test_reads_between_checks_are_free(self):
+        SystemSettings.set_setting('LIMIT', '1')
+        settings_cache.get_all()
+        with self.assertNumQueries(0):
+            self.assertEqual(settings_cache.get_int('LIMIT'), 1)
+
+    def test_other_processes_see_the_version_bump(self):
+        other_process = settings_cache.SettingsCache()
+        SystemSettings.set_setting('LIMIT', '1')
+        with self.settings(SYSTEM_SETTINGS_CHECK_INTERVAL=3600):
+            self.assertEqual(other_process.get_all()['LIMIT'], '1')
+            SystemSettings.set_setting('LIMIT', '2')
+            self.assertEqual(settings_cache.get_str('LIMIT'), '2') # This process invalidated its own cache
+            self.assertEqual(other_process.get_all()['LIMIT'], '1') # Until its next check
+        with self.settings(SYSTEM_SETTINGS_CHECK_INTERVAL=0):
+            self.assertEqual(other_process.get_all()['LIMIT'], '2')
+            with self.assertNumQueries(1): # Unchanged stamp - no reload
+                other_process.get_all()
+
+            SystemSettings.objects.filter(klucz='LIMIT').update(wartosc='3')
+            self.assertEqual(other_process.get_all()['LIMIT'], '2') # update() sends no signals...
+            settings_cache.bump_version()
+            self.assertEqual(other_process.get_all()['LIMIT'], '3') # ...hence bump_version()
+
+
+class StoredFilesTestCase(TestCase):
+    """Tests storing files, in a temporary MEDIA_ROOT removed afterwards."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp(prefix='documents-tests-')
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=media_root, DOCUMENT_TASKS_SYNC=True, ACTIVITY_LOG_SYNC=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def make_user(self, username, role=Role.EDITOR):
+        user = User.objects.create_user(username, f'{username}@example.com', 'haslo')
+        user.profile.rola, _ = Role.objects.get_or_create(nazwa=role)
+        user.profile.save()
+        return User.objects.get(pk=user.pk)
+
+
+class UploadContentTypeTests(StoredFilesTestCase):
+    """Files are served with the type of their extension; content contradicting it is refused."""
+
+    HTML = b'<html><body><script>alert(document.cookie)</script></body></html>'
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('edytor')
+        self.client.force_login(self.user)
+
+    def test_html_uploaded_as_txt_is_refused(self):
+        response = self.client.post('/documents/upload/', {
+            'plik': SimpleUploadedFile('notatka.txt', self.HTML), 'nazwa': 'Notatka', 'status': 'draft',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Zawartość pliku nie odpowiada jego rozszerzeniu')
+        self.assertFalse(Document.objects.exists())
+
+    def test_html_in_batch_is_skipped(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/documents/upload/batch/', {
+                'pliki': [SimpleUploadedFile('notatka.txt', self.HTML), SimpleUploadedFile('tekst.txt', b'zwykly tekst')],
+                'status': 'draft',
+            })
+        self.assertEqual(list(Document.objects.values_list('nazwa', flat=True)), ['tekst.txt'])
+
+    def test_preview_ignores_sniffed_type(self):
+        response = self.client.post('/documents/upload/', {
+            'plik': SimpleUploadedFile('notatka.txt', b'zwykly tekst'), 'nazwa': 'Notatka', 'status': 'draft',
+        })
+        document = Document.objects.get()
+        Document.objects.filter(pk=document.pk).update(typ_mime='text/html') # Whatever was sniffed on upload
+        response = self.client.get(f'/documents/{document.pk}/preview/')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertTrue(response['Content-Disposition'].startswith('inline'))
+
+
+class DocumentContentTests(TestCase):
+    def test_one_row_for_the_current_file(self):
+        user = User.objects.create_user('tresc', 'tresc@example.com', 'haslo')
+        document = Document.objects.create(nazwa='Dokument', wlasciciel=user)
+        DocumentContent.objects.create(dokument=document, hash_pliku='a' * 64)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            DocumentContent.objects.create(dokument=document, hash_pliku='a' * 64)
+        # A concurrent extraction losing the race gets the existing row
+        content, created = DocumentContent.objects.get_or_create(dokument=document, wersja=None, defaults={'hash_pliku': 'b' * 64})
+        self.assertFalse(created)
+        self.assertEqual(content.hash_pliku, 'a' * 64)
+
+
+class StorageStatsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('statystyki', 'statystyki@example.com', 'haslo')
+        self.other = User.objects.create_user('inny', 'inny@example.com', 'haslo')
+
+    def test_single_global_row(self):
+        get_totals()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            StorageStats.objects.create(uzytkownik=None)
+        self.assertEqual(get_totals()['liczba_dokumentow'], 0)
+
+    def test_save_of_instance_built_by_hand(self):
+        document = Document.objects.create(nazwa='Dokument', wlasciciel=self.user, rozmiar_pliku=100)
+        get_totals(), get_totals(self.user), get_totals(self.other)
+        with CaptureQueriesContext(connection) as queries:
+            Document(
+                pk=document.pk, nazwa='Dokument', wlasciciel=self.other, rozmiar_pliku=300, data_utworzenia=document.data_utworzenia,
+            ).save()
+        # A delta against the stored row, not a rebuild of every statistics row
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT COUNT')])
+        self.assertEqual(get_totals(), {'liczba_dokumentow': 1, 'rozmiar_calkowity': 300, 'liczba_folderow': 0})
+        self.assertEqual(get_totals(self.user)['liczba_dokumentow'], 0)
+        self.assertEqual(get_totals(self.other), compute_totals(self.other))
+
+
+class ChunkedUploadTests(StoredFilesTestCase):
+    PDF = b'%PDF-1.4\n' + bytes(range(256)) * 8
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('edytor')
+        self.client.force_login(self.user)
+
+    def start(self, filename='raport.pdf', size=None):
+        response = self.client.post('/uploads/', {'nazwa_pliku': filename, 'rozmiar': len(self.PDF) if size is None else size})
+        self.assertEqual(response.status_code, 201)
+        return response
+
+    def send(self, url, data, offset, **headers):
+        return self.client.patch(url, data, content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset), **headers)
+
+    def stored_content(self, session):
+        with blobs.get_blob_storage().open(session.plik) as stored:
+            return stored.read()
+
+    def test_resume_after_short_chunk(self):
+        url = self.start()['Location']
+        session = UploadSession.objects.get()
+        # The connection drops after 1000 bytes of the whole file
+        chunked_uploads.append_chunk(session, 0, io.BytesIO(self.PDF[:1000]), len(self.PDF))
+        self.assertEqual(self.client.head(url)['Upload-Offset'], '1000')
+
+        response = self.send(url, self.PDF[1000:], 1000)
+        self.assertTrue(response.json()['complete'])
+        session.refresh_from_db()
+        self.assertEqual(session.hash_pliku, hashlib.sha256(self.PDF).hexdigest())
+        self.assertEqual(self.stored_content(session), self.PDF)
+
+    def test_wrong_checksum(self):
+        url = self.start()['Location']
+        wrong = 'sha256 ' + base64.b64encode(hashlib.sha256(b'inne dane').digest()).decode()
+        response = self.send(url, self.PDF, 0, HTTP_UPLOAD_CHECKSUM=wrong)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Upload-Offset'], '0')
+
+        right = 'sha256 ' + base64.b64encode(hashlib.sha256(self.PDF).digest()).decode()
+        response = self.send(url, self.PDF, 0, HTTP_UPLOAD_CHECKSUM=right)
+        self.assertTrue(response.json()['complete'])
+
+    def test_wrong_offset_is_a_conflict(self):
+        url = self.start()['Location']
+        self.send(url, self.PDF[:100], 0)
+        response = self.send(url, self.PDF[50:150], 50)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '100')
+        self.assertEqual(UploadSession.objects.get().przeslano, 100)
+
+    def test_zero_byte_file(self):
+        response = self.start('pusty.txt', size=0)
+        self.assertTrue(response.json()['complete'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/documents/upload/', {'przeslanie': response.json()['id'], 'nazwa': 'Pusty', 'status': 'draft'})
+        document = Document.objects.get()
+        self.assertEqual(document.rozmiar_pliku, 0)
+        self.assertEqual(document.hash_pliku, hashlib.sha256(b'').hexdigest())
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_failed_completion_is_retried_with_an_empty_chunk(self):
+        for step in ('move_into_place', 'register_blob'): # Before and after the part file is moved
+            url = self.start()['Location']
+            session = UploadSession.objects.get()
+            with mock.patch.object(blobs, step, side_effect=OSError('Brak miejsca na dysku')):
+                with self.assertRaises(OSError):
+                    chunked_uploads.append_chunk(session, 0, io.BytesIO(self.PDF), len(self.PDF))
+            session.refresh_from_db()
+            self.assertEqual((session.przeslano, session.status, session.zapis_od), (len(self.PDF), UploadSession.STATUS_UPLOADING, None))
+            self.assertFalse(self.client.get(url).json()['complete'])
+
+            self.assertEqual(self.send(url, b'', 100).status_code, 400) # Empty chunks only finish a file
+            response = self.send(url, b'', len(self.PDF))
+            self.assertTrue(response.json()['complete'], step)
+            session.refresh_from_db()
+            self.assertEqual(session.hash_pliku, hashlib.sha256(self.PDF).hexdigest())
+            self.assertEqual(self.stored_content(session), self.PDF)
+            self.assertTrue(FileBlob.objects.filter(nazwa=session.plik).exists())
+            chunked_uploads.abort_session(session)
+
+    def test_second_attach_fails(self):
+        url = self.start()['Location']
+        self.send(url, self.PDF, 0)
+        session = UploadSession.objects.get()
+        chunked_uploads.attach_upload(Document(nazwa='Pierwszy', wlasciciel=self.user), session)
+        with self.assertRaises(ValidationError):
+            chunked_uploads.attach_upload(Document(nazwa='Drugi', wlasciciel=self.user), session)
+
+
+class BatchUploadTests(StoredFilesTestCase):
+    """ingest_batch creates documents of plain files and ZIP members in bulk, skipping what it cannot accept."""
+
+    PDF = b'%PDF-1.4\n' + b'raport' * 50
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('edytor')
+        self.folder = Folder.objects.create(nazwa='Paczki', wlasciciel=self.user)
+
+    def archive(self, name, members):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for member, content in members.items():
+                archive.writestr(member, content)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def ingest(self, *files, **kwargs):
+        return batch_upload.ingest_batch(files, self.user, folder=self.folder, adres_ip='10.0.0.3', **kwargs)
+
+    def test_files_and_archive_members(self):
+        tags = [Tag.objects.create(nazwa='faktury'), Tag.objects.create(nazwa='2024')]
+        result = self.ingest(
+            SimpleUploadedFile('notatka.txt', b'Zwykla notatka'),
+            SimpleUploadedFile('program.exe', b'MZ'),
+            self.archive('paczka.zip', {
+                'umowy/umowa.pdf': self.PDF, 'umowy/kopia.pdf': self.PDF, 'lista.txt': b'1, 2, 3',
+                'falszywy.pdf': b'to nie jest PDF', '__MACOSX/._umowa.pdf': b'x', '.DS_Store': b'x', 'pusty/': b'',
+            }),
+            tags=tags, status='published',
+        )
+        self.assertEqual(sorted(document.nazwa for document in result.documents), ['kopia.pdf', 'lista.txt', 'notatka.txt', 'umowa.pdf'])
+        self.assertEqual(dict(result.skipped), {
+            'program.exe': 'Nieobsługiwany format pliku', 'falszywy.pdf': 'Zawartość pliku nie odpowiada jego rozszerzeniu',
+        })
+
+        documents = Document.objects.filter(folder=self.folder)
+        self.assertEqual(documents.count(), 4)
+        self.assertEqual(set(documents.values_list('status', flat=True)), {'published'})
+        for document in documents:
+            self.assertEqual(set(document.tagi.all()), set(tags))
+            stored = blobs.get_blob_storage().open(document.plik.name).read()
+            self.assertEqual(hashlib.sha256(stored).hexdigest(), document.hash_pliku)
+        self.assertEqual(FileBlob.objects.get(nazwa=documents.get(nazwa='umowa.pdf').plik.name).liczba_odwolan, 2) # Stored once
+
+        granted = set(UserObjectPermission.objects.filter(user=self.user).values_list('object_pk', 'permission__codename'))
+        self.assertEqual(granted, {(str(document.pk), perm) for document in documents for perm in DOCUMENT_PERMISSIONS})
+        self.assertEqual(set(Document.objects.accessible_by(self.user)), set(documents))
+        self.assertEqual(get_totals(self.user), compute_totals(self.user))
+        self.assertEqual(get_totals(self.user)['liczba_dokumentow'], 4)
+
+        entry = ActivityLog.objects.get(typ_aktywnosci='tworzenie')
+        self.assertEqual((entry.folder, entry.adres_ip), (self.folder, '10.0.0.3'))
+        self.assertIn('Wgrano 4 dokumentów', entry.szczegoly)
+        self.assertIn('pominięto 2 plików', entry.szczegoly)
+
+    def test_bad_archives_are_skipped(self):
+        broken = self.archive('uszkodzone.zip', {'a.txt': b'tekst ' * 100})
+        broken = SimpleUploadedFile('uszkodzone.zip', broken.read()[:-40])
+        result = self.ingest(SimpleUploadedFile('nie_zip.zip', b'to nie archiwum'), broken, SimpleUploadedFile('ok.txt', b'ok'))
+        self.assertEqual([document.nazwa for document in result.documents], ['ok.txt'])
+        self.assertEqual(dict(result.skipped), {'nie_zip.zip': 'Uszkodzone archiwum ZIP', 'uszkodzone.zip': 'Uszkodzone archiwum ZIP'})
+
+    def test_archive_limits(self):
+        members = {f'plik{i}.txt': b'tresc ' * 20 for i in range(3)}
+        with self.settings(BATCH_UPLOAD_MAX_ARCHIVE_MEMBERS=2):
+            result = self.ingest(self.archive('duzo.zip', members))
+        self.assertEqual((result.documents, result.skipped), ([], [('duzo.zip', 'Archiwum zawiera ponad 2 plików')]))
+        with self.settings(BATCH_UPLOAD_MAX_ARCHIVE_SIZE=300):
+            result = self.ingest(self.archive('bomba.zip', members))
+        self.assertEqual(result.documents, [])
+        self.assertIn('Archiwum po rozpakowaniu przekracza', result.skipped[0][1])
+        with self.settings(BATCH_UPLOAD_MAX_FILES=2):
+            result = self.ingest(self.archive('trzy.zip', members))
+        self.assertEqual(len(result.documents), 2)
+        self.assertEqual(result.skipped, [('plik2.txt', 'Przekroczono limit 2 plików w jednej paczce')])
+        self.assertFalse(ActivityLog.objects.filter(szczegoly__contains='Wgrano 0').exists())
+
+    def test_archives_are_closed(self):
+        opened = []
+        real_zipfile = zipfile.ZipFile
+
+        def record(*args, **kwargs):
+            archive = real_zipfile(*args, **kwargs)
+            opened.append(archive)
+            return archive
+
+        archives = [self.archive('a.zip', {'a.txt': b'a'}), self.archive('b.zip', {'b.txt': b'b'})]
+        with mock.patch.object(batch_upload.zipfile, 'ZipFile', side_effect=record):
+            result = self.ingest(*archives)
+        self.assertEqual(len(result.documents), 2)
+        self.assertEqual(len(opened), 2)
+        self.assertTrue(all(archive.fp is None for archive in opened))
+
+
+class BlobReferenceTests(StoredFilesTestCase):
+    PDF = b'%PDF-1.4\n' + b'tresc' * 100
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('edytor')
+
+    def create_document(self, name):
+        return Document.objects.create(nazwa=name, wlasciciel=self.user, plik=SimpleUploadedFile(f'{name}.pdf', self.PDF))
+
+    def test_same_content_is_stored_once(self):
+        first, second = self.create_document('pierwszy'), self.create_document('drugi')
+        self.assertEqual(first.plik.name, second.plik.name)
+        self.assertEqual(FileBlob.objects.get().liczba_odwolan, 2)
+
+        first.delete()
+        self.assertEqual(blobs.collect_garbage(grace_period=timedelta(0)), [])
+        self.assertTrue(blobs.get_blob_storage().exists(second.plik.name))
+
+        second.delete()
+        self.assertEqual(FileBlob.objects.get().liczba_odwolan, 0)
+        self.assertEqual([blob.nazwa for blob in blobs.collect_garbage(grace_period=timedelta(0))], [second.plik.name])
+        self.assertFalse(blobs.get_blob_storage().exists(second.plik.name))
+        self.assertFalse(FileBlob.objects.exists())
+
+    def test_garbage_collection_rechecks_counts(self):
+        document = self.create_document('dokument')
+        FileBlob.objects.update(liczba_odwolan=0) # Counter out of sync with the database
+        self.assertEqual(blobs.collect_garbage(grace_period=timedelta(0)), [])
+        self.assertTrue(blobs.get_blob_storage().exists(document.plik.name))
+        self.assertEqual(FileBlob.objects.get().liczba_odwolan, 1)
+
+    def test_grace_period(self):
+        document = self.create_document('dokument')
+        document.delete()
+        self.assertEqual(blobs.collect_garbage(grace_period=timedelta(hours=1)), [])
+        self.assertTrue(blobs.get_blob_storage().exists(document.plik.name))
+
+
+class AccessTableTests(TestCase):
+    """ObjectAccess rows follow ownership, guardian permissions and group membership."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user('wlasciciel', 'wlasciciel@example.com', 'haslo')
+        self.reader = User.objects.create_user('czytelnik', 'czytelnik@example.com', 'haslo')
+        self.document = Document.objects.create(nazwa='Dokument', wlasciciel=self.owner)
+
+    def masks(self):
+        return dict(ObjectAccess.objects.filter(dokument=self.document).values_list('uzytkownik__username', 'uprawnienia'))
+
+    def test_owner_and_direct_grants(self):
+        self.assertEqual(self.masks(), {'wlasciciel': ObjectAccess.OWNER | ObjectAccess.BROWSE})
+        assign_perm('browse_document', self.reader, self.document)
+        assign_perm('download_document', self.reader, self.document)
+        self.assertEqual(self.masks()['czytelnik'], ObjectAccess.BROWSE | ObjectAccess.DOWNLOAD)
+        self.assertEqual(list(Document.objects.accessible_by(self.reader, ObjectAccess.DOWNLOAD)), [self.document])
+
+        remove_perm('browse_document', self.reader, self.document)
+        remove_perm('download_document', self.reader, self.document)
+        self.assertNotIn('czytelnik', self.masks())
+        self.assertFalse(Document.objects.accessible_by(self.reader).exists())
+
+    def test_group_membership(self):
+        group = Group.objects.create(name='Dział')
+        assign_perm('browse_document', group, self.document)
+        self.assertNotIn('czytelnik', self.masks())
+        self.reader.groups.add(group)
+        self.assertEqual(self.masks()['czytelnik'], ObjectAccess.BROWSE)
+        group.user_set.clear()
+        self.assertNotIn('czytelnik', self.masks())
+
+    def test_owner_change(self):
+        self.document.wlasciciel = self.reader
+        self.document.save()
+        self.assertEqual(self.masks(), {'czytelnik': ObjectAccess.OWNER | ObjectAccess.BROWSE})
+
+    def test_sync_repairs_rows(self):
+        assign_perm('browse_document', self.reader, self.document)
+        expected = self.masks()
+        ObjectAccess.objects.filter(uzytkownik=self.owner).delete()
+        ObjectAccess.objects.filter(uzytkownik=self.reader).update(uprawnienia=ObjectAccess.CHANGE)
+        stranger = User.objects.create_user('obcy', 'obcy@example.com', 'haslo')
+        ObjectAccess.objects.create(uzytkownik=stranger, dokument=self.document, uprawnienia=ObjectAccess.BROWSE)
+
+        access.sync_access(Document, [self.document.pk])
+        self.assertEqual(self.masks(), expected)
+
+
+class RenditionTests(StoredFilesTestCase):
+    def setUp(self):
+        super().setUp()
+        from PIL import Image
+
+        image = io.BytesIO()
+        Image.new('RGB', (1200, 900), (200, 30, 30)).save(image, 'PNG')
+        self.user = self.make_user('edytor')
+        self.client.force_login(self.user)
+        self.document = Document.objects.create(
+            nazwa='Zdjęcie', wlasciciel=self.user, plik=SimpleUploadedFile('zdjecie.png', image.getvalue()),
+        )
+
+    def test_only_the_exact_version_is_cached_for_good(self):
+        url = self.document.rendition_urls['miniatura']
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+
+        for version in (self.document.hash_pliku[:1], self.document.hash_pliku[:15], 'x'):
+            response = self.client.get(url.split('?')[0], {'v': version})
+            self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+
+class OfficePreviewTests(StoredFilesTestCase):
+    @staticmethod
+    def docx(body):
+        data = io.BytesIO()
+        with zipfile.ZipFile(data, 'w') as archive:
+            archive.writestr('word/document.xml', (
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                f'<w:body>{body}</w:body></w:document>'
+            ))
+        return data.getvalue()
+
+    @staticmethod
+    def xlsx(*sheets):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        workbook.remove(workbook.active)
+        for title, rows in sheets:
+            sheet = workbook.create_sheet(title)
+            for row in rows:
+                sheet.append(row)
+        data = io.BytesIO()
+        workbook.save(data)
+        return data.getvalue()
+
+    def test_docx_is_escaped(self):
+        fragment = office_preview.render_docx(io.BytesIO(self.docx(
+            '<w:p><w:pPr><w:pStyle w:val="Heading1"/></w:pPr><w:r><w:t>&lt;script&gt;alert(1)&lt;/script&gt;</w:t></w:r></w:p>'
+            '<w:p><w:r><w:rPr><w:b/></w:rPr><w:t>A &amp; B</w:t></w:r><w:r><w:rPr><w:i w:val="0"/></w:rPr><w:t> zwykły</w:t></w:r></w:p>'
+            '<w:tbl><w:tr><w:tc><w:p><w:r><w:t>&lt;b&gt;komórka</w:t></w:r></w:p></w:tc></w:tr></w:tbl>'
+        )))
+        self.assertEqual(fragment, (
+            '<h2>&lt;script&gt;alert(1)&lt;/script&gt;</h2>'
+            '<p><strong>A &amp; B</strong> zwykły</p>'
+            '<table class="table table-sm table-bordered"><tr><td><p>&lt;b&gt;komórka</p></td></tr></table>'
+        ))
+
+    def test_docx_stops_at_the_page_limit(self):
+        page = '<w:p><w:r><w:t>strona</w:t><w:br w:type="page"/></w:r><w:r><w:t>, ciąg dalszy</w:t></w:r></w:p>'
+        fragment = office_preview.render_docx(io.BytesIO(self.docx(
+            '<w:tbl><w:tr><w:tc>' + page * 5 + '</w:tc></w:tr></w:tbl>'
+        )), max_pages=2)
+        self.assertEqual(fragment.count('strona'), 2)
+        self.assertIn('<p>strona, ciąg dalszy</p><p>strona</p>', fragment) # Text before the third page is kept
+        self.assertIn('</td></tr></table>', fragment) # Cut inside the table, which is still closed
+        self.assertIn('pierwsze 2 stron', fragment)
+
+    def test_xlsx_is_escaped_and_limited(self):
+        import datetime
+
+        rows = [['<img src=x onerror=alert(1)>', 2.0, datetime.date(2024, 3, 1)]]
+        rows += [[f'wiersz {number}', None, None, 'poza'] for number in range(5)]
+        fragment = office_preview.render_xlsx(io.BytesIO(self.xlsx(('<Arkusz>', rows), ('Pusty', []))), max_rows=3, max_columns=3)
+        self.assertIn('<h2 class="h5 mt-3">&lt;Arkusz&gt;</h2>', fragment)
+        self.assertIn('<tr><td>&lt;img src=x onerror=alert(1)&gt;</td><td>2</td><td>01.03.2024</td></tr>', fragment)
+        self.assertIn('<tr><td>wiersz 1</td><td></td><td></td></tr>', fragment)
+        self.assertNotIn('wiersz 2', fragment)
+        self.assertNotIn('poza', fragment)
+        self.assertIn('do 3 wiersza i 3 kolumny', fragment)
+        self.assertIn('Pusty arkusz', fragment)
+        self.assertNotIn('<img', fragment)
+
+    def test_preview_is_rendered_once_per_content(self):
+        user = self.make_user('edytor')
+        self.client.force_login(user)
+        content = self.docx('<w:p><w:r><w:t>treść</w:t></w:r></w:p>')
+        first, second = (
+            Document.objects.create(nazwa=name, wlasciciel=user, plik=SimpleUploadedFile(f'{name}.docx', content))
+            for name in ('pierwszy', 'drugi')
+        )
+        render_docx = mock.Mock(wraps=office_preview.render_docx)
+        with mock.patch.dict(office_preview.RENDERERS, docx=render_docx):
+            for document in (first, second):
+                response = self.client.get(f'/documents/{document.pk}/preview/')
+                self.assertContains(response, '<p>treść</p>', html=True)
+        self.assertEqual(render_docx.call_count, 1)
+        office_preview.delete_previews([first.hash_pliku])
+        self.assertFalse(blobs.get_blob_storage().exists(office_preview.preview_name(first.hash_pliku)))
+
+    def test_damaged_file_redirects(self):
+        user = self.make_user('edytor')
+        self.client.force_login(user)
+        document = Document.objects.create(
+            nazwa='Uszkodzony', wlasciciel=user, plik=SimpleUploadedFile('uszkodzony.xlsx', b'to nie jest arkusz'),
+        )
+        response = self.client.get(f'/documents/{document.pk}/preview/')
+        self.assertRedirects(response, f'/documents/{document.pk}/', fetch_redirect_response=False)
+
+
+class FileServingTests(StoredFilesTestCase):
+    DATA = bytes(range(48, 123)) * 4 # 300 bytes of text
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('pobierajacy')
+        self.client.force_login(self.user)
+        self.document = Document.objects.create(
+            nazwa='Plik', wlasciciel=self.user, plik=SimpleUploadedFile('plik.txt', self.DATA),
+        )
+        self.url = f'/documents/{self.document.pk}/download/'
+        self.etag = f'"{self.document.hash_pliku}"'
+
+    def downloads(self):
+        return ActivityLog.objects.filter(typ_aktywnosci='pobieranie').count()
+
+    def test_whole_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.DATA)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.downloads(), 1)
+
+    def test_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 0-9/300')
+        self.assertEqual(b''.join(response.streaming_content), self.DATA[:10])
+        self.assertEqual(self.downloads(), 1)
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.DATA[10:])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.DATA[-5:])
+        self.assertEqual(self.downloads(), 1) # Continuations are not new downloads
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=300-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */300')
+        self.assertEqual(self.downloads(), 0)
+
+    def test_if_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-', HTTP_IF_RANGE=self.etag)
+        self.assertEqual(response.status_code, 206)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-', HTTP_IF_RANGE='"inna-wersja"')
+        self.assertEqual(response.status_code, 200) # Changed file - sent whole
+        self.assertEqual(b''.join(response.streaming_content), self.DATA)
+        self.assertEqual(self.downloads(), 1)
+
+    def test_not_modified(self):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"inna-wersja"').status_code, 200)
+        self.assertEqual(self.downloads(), 1)
+
+    @override_settings(DOCUMENT_SERVE_MODE='x-accel-redirect', DOCUMENT_ACCEL_REDIRECT_PREFIX='/protected/')
+    def test_offloaded_ranges(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{self.document.plik.name}')
+        self.assertEqual(self.downloads(), 1)
+        # nginx answers the ranges; Django still sees the Range header
+        self.client.get(self.url, HTTP_RANGE='bytes=100-')
+        self.client.get(self.url, HTTP_RANGE='bytes=900-')
+        self.assertEqual(self.downloads(), 1)
+        self.client.get(self.url, HTTP_RANGE='bytes=0-99')
+        self.client.get(self.url, HTTP_RANGE='bytes=100-', HTTP_IF_RANGE='"inna-wersja"')
+        self.assertEqual(self.downloads(), 3)
+
+    @override_settings(DOCUMENT_SERVE_MODE='x-sendfile')
+    def test_offloaded_not_modified(self):
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag).status_code, 304)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=50-')
+        self.assertEqual(response['X-Sendfile'], self.document.plik.path)
+        self.assertEqual(self.downloads(), 0)
+
+
+class ExportTests(StoredFilesTestCase):
+    """ZIP exports keep the folder structure, give colliding names numbers and contain only what the user may view."""
+
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user('wlasciciel')
+        self.root = Folder.objects.create(nazwa='Projekty', wlasciciel=self.owner)
+        self.child = Folder.objects.create(nazwa='2024', wlasciciel=self.owner, rodzic=self.root)
+        self.outside = Folder.objects.create(nazwa='Inne', wlasciciel=self.owner)
+        self.umowa = self.create_document('Umowa', self.root)
+        self.umowa_kopia = self.create_document('umowa', self.root) # Same name up to case
+        self.raport = self.create_document('Raport Q1/Q2', self.child)
+        self.create_document('Poza', self.outside)
+        self.create_document('Usunięty', self.root).move_to_trash(self.owner)
+        self.client.force_login(self.owner)
+
+    def create_document(self, name, folder):
+        content = f'%PDF-1.4 {name}'.encode()
+        return Document.objects.create(nazwa=name, wlasciciel=self.owner, folder=folder, plik=SimpleUploadedFile('plik.pdf', content))
+
+    def download(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(archive.testzip()) # CRCs match
+        return archive
+
+    def test_folder_paths_and_name_collisions(self):
+        with self.settings(EXPORT_READ_BUFFER_SIZE=4): # Many blocks per file
+            archive = self.download(f'/folders/{self.root.pk}/export/')
+        self.assertEqual(sorted(archive.namelist()), ['Projekty/2024/Raport Q1_Q2.pdf', 'Projekty/Umowa.pdf', 'Projekty/umowa (2).pdf'])
+        self.assertEqual(archive.read('Projekty/Umowa.pdf'), b'%PDF-1.4 Umowa')
+        self.assertEqual(archive.read('Projekty/umowa (2).pdf'), b'%PDF-1.4 umowa')
+        self.assertTrue(ActivityLog.objects.filter(folder=self.root, typ_aktywnosci='pobieranie').exists())
+
+        used = set()
+        names = [export.entry_name(self.umowa, 'A', used) for _ in range(3)]
+        self.assertEqual(names, ['A/Umowa.pdf', 'A/Umowa (2).pdf', 'A/Umowa (3).pdf'])
+
+    def test_only_viewable_documents(self):
+        reader = self.make_user('czytelnik', Role.READER)
+        assign_perm('browse_folder', reader, self.root)
+        assign_perm('browse_document', reader, self.raport)
+        self.client.force_login(reader)
+        archive = self.download(f'/folders/{self.root.pk}/export/')
+        self.assertEqual(archive.namelist(), ['Projekty/2024/Raport Q1_Q2.pdf'])
+        self.assertEqual(self.client.get(f'/folders/{self.outside.pk}/export/').status_code, 403)
+
+        archive = self.download('/documents/export/', dokumenty=[self.raport.pk, self.umowa.pk, 'x'])
+        self.assertEqual(archive.namelist(), ['Raport Q1_Q2.pdf'])
+
+    def test_missing_files_are_listed(self):
+        os.remove(blobs.get_blob_storage().path(self.umowa.plik.name))
+        archive = self.download('/documents/export/', dokumenty=[self.umowa.pk, self.raport.pk])
+        self.assertEqual(sorted(archive.namelist()), [export.MISSING_FILES_ENTRY, 'Raport Q1_Q2.pdf'])
+        self.assertIn('Umowa.pdf', archive.read(export.MISSING_FILES_ENTRY).decode())
+
+
+class TrashTests(StoredFilesTestCase):
+    """Restoring and purging trashed documents; purges survive an interrupted background task."""
+
+    def setUp(self):
+        super().setUp()
+        self.editor = self.make_user('edytor')
+        self.other = self.make_user('inny')
+        self.documents = [Document.objects.create(nazwa=f'Dokument {i}', wlasciciel=self.editor) for i in range(3)]
+        for document in self.documents:
+            document.move_to_trash(self.editor)
+        self.foreign = Document.objects.create(nazwa='Cudzy', wlasciciel=self.other)
+        self.foreign.move_to_trash(self.other)
+        self.client.force_login(self.editor)
+
+    def test_restore(self):
+        response = self.client.post(f'/trash/{self.documents[0].pk}/restore/')
+        self.assertRedirects(response, '/trash/', fetch_redirect_response=False)
+        restored = Document.objects.get(pk=self.documents[0].pk)
+        self.assertEqual((restored.usunieto, restored.data_usuniecia, restored.usuniety_przez), (False, None, None))
+        self.assertTrue(ActivityLog.objects.filter(dokument=restored, szczegoly__contains='Przywrócono').exists())
+        self.assertEqual(self.client.post(f'/trash/{self.foreign.pk}/restore/').status_code, 403)
+
+    def test_listing_flags_deletable_documents(self):
+        admin = self.make_user('admin', Role.ADMIN)
+        for user, expected in ((self.editor, 3), (admin, 4)):
+            self.client.force_login(user)
+            page = self.client.get('/trash/').context['page_obj']
+            self.assertEqual(len(page), expected)
+            self.assertTrue(all(document.current_user_can_delete for document in page))
+
+    def test_purge(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/trash/{self.documents[0].pk}/delete/')
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Document.objects.filter(pk=self.documents[0].pk).exists())
+        self.assertEqual(self.client.post(f'/trash/{self.foreign.pk}/delete/').status_code, 403)
+        self.assertTrue(Document.objects.filter(pk=self.foreign.pk).exists())
+
+    def test_interrupted_purge_is_finished_by_purge_trash(self):
+        with mock.patch.object(trash, 'run_in_background'), self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/trash/empty/') # The task never runs, as after a restart
+        marked = Document.objects.filter(do_usuniecia=True)
+        self.assertEqual(set(marked.values_list('pk', flat=True)), {document.pk for document in self.documents})
+        self.assertEqual(len(self.client.get('/trash/').context['page_obj']), 0)
+        self.assertEqual(self.client.post(f'/trash/{self.documents[0].pk}/restore/').status_code, 404)
+
+        call_command('purge_trash', '--no-collect', stdout=io.StringIO())
+        self.assertFalse(Document.objects.filter(pk__in=[document.pk for document in self.documents]).exists())
+        self.assertTrue(Document.objects.filter(pk=self.foreign.pk).exists()) # Not expired, not requested
+        self.assertEqual(trash.purge_documents([self.documents[0].pk]), 0) # Idempotent
+
+    def test_retention(self):
+        SystemSettings.set_setting('TRASH_RETENTION_DAYS', '10')
+        now = timezone.now()
+        Document.objects.filter(pk=self.documents[0].pk).update(data_usuniecia=now - timedelta(days=11))
+        Document.objects.filter(pk=self.documents[1].pk).update(data_usuniecia=now - timedelta(days=9))
+        Document.objects.filter(pk=self.documents[2].pk).update(do_usuniecia=True)
+        live = Document.objects.create(nazwa='Żywy', wlasciciel=self.editor)
+
+        self.assertEqual(trash.purge_expired(dry_run=True, collect=False), (2, []))
+        self.assertEqual(trash.purge_expired(batch_size=1, collect=False), (2, []))
+        self.assertEqual(set(Document.objects.values_list('pk', flat=True)), {self.documents[1].pk, self.foreign.pk, live.pk})
+        self.assertEqual(trash.purge_expired(now=now + timedelta(days=2), collect=False), (1, []))
+        self.assertTrue(Document.objects.filter(pk=live.pk).exists())
+
+
+class FolderDeletionTests(StoredFilesTestCase):
+    """Subtree deletion in batches, with progress, permission cleanup and recovery of jobs whose worker died."""
+
+    def setUp(self):
+        super().setUp()
+        self.owner = self.make_user('wlasciciel')
+        self.reader = self.make_user('czytelnik', Role.READER)
+        self.root = Folder.objects.create(nazwa='Projekty', wlasciciel=self.owner)
+        child = Folder.objects.create(nazwa='2024', wlasciciel=self.owner, rodzic=self.root)
+        grandchild = Folder.objects.create(nazwa='Umowy', wlasciciel=self.owner, rodzic=child)
+        self.subtree = [self.root, child, grandchild]
+        self.outside = Folder.objects.create(nazwa='Inne', wlasciciel=self.owner)
+        for folder in self.subtree + [self.outside]:
+            assign_perm('browse_folder', self.reader, folder)
+        self.documents = [
+            Document.objects.create(nazwa=f'Dokument {i}', wlasciciel=self.owner, folder=self.subtree[i % 3]) for i in range(5)
+        ]
+        self.documents[4].move_to_trash(self.owner) # Already in the trash
+        self.kept = Document.objects.create(nazwa='Poza', wlasciciel=self.owner, folder=self.outside)
+
+    def start(self):
+        with self.captureOnCommitCallbacks(execute=False): # The background task is never run
+            return folder_deletion.start_folder_deletion(self.root, self.owner)
+
+    def test_batches_progress_and_cleanup(self):
+        job = self.start()
+        self.assertEqual((job.liczba_folderow, job.liczba_dokumentow), (3, 5))
+        with mock.patch.object(folder_deletion, '_record_progress', wraps=folder_deletion._record_progress) as record:
+            folder_deletion.run_folder_deletion(job.pk, batch_size=2)
+        progress = [call.kwargs for call in record.call_args_list]
+        self.assertEqual(
+            [changes.get('usuniete_dokumenty', changes.get('usuniete_foldery')) for changes in progress[1:-1]], [2, 4, 5, 2, 3],
+        )
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, FolderDeletionJob.STATUS_DONE)
+        self.assertEqual((job.usuniete_foldery, job.usuniete_dokumenty, job.get_progress()), (3, 5, 100))
+        self.assertEqual(list(Folder.objects.all()), [self.outside])
+        trashed = Document.objects.filter(pk__in=[document.pk for document in self.documents])
+        self.assertEqual(trashed.filter(usunieto=True, folder=None).count(), 5)
+        self.assertEqual(Document.objects.get(pk=self.kept.pk).folder, self.outside)
+
+        folder_type = ContentType.objects.get_for_model(Folder)
+        self.assertEqual(
+            list(UserObjectPermission.objects.filter(content_type=folder_type).values_list('object_pk', flat=True)), [str(self.outside.pk)],
+        )
+        self.assertEqual(set(ObjectAccess.objects.exclude(folder=None).values_list('folder_id', flat=True)), {self.outside.pk})
+
+    def test_trashed_documents_remember_their_folder(self):
+        folder_deletion.run_folder_deletion(self.start().pk, batch_size=2)
+        locations = dict(Document.objects.filter(usunieto=True).values_list('nazwa', 'lokalizacja_przed_usunieciem'))
+        self.assertEqual(locations, {
+            'Dokument 0': 'Projekty', 'Dokument 1': 'Projekty / 2024', 'Dokument 2': 'Projekty / 2024 / Umowy',
+            'Dokument 3': 'Projekty', 'Dokument 4': 'Projekty / 2024', # Was in the trash already
+        })
+
+        self.client.force_login(self.owner)
+        self.assertContains(self.client.get('/trash/'), 'Projekty / 2024 / Umowy')
+        response = self.client.post(f'/trash/{self.documents[2].pk}/restore/', follow=True)
+        self.assertIn('Projekty / 2024 / Umowy', [str(message) for message in response.context['messages']][0])
+        restored = Document.objects.get(pk=self.documents[2].pk)
+        self.assertEqual((restored.usunieto, restored.folder, restored.lokalizacja_przed_usunieciem), (False, None, ''))
+
+    def test_invalid_path_fails_the_job(self):
+        job = self.start()
+        FolderDeletionJob.objects.filter(pk=job.pk).update(sciezka='')
+        job = folder_deletion.run_folder_deletion(job.pk)
+        self.assertEqual(job.status, FolderDeletionJob.STATUS_FAILED)
+        self.assertEqual(Folder.objects.count(), 4)
+
+    def test_stale_job_is_resumed_when_looked_at(self):
+        job = self.start()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.assertEqual(folder_deletion.get_active_job(self.root), job)
+        self.assertEqual(callbacks, []) # Alive - left alone
+
+        FolderDeletionJob.objects.filter(pk=job.pk).update(
+            status=FolderDeletionJob.STATUS_RUNNING, ostatni_postep=timezone.now() - timedelta(hours=1),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            folder_deletion.get_active_job(self.root)
+        job.refresh_from_db()
+        self.assertEqual(job.status, FolderDeletionJob.STATUS_DONE)
+        self.assertFalse(Folder.objects.filter(pk=self.root.pk).exists())
+
+    def test_resume_command_finishes_interrupted_jobs(self):
+        job = self.start()
+        # Interrupted after the documents were trashed, before any folder was deleted
+        folder_deletion._trash_documents(job, 10)
+        FolderDeletionJob.objects.filter(pk=job.pk).update(
+            status=FolderDeletionJob.STATUS_RUNNING, ostatni_postep=timezone.now() - timedelta(hours=1),
+        )
+        stale = FolderDeletionJob.objects.get(pk=job.pk)
+        call_command('resume_folder_deletions', stdout=io.StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.usuniete_dokumenty, job.usuniete_foldery), (FolderDeletionJob.STATUS_DONE, 5, 3))
+        self.assertFalse(folder_deletion.claim_stale_job(stale)) # Finished meanwhile
+
+
+class ActivityLogWriterTests(TestCase):
+    """Background writer of documents.activity, driven from the test thread."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('dziennik', 'dziennik@example.com', 'haslo')
+        self.writer = activity.ActivityLogWriter(max_size=2, batch_size=10, retry_delay=0.5, max_retry_delay=2.0)
+        patcher = mock.patch.object(self.writer, 'start') # No thread - flush() writes
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def entry(self, szczegoly='wpis', **kwargs):
+        return ActivityLog(uzytkownik=self.user, typ_aktywnosci='edycja', szczegoly=szczegoly, **kwargs)
+
+    def locked(self):
+        return mock.patch.object(ActivityLog.objects, 'bulk_create', side_effect=OperationalError('database is locked'))
+
+    def test_full_queue_writes_synchronously(self):
+        for i in range(3):
+            self.writer.put(self.entry(f'wpis {i}'))
+        self.assertEqual(list(ActivityLog.objects.values_list('szczegoly', flat=True)), ['wpis 2'])
+        self.writer.flush()
+        self.assertEqual(ActivityLog.objects.count(), 3)
+        metrics = self.writer.get_metrics()
+        self.assertEqual((metrics['queued'], metrics['written_sync'], metrics['flushed'], metrics['pending']), (2, 1, 2, 0))
+
+    def test_failed_batch_is_kept_and_retried(self):
+        self.writer.put(self.entry('pierwszy'))
+        self.writer.put(self.entry('drugi'))
+        with self.locked():
+            self.writer.flush()
+            self.assertEqual(self.writer.get_metrics()['pending_retry'], 2)
+            self.writer.retry_deferred() # Still locked - waits longer next time
+            self.assertEqual(self.writer._next_delay, 1.0)
+        self.assertFalse(ActivityLog.objects.exists())
+
+        self.writer.retry_deferred()
+        self.assertEqual(sorted(ActivityLog.objects.values_list('szczegoly', flat=True)), ['drugi', 'pierwszy'])
+        metrics = self.writer.get_metrics()
+        self.assertEqual((metrics['deferred'], metrics['failed_attempts'], metrics['pending_retry']), (2, 2, 0))
+        self.assertEqual(self.writer._next_delay, 0.5)
+
+    def test_full_queue_with_locked_database(self):
+        self.writer.put(self.entry('a'))
+        self.writer.put(self.entry('b'))
+        with self.locked():
+            self.writer.put(self.entry('c'))
+        self.assertEqual(self.writer.get_metrics()['pending_retry'], 1)
+        self.writer.flush()
+        self.assertEqual(ActivityLog.objects.count(), 3)
+
+    def test_deleted_objects(self):
+        document = Document.objects.create(nazwa='Dokument', wlasciciel=self.user)
+        other = User.objects.create_user('usuniety', 'usuniety@example.com', 'haslo')
+        self.writer.put(self.entry('o dokumencie', dokument=document))
+        self.writer.put(ActivityLog(uzytkownik=other, typ_aktywnosci='edycja'))
+        document.delete()
+        other.delete()
+        self.writer.flush()
+        entry = ActivityLog.objects.get()
+        self.assertEqual((entry.szczegoly, entry.dokument_id), ('o dokumencie', None))
+        self.assertEqual(self.writer.get_metrics()['skipped_deleted_user'], 1)
+
+    def test_shutdown_flushes(self):
+        self.writer.put(self.entry('a'))
+        with self.locked():
+            self.writer.put(self.entry('b'))
+            self.writer.put(self.entry('c')) # Queue full and database locked
+        self.writer.shutdown(timeout=2)
+        self.assertEqual(ActivityLog.objects.count(), 3)
+        self.assertEqual(self.writer.get_metrics()['pending_retry'], 0)
+
+    @override_settings(ACTIVITY_LOG_SYNC=False)
+    def test_rolled_back_work_is_not_logged(self):
+        with mock.patch.object(activity, 'get_writer') as get_writer:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        activity.log_activity(self.user, 'edycja', szczegoly='wycofane')
+                        raise ValueError
+                except ValueError:
+                    pass
+                activity.log_activity(self.user, 'edycja', szczegoly='zatwierdzone')
+        self.assertEqual([c.args[0].szczegoly for c in get_writer.return_value.put.call_args_list], ['zatwierdzone'])
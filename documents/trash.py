@@ -0,0 +1,87 @@
+"""
+The trash for deleted documents.
+
+Deleting a document only moves it to the trash (usunieto=True, with
+data_usuniecia and usuniety_przez set); it can be restored until it has been
+there longer than the TRASH_RETENTION_DAYS system setting. Live listings
+filter usunieto=False and use partial indexes that leave trashed rows out,
+the trash has its own partial indexes (see Document.Meta.indexes).
+
+Purging from the trash (one document or the whole trash) first marks the
+documents do_usuniecia - they disappear from the trash and can no longer be
+restored - and then deletes them in a background task. The task runs in the
+in-process pool, so a restart can interrupt it; purging is idempotent and
+the marks stay in the database, so the next purge_expired() finishes the
+job.
+
+purge_expired() (management command purge_trash, run periodically from
+cron) removes documents marked for purging and expired documents in batches
+of separate transactions, so it never holds long locks. Their files go
+through the blob garbage collector: purged documents drop their references,
+and collect_garbage() deletes the files unreferenced for its grace period,
+several at a time.
+"""
+import logging
+
+from django.db import transaction
+
+from .blobs import GARBAGE_GRACE_PERIOD, collect_garbage
+from .tasks import run_in_background
+
+logger = logging.getLogger(__name__)
+
+PURGE_BATCH_SIZE = 100
+PURGE_WORKERS = 4
+
+
+def purge_documents(document_ids, batch_size=PURGE_BATCH_SIZE):
+    """
+    Delete trashed documents (with versions, comments...) for good, batch_size per
+    transaction. Already purged or restored ones are skipped. Returns how many were deleted.
+    """
+    from .models import Document
+
+    document_ids = list(document_ids)
+    purged = 0
+    for start in range(0, len(document_ids), batch_size):
+        with transaction.atomic():
+            deleted, per_model = Document.objects.filter(pk__in=document_ids[start:start + batch_size], usunieto=True).delete()
+        purged += per_model.get(Document._meta.label, 0)
+    return purged
+
+
+def schedule_purge(document_ids):
+    """Mark trashed documents for purging and purge them in the background once the current transaction commits."""
+    from .models import Document
+
+    document_ids = list(document_ids)
+    for start in range(0, len(document_ids), PURGE_BATCH_SIZE):
+        Document.objects.filter(pk__in=document_ids[start:start + PURGE_BATCH_SIZE], usunieto=True).update(do_usuniecia=True)
+    if document_ids:
+        transaction.on_commit(lambda: run_in_background(purge_documents, document_ids))
+
+
+def purge_expired(batch_size=PURGE_BATCH_SIZE, workers=PURGE_WORKERS, dry_run=False, collect=True,
+                  grace_period=GARBAGE_GRACE_PERIOD, now=None):
+    """
+    Purge documents marked for purging (left by an interrupted schedule_purge) and ones whose
+    trash retention has passed, batch_size per transaction, then delete unreferenced files.
+    Returns (number of documents, deleted FileBlobs).
+    """
+    from .models import Document
+
+    querysets = (Document.objects.purge_requested(), Document.objects.trash_expired(now))
+    if dry_run:
+        count = (querysets[0] | querysets[1]).count()
+        return count, collect_garbage(grace_period, dry_run=True) if collect else []
+
+    purged = 0
+    for queryset in querysets:
+        while True:
+            batch = list(queryset.order_by('data_usuniecia', 'id').values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            purged += purge_documents(batch, batch_size)
+            logger.info("Kosz: trwale usunięto %d dokumentów", purged)
+    deleted_blobs = collect_garbage(grace_period, workers=workers) if collect else []
+    return purged, deleted_blobs
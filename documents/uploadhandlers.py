@@ -0,0 +1,147 @@
+"""
+Upload handlers computing file fingerprints while the request body streams in.
+
+The handlers hash (SHA-256), count and sniff the MIME type of every uploaded
+file chunk by chunk as it arrives, and attach the results to the resulting
+UploadedFile as ``sha256`` and ``sniffed_content_type``. Document and
+DocumentVersion reuse these values on save instead of reading the spooled file
+a second time. Files that did not come through these handlers (ContentFile,
+files already in storage) are hashed with file_digest().
+
+The sniffed type is used to refuse files whose content does not match their
+extension (validate_content_type), e.g. HTML uploaded as .txt. It is kept in
+typ_mime for information only; files are served with a type derived from
+the extension (documents.serving).
+
+Enable them in settings:
+
+    FILE_UPLOAD_HANDLERS = [
+        'documents.uploadhandlers.HashingMemoryFileUploadHandler',
+        'documents.uploadhandlers.HashingTemporaryFileUploadHandler',
+    ]
+"""
+import hashlib
+import mimetypes
+import os
+
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+try:
+    import magic
+except ImportError: # libmagic missing - fall back to guessing from the file name
+    magic = None
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# libmagic needs only the beginning of a file
+SNIFF_SIZE = 8192
+
+
+def sniff_content_type(head, name=''):
+    """MIME type from the first bytes of a file, or guessed from its name."""
+    if magic is not None and head:
+        try:
+            return magic.from_buffer(head, mime=True)
+        except Exception: # Malformed input or libmagic error
+            pass
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+OFFICE_ZIP_TYPES = {'application/zip', 'application/octet-stream'} # Older libmagic reports OOXML as plain ZIP
+OLE_TYPES = {'application/x-ole-storage', 'application/CDFV2', 'application/vnd.ms-office', 'application/octet-stream'}
+# Sniffed types accepted for each extension
+SNIFFED_TYPES = {
+    'pdf': {'application/pdf', 'application/x-pdf'},
+    'png': {'image/png'},
+    'jpg': {'image/jpeg'},
+    'jpeg': {'image/jpeg'},
+    'docx': {'application/vnd.openxmlformats-officedocument.wordprocessingml.document'} | OFFICE_ZIP_TYPES,
+    'xlsx': {'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'} | OFFICE_ZIP_TYPES,
+    'doc': {'application/msword'} | OLE_TYPES,
+    'xls': {'application/vnd.ms-excel'} | OLE_TYPES,
+}
+# Text files may be any plain text, but not markup a browser would render and run
+TEXT_TYPES = {'application/json', 'application/x-empty', 'inode/x-empty', 'application/octet-stream'}
+ACTIVE_TEXT_TYPES = {'text/html', 'text/xml', 'application/xml', 'application/xhtml+xml', 'image/svg+xml', 'text/javascript'}
+
+
+def content_matches_extension(filename, content_type):
+    """Whether a sniffed MIME type is plausible for the extension of filename."""
+    extension = os.path.splitext(filename or '')[1].lower().lstrip('.')
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if extension == 'txt':
+        return content_type not in ACTIVE_TEXT_TYPES and (content_type.startswith('text/') or content_type in TEXT_TYPES)
+    return content_type in {allowed.lower() for allowed in SNIFFED_TYPES.get(extension, ())}
+
+
+def validate_content_type(filename, content_type):
+    """Raise ValidationError when the content of a file does not match its extension."""
+    if not content_matches_extension(filename, content_type):
+        extension = os.path.splitext(filename or '')[1].lower()
+        raise ValidationError(f"Zawartość pliku nie odpowiada jego rozszerzeniu ({extension or 'brak'}).")
+
+
+def file_digest(fileobj):
+    """Return (sha256 hex digest, size) of a file, reusing values from the upload handlers."""
+    if getattr(fileobj, 'sha256', None):
+        return fileobj.sha256, fileobj.size
+    file_hash = hashlib.sha256()
+    size = 0
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(UPLOAD_CHUNK_SIZE), b''):
+        file_hash.update(chunk)
+        size += len(chunk)
+    fileobj.seek(0)
+    return file_hash.hexdigest(), size
+
+
+def file_content_type(fileobj):
+    """MIME type of a file, reusing the value sniffed by the upload handlers."""
+    if getattr(fileobj, 'sniffed_content_type', None):
+        return fileobj.sniffed_content_type
+    head = b''
+    try:
+        fileobj.seek(0)
+        head = fileobj.read(SNIFF_SIZE)
+        fileobj.seek(0)
+    except (OSError, ValueError):
+        pass
+    return sniff_content_type(head, getattr(fileobj, 'name', '') or '')
+
+
+class HashingUploadMixin:
+    """Hash, count and sniff chunks before handing them to the storing handler."""
+    chunk_size = UPLOAD_CHUNK_SIZE
+
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        self.head = b''
+        super().new_file(*args, **kwargs)
+
+    def is_storing(self):
+        return True
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.is_storing():
+            self.sha256.update(raw_data)
+            if len(self.head) < SNIFF_SIZE:
+                self.head += raw_data[:SNIFF_SIZE - len(self.head)]
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        if uploaded_file is not None:
+            uploaded_file.sha256 = self.sha256.hexdigest()
+            uploaded_file.sniffed_content_type = sniff_content_type(self.head, self.file_name)
+        return uploaded_file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    """Small uploads kept in memory (up to FILE_UPLOAD_MAX_MEMORY_SIZE)."""
+
+    def is_storing(self):
+        return self.activated
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    """Large uploads spooled to a temporary file."""
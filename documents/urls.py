@@ -12,12 +12,18 @@ urlpatterns = [
     path('admin/documents/', views.document_list, name='document_list'),
     path('documents/upload/', views.document_upload, name='document_upload'),
     path('documents/upload/<int:folder_id>/', views.document_upload, name='document_upload_to_folder'),
+    path('documents/upload/batch/', views.document_batch_upload, name='document_batch_upload'),
+    path('documents/upload/batch/<int:folder_id>/', views.document_batch_upload, name='document_batch_upload_to_folder'),
     path('documents/<int:pk>/', views.document_detail, name='document_detail'),
     path('documents/<int:pk>/edit/', views.document_edit, name='document_edit'),
     path('documents/<int:pk>/delete/', views.document_delete, name='document_delete'),
     path('documents/<int:pk>/download/', views.document_download, name='document_download'),
     path('documents/<int:pk>/preview/', views.document_preview, name='document_preview'),
+    path('documents/<int:pk>/rendition/<str:size>/', views.document_rendition, name='document_rendition'),
+    path('documents/export/', views.documents_export, name='documents_export'),
     path('documents/<int:pk>/version/upload/', views.document_version_upload, name='document_version_upload'),
+    path('uploads/', views.upload_sessions, name='upload_sessions'),
+    path('uploads/<int:pk>/', views.upload_session, name='upload_session'),
     
     # Folders (admin only)
     path('admin/folders/', views.folder_list, name='folder_list'),
@@ -25,8 +31,20 @@ urlpatterns = [
     path('folders/create/<int:parent_id>/', views.folder_create, name='folder_create_in_parent'),
     path('folders/<int:pk>/edit/', views.folder_edit, name='folder_edit'),
     path('folders/<int:pk>/delete/', views.folder_delete, name='folder_delete'),
+    path('folders/<int:pk>/export/', views.folder_export, name='folder_export'),
+    path('folders/delete-jobs/<int:pk>/', views.folder_delete_job, name='folder_delete_job'),
+    path('folders/delete-jobs/<int:pk>/status/', views.folder_delete_job_status, name='folder_delete_job_status'),
     path('documents/<int:document_pk>/version/<int:version_pk>/download/', views.document_version_download, name='document_version_download'),
     
+    # Trash
+    path('trash/', views.trash, name='trash'),
+    path('trash/empty/', views.trash_empty, name='trash_empty'),
+    path('trash/<int:pk>/restore/', views.document_restore, name='document_restore'),
+    path('trash/<int:pk>/delete/', views.document_purge, name='document_purge'),
+
+    # Activity log (admin only)
+    path('activity/', views.activity_log, name='activity_log'),
+
     # Search and API
     path('search/', views.search_documents, name='search_documents'),
 ]
\ No newline at end of file
@@ -1,22 +1,40 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse, HttpResponse, Http404, FileResponse
-from django.core.paginator import Paginator
 from django.db.models import Q, Prefetch
-from django.core.exceptions import PermissionDenied
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import transaction
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.conf import settings
+from django.utils.cache import get_conditional_response
 from guardian.decorators import permission_required_or_403 # Keep if used elsewhere
-from guardian.shortcuts import get_objects_for_user, assign_perm, remove_perm
 
-from .models import Document, Folder, Tag, SystemSettings, DocumentVersion, ActivityLog, Comment
+from .models import Document, Folder, Tag, SystemSettings, DocumentVersion, Comment, ActivityLog, FolderDeletionJob, UploadSession
+from .activity import log_activity
+from .batch_upload import ingest_batch
+from .chunked_uploads import (
+    UploadConflict, abort_session, append_chunk, attach_upload, create_session,
+    get_max_chunk_size, get_max_upload_size
+)
+from .comments import flatten_comment_tree, load_comment_tree
+from .export import export_response, exportable_documents, folder_paths
+from .extraction import schedule_extraction
+from .office_preview import PreviewUnavailable, get_preview_html
+from .pagination import KeysetPaginator, OffsetPaginator
+from .renditions import content_type as rendition_content_type, get_rendition_path, get_sizes, rendition_version, schedule_renditions
+from .search import search_queryset
+from .serving import is_new_transfer, serve_file
+from .trash import schedule_purge
+from .folder_deletion import get_active_job, resume_if_stale, start_folder_deletion
+from .stats import get_dashboard_stats
 from .forms import (
     DocumentUploadForm, FolderCreateForm, DocumentUpdateForm,
-    DocumentVersionUploadForm, FolderUpdateForm, FolderDeleteForm, CommentForm
+    DocumentVersionUploadForm, FolderUpdateForm, FolderDeleteForm, CommentForm, BatchUploadForm
 )
 # Assuming UserProfile is in users.models
 # from users.models import UserProfile
@@ -26,7 +44,8 @@ from users.permissions import (
     user_can_view_document, user_can_edit_document, user_can_delete_document,
     user_can_create_document, user_can_comment_on_document, user_can_share_document,
     user_can_view_folder, user_can_edit_folder, user_can_delete_folder,
-    user_can_create_folder
+    user_can_create_folder, resolve_document_permissions, resolve_folder_permissions,
+    bulk_grant_permissions, DOCUMENT_PERMISSIONS
 )
 import os
 import mimetypes
@@ -53,10 +72,7 @@ def home(request, folder_id=None):
         if not user_can_view_folder(request.user, current_folder):
             messages.error(request, "Nie masz uprawnień do tego folderu.")
             return redirect('documents:home')
-        temp_folder = current_folder
-        while temp_folder:
-            breadcrumbs.insert(0, temp_folder)
-            temp_folder = temp_folder.rodzic
+        breadcrumbs = current_folder.get_ancestors(include_self=True)
     
     folders_qs = Folder.objects.none()
     documents_qs = Document.objects.none()
@@ -66,54 +82,41 @@ def home(request, folder_id=None):
             # Simplified for brevity; actual permission filtering for listed items can be complex
             # For now, assumes if user can view current_folder, they see its immediate contents
             # More granular would involve checking perms for each sub-folder/document
-            folders_qs = Folder.objects.filter(rodzic=current_folder).prefetch_related('tagi', 'wlasciciel__profile').order_by('nazwa')
+            folders_qs = Folder.objects.with_counts().filter(rodzic=current_folder).prefetch_related('tagi', 'wlasciciel__profile').order_by('nazwa')
             documents_qs = Document.objects.filter(
                 folder=current_folder, usunieto=False
             ).select_related('wlasciciel__profile', 'folder').prefetch_related('tagi').order_by('nazwa')
         else: # Root level
-            # Show folders user owns or has browse_folder perm on at root
-            # This part can be complex for optimal performance with Guardian.
-            # get_objects_for_user is better for Guardian based listings.
-            owned_root_folders = Folder.objects.filter(rodzic=None, wlasciciel=request.user)
-            # Add folders shared via Guardian (simplified)
-            # shared_root_folders = get_objects_for_user(request.user, 'documents.browse_folder', klass=Folder).filter(rodzic=None)
-            # folders_qs = (owned_root_folders | shared_root_folders).distinct().prefetch_related('tagi', 'wlasciciel__profile').order_by('nazwa')
-            
-            # Simplified: show owned root folders for non-admins, all for admins
+            # Admins see everything; others see what they own or what was shared with them
+            # (documents.access - one indexed join instead of guardian subqueries)
             if request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.is_admin):
-                folders_qs = Folder.objects.filter(rodzic=None).prefetch_related('tagi', 'wlasciciel__profile').order_by('nazwa')
+                folders_qs = Folder.objects.with_counts().filter(rodzic=None).prefetch_related('tagi', 'wlasciciel__profile').order_by('nazwa')
                 documents_qs = Document.objects.filter(
                     Q(folder=None) | Q(folder__rodzic=None), usunieto=False # Docs in root or in root folders
                 ).select_related('wlasciciel__profile', 'folder').prefetch_related('tagi').order_by('nazwa')
             else:
-                folders_qs = Folder.objects.filter(rodzic=None, wlasciciel=request.user).prefetch_related('tagi', 'wlasciciel__profile').order_by('nazwa')
-                documents_qs = Document.objects.filter(
-                     Q(folder=None, wlasciciel=request.user) | Q(folder__rodzic=None, wlasciciel=request.user), usunieto=False
+                folders_qs = Folder.objects.with_counts().accessible_by(request.user).filter(rodzic=None).prefetch_related('tagi', 'wlasciciel__profile').order_by('nazwa')
+                documents_qs = Document.objects.accessible_by(request.user).filter(
+                     Q(folder=None) | Q(folder__rodzic=None), usunieto=False
                 ).select_related('wlasciciel__profile', 'folder').prefetch_related('tagi').order_by('nazwa')
 
 
+        # For template: Check if current user can edit/delete listed items (resolved for the whole page at once)
+        folder_perms = resolve_folder_permissions(request.user, folders_qs)
         for folder_item in folders_qs:
-            folder_item.doc_count = folder_item.documents.filter(usunieto=False).count()
-            folder_item.subfolder_count = folder_item.podkatalogi.count()
-            # For template: Check if current user can edit/delete this specific folder
-            folder_item.current_user_can_edit = user_can_edit_folder(request.user, folder_item)
-            folder_item.current_user_can_delete = user_can_delete_folder(request.user, folder_item)
+            folder_item.current_user_can_edit = 'change_folder' in folder_perms[folder_item.pk]
+            folder_item.current_user_can_delete = 'delete_folder' in folder_perms[folder_item.pk]
 
+        document_perms = resolve_document_permissions(request.user, documents_qs)
         for doc_item in documents_qs:
-            # For template: Check if current user can edit/delete this specific document
-            doc_item.current_user_can_edit = user_can_edit_document(request.user, doc_item)
-            doc_item.current_user_can_delete = user_can_delete_document(request.user, doc_item)
-
-        # Quick stats (remains largely the same, based on ownership or superuser status)
-        if request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.is_admin):
-            total_documents = Document.objects.filter(usunieto=False).count()
-            total_folders = Folder.objects.count()
-            total_size = sum(doc.rozmiar_pliku or 0 for doc in Document.objects.filter(usunieto=False))
-        else:
-            user_documents_qs = Document.objects.filter(wlasciciel=request.user, usunieto=False)
-            total_documents = user_documents_qs.count()
-            total_folders = Folder.objects.filter(wlasciciel=request.user).count()
-            total_size = sum(doc.rozmiar_pliku or 0 for doc in user_documents_qs)
+            doc_item.current_user_can_edit = 'change_document' in document_perms[doc_item.pk]
+            doc_item.current_user_can_delete = 'delete_document' in document_perms[doc_item.pk]
+
+        # Quick stats: running totals (global for admins, own items otherwise), see documents.stats
+        dashboard_stats = get_dashboard_stats(request.user)
+        total_documents = dashboard_stats['liczba_dokumentow']
+        total_folders = dashboard_stats['liczba_folderow']
+        total_size = dashboard_stats['rozmiar_calkowity']
     else: # Not authenticated
         total_documents = 0
         total_folders = 0
@@ -143,25 +146,16 @@ def home(request, folder_id=None):
 
 @login_required
 def document_list(request):
-    # This view might be admin-focused or a general list.
-    # For now, it shows documents based on ownership or superuser status.
-    # For a true "all documents I can see" list, Guardian's get_objects_for_user is better.
+    # Admins see all documents, other users the documents they own or that were shared with them
     if not (request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.is_admin)):
-        # If not admin, maybe show only their documents or redirect?
-        # For now, let's assume it's an admin view as per original comment in urls.py
-        messages.warning(request, "Ta lista dokumentów jest dostępna dla administratorów.")
-        # return redirect('documents:home')
-        # Or, filter to show only documents the user has *some* permission for (more complex)
-        documents_qs = get_objects_for_user(request.user, 'documents.browse_document', klass=Document, use_groups=True, with_superuser=False)
+        documents_qs = Document.objects.accessible_by(request.user)
         documents_qs = documents_qs.filter(usunieto=False).select_related('wlasciciel__profile', 'folder').prefetch_related('tagi')
     else:
         documents_qs = Document.objects.filter(usunieto=False).select_related('wlasciciel__profile', 'folder').prefetch_related('tagi')
 
     search_query = request.GET.get('search', '')
     if search_query:
-        documents_qs = documents_qs.filter(
-            Q(nazwa__icontains=search_query) | Q(opis__icontains=search_query) | Q(tagi__nazwa__icontains=search_query)
-        ).distinct()
+        documents_qs = search_queryset(documents_qs, search_query)
     
     folder_id_filter = request.GET.get('folder')
     if folder_id_filter:
@@ -181,24 +175,31 @@ def document_list(request):
         elif file_type_filter == 'image': documents_qs = documents_qs.filter(Q(typ_pliku__contains='image') | Q(nazwa__endswith='.png') | Q(nazwa__endswith='.jpg') | Q(nazwa__endswith='.jpeg'))
 
 
-    paginator = Paginator(documents_qs, 20)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # Cursor pagination on the (ostatnia_modyfikacja, id) index; search results keep their ranking
+    if search_query:
+        paginator = OffsetPaginator(documents_qs, 20)
+    else:
+        paginator = KeysetPaginator(documents_qs, 20, ('ostatnia_modyfikacja', 'id'))
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    pagination_query = request.GET.copy()
+    pagination_query.pop('cursor', None)
 
+    document_perms = resolve_document_permissions(request.user, page_obj)
     for doc_item in page_obj:
-        doc_item.current_user_can_edit = user_can_edit_document(request.user, doc_item)
-        doc_item.current_user_can_delete = user_can_delete_document(request.user, doc_item)
+        doc_item.current_user_can_edit = 'change_document' in document_perms[doc_item.pk]
+        doc_item.current_user_can_delete = 'delete_document' in document_perms[doc_item.pk]
 
     # Folders and Tags for filtering dropdowns
     if request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.is_admin):
         folders_for_filter = Folder.objects.all().order_by('nazwa')
     else:
-        folders_for_filter = Folder.objects.filter(wlasciciel=request.user).order_by('nazwa') # Or folders they can view
+        folders_for_filter = Folder.objects.accessible_by(request.user).order_by('nazwa')
     
     tags_for_filter = Tag.objects.all().order_by('nazwa')
     
     context = {
         'page_obj': page_obj,
+        'pagination_query': pagination_query.urlencode(),
         'search_query': search_query,
         'folders': folders_for_filter,
         'tags': tags_for_filter,
@@ -216,7 +217,6 @@ def document_detail(request, pk):
         Document.objects.prefetch_related(
             'tagi', 'wlasciciel__profile', 'folder',
             'wersje__utworzony_przez__profile',
-            Prefetch('komentarze', queryset=Comment.objects.filter(rodzic=None, aktywny=True).select_related('uzytkownik__profile').order_by('data_utworzenia')),
             'metadane'
         ),
         pk=pk, usunieto=False
@@ -236,9 +236,12 @@ def document_detail(request, pk):
             new_comment = posted_comment_form.save(commit=False)
             new_comment.dokument = document
             new_comment.uzytkownik = request.user
+            parent_id = request.POST.get('parent_id')
+            if parent_id and parent_id.isdigit(): # Reply - only to an active comment of the same document
+                new_comment.rodzic = Comment.objects.filter(pk=parent_id, dokument=document, aktywny=True).first()
             new_comment.save()
             messages.success(request, 'Komentarz został dodany pomyślnie.')
-            ActivityLog.objects.create(
+            log_activity(
                 uzytkownik=request.user, typ_aktywnosci='komentowanie', dokument=document,
                 szczegoly=f"Dodano komentarz do dokumentu {document.nazwa}", adres_ip=get_client_ip(request)
             )
@@ -248,16 +251,20 @@ def document_detail(request, pk):
             messages.error(request, 'Wystąpił błąd podczas dodawania komentarza.')
 
     if request.method == 'GET':
-        ActivityLog.objects.create(
+        log_activity(
             uzytkownik=request.user, typ_aktywnosci='pobieranie', dokument=document,
             szczegoly=f"Wyświetlenie dokumentu {document.nazwa}", adres_ip=get_client_ip(request)
         )
 
+    # Whole discussion in one query, flattened into display order with nesting depth
+    comments = flatten_comment_tree(load_comment_tree(document))
+
     # POPRAWIONY KONTEKST - nazwy zmiennych muszą się zgadzać z szablonem
     context = {
         'document': document,
         'versions': document.wersje.all(),
-        'comments': document.komentarze.all(),
+        'comments': comments,
+        'comment_count': len(comments),
         'metadata': document.metadane.all(),
         'can_edit_this_document': user_can_edit_document(request.user, document),
         'can_delete_this_document': user_can_delete_document(request.user, document),
@@ -285,22 +292,27 @@ def document_upload(request, folder_id=None):
     if request.method == 'POST':
         form = DocumentUploadForm(request.POST, request.FILES, user=request.user)
         if form.is_valid():
-            document = form.save(commit=False)
-            document.wlasciciel = request.user
-            if target_folder:
-                document.folder = target_folder
-            document.save()
-            form.save_m2m()
-
-            # Assign default owner permissions
-            assign_perm('browse_document', request.user, document)
-            assign_perm('change_document', request.user, document)
-            assign_perm('delete_document', request.user, document)
-            assign_perm('share_document', request.user, document)
-            assign_perm('download_document', request.user, document)
-            assign_perm('comment_document', request.user, document)
-
-            ActivityLog.objects.create(
+            try:
+                with transaction.atomic():
+                    document = form.save(commit=False)
+                    document.wlasciciel = request.user
+                    if target_folder:
+                        document.folder = target_folder
+                    if form.cleaned_data.get('przeslanie'): # File sent earlier in chunks
+                        attach_upload(document, form.cleaned_data['przeslanie'])
+                    document.save()
+                    form.save_m2m()
+
+                    # Assign default owner permissions
+                    bulk_grant_permissions([document], [request.user], DOCUMENT_PERMISSIONS)
+                    schedule_extraction(document)
+                    schedule_renditions([document])
+            except ValidationError as e:
+                form.add_error(None, e)
+                messages.error(request, "Popraw błędy w formularzu.")
+                return render(request, 'documents/document_upload.html', _upload_context(form, target_folder=target_folder))
+
+            log_activity(
                 uzytkownik=request.user, typ_aktywnosci='tworzenie', dokument=document,
                 szczegoly=f"Utworzono dokument {document.nazwa}" + (f" w folderze {target_folder.nazwa}" if target_folder else ""),
                 adres_ip=get_client_ip(request)
@@ -315,8 +327,50 @@ def document_upload(request, folder_id=None):
             form.fields['folder'].initial = target_folder
             form.fields['folder'].widget.attrs['disabled'] = True # If uploading to specific folder, don't allow change
 
-    context = {'form': form, 'target_folder': target_folder}
-    return render(request, 'documents/document_upload.html', context)
+    return render(request, 'documents/document_upload.html', _upload_context(form, target_folder=target_folder))
+
+
+@login_required
+def document_batch_upload(request, folder_id=None):
+    """Many files or ZIP archives at once - one transaction and one log entry (documents.batch_upload)"""
+    target_folder = None
+    if folder_id:
+        target_folder = get_object_or_404(Folder, pk=folder_id)
+        if not user_can_view_folder(request.user, target_folder):
+            raise PermissionDenied("Nie masz uprawnień do tego folderu.")
+
+    if not user_can_create_document(request.user):
+        messages.error(request, "Nie masz uprawnień do dodawania dokumentów.")
+        return redirect('documents:home' if not folder_id else ('documents:folder_view', folder_id))
+
+    if request.method == 'POST':
+        form = BatchUploadForm(request.POST, request.FILES, user=request.user)
+        if form.is_valid():
+            folder = target_folder or form.cleaned_data['folder']
+            result = ingest_batch(
+                form.cleaned_data['pliki'], request.user, folder=folder,
+                tags=form.cleaned_data['tagi'], status=form.cleaned_data['status'],
+                adres_ip=get_client_ip(request),
+            )
+            if result.documents:
+                messages.success(request, f'Dodano {len(result.documents)} dokumentów.')
+            for name, reason in result.skipped[:20]:
+                messages.warning(request, f'Pominięto "{name}": {reason}')
+            if len(result.skipped) > 20:
+                messages.warning(request, f'Pominięto jeszcze {len(result.skipped) - 20} plików.')
+            if result.documents:
+                return redirect('documents:folder_view', folder_id=folder.id) if folder else redirect('documents:home')
+        else:
+            messages.error(request, "Popraw błędy w formularzu.")
+    else:
+        form = BatchUploadForm(user=request.user)
+        if target_folder:
+            form.fields['folder'].initial = target_folder
+            form.fields['folder'].widget.attrs['disabled'] = True
+
+    from .settings_cache import format_size
+    context = {'form': form, 'target_folder': target_folder, 'max_file_size': format_size(Document.get_max_file_size())}
+    return render(request, 'documents/document_batch_upload.html', context)
 
 
 @login_required
@@ -329,7 +383,7 @@ def document_edit(request, pk):
         form = DocumentUpdateForm(request.POST, instance=document, user=request.user)
         if form.is_valid():
             form.save()
-            ActivityLog.objects.create(
+            log_activity(
                 uzytkownik=request.user, typ_aktywnosci='edycja', dokument=document,
                 szczegoly=f"Edytowano metadane dokumentu {document.nazwa}", adres_ip=get_client_ip(request)
             )
@@ -353,20 +407,19 @@ def document_delete(request, pk):
         # if request.POST.get('final_confirm') == 'yes': # From document_delete.html
         document_name = document.nazwa
         folder_id = document.folder.id if document.folder else None
-        ActivityLog.objects.create(
+        log_activity(
             uzytkownik=request.user, typ_aktywnosci='usuniecie',
             szczegoly=f"Usunięto dokument {document_name}", adres_ip=get_client_ip(request)
         )
-        document.usunieto = True # Soft delete
-        document.save()
-        messages.success(request, f'Dokument "{document_name}" został usunięty.')
+        document.move_to_trash(request.user)
+        messages.success(request, f'Dokument "{document_name}" został przeniesiony do kosza.')
         return redirect('documents:folder_view', folder_id=folder_id) if folder_id else redirect('documents:home')
         # else:
         #     messages.warning(request, "Usunięcie nie zostało potwierdzone.")
         #     return redirect('documents:document_delete', pk=pk)
 
 
-    context = {'document': document}
+    context = {'document': document, 'retention_days': Document.get_trash_retention_days()}
     return render(request, 'documents/document_delete.html', context)
 
 
@@ -377,64 +430,162 @@ def document_version_upload(request, pk):
         raise PermissionDenied("Nie masz uprawnień do dodawania nowej wersji tego dokumentu.")
 
     if request.method == 'POST':
-        form = DocumentVersionUploadForm(request.POST, request.FILES)
+        form = DocumentVersionUploadForm(request.POST, request.FILES, user=request.user)
         if form.is_valid():
             latest_version = document.wersje.order_by('-numer_wersji').first()
             new_version_number = (latest_version.numer_wersji + 1) if latest_version else 1
             
-            version = DocumentVersion.objects.create(
-                dokument=document, numer_wersji=new_version_number,
-                utworzony_przez=request.user, plik=form.cleaned_data['plik'],
-                komentarz=form.cleaned_data['komentarz']
-            )
-            document.plik = version.plik
-            document.rozmiar_pliku = version.rozmiar_pliku
-            document.save() # This also updates ostatnia_modyfikacja
-
-            ActivityLog.objects.create(
+            try:
+                with transaction.atomic():
+                    version = DocumentVersion(
+                        dokument=document, numer_wersji=new_version_number,
+                        utworzony_przez=request.user, plik=form.cleaned_data['plik'],
+                        komentarz=form.cleaned_data['komentarz']
+                    )
+                    if form.cleaned_data.get('przeslanie'): # File sent earlier in chunks
+                        attach_upload(version, form.cleaned_data['przeslanie'])
+                    version.save()
+                    document.plik = version.plik
+                    document.rozmiar_pliku = version.rozmiar_pliku
+                    document.hash_pliku = version.hash_pliku
+                    document.typ_mime = version.typ_mime
+                    document.save() # This also updates ostatnia_modyfikacja
+                    schedule_extraction(document, version)
+                    schedule_renditions([document])
+            except ValidationError as e:
+                form.add_error(None, e)
+                return render(request, 'documents/document_version_upload.html', _upload_context(form, document=document))
+
+            log_activity(
                 uzytkownik=request.user, typ_aktywnosci='edycja', dokument=document,
                 szczegoly=f"Utworzono wersję {new_version_number} dokumentu {document.nazwa}", adres_ip=get_client_ip(request)
             )
             messages.success(request, f'Utworzono nową wersję ({new_version_number}) dokumentu.')
             return redirect('documents:document_detail', pk=pk)
     else:
-        form = DocumentVersionUploadForm()
+        form = DocumentVersionUploadForm(user=request.user)
     
-    context = {'form': form, 'document': document}
-    return render(request, 'documents/document_version_upload.html', context)
+    return render(request, 'documents/document_version_upload.html', _upload_context(form, document=document))
+
+
+def _upload_context(form, **context):
+    """Context of the upload pages, with the limits of chunked uploads for their script"""
+    from .settings_cache import format_size
+    max_size = get_max_upload_size()
+    return {
+        'form': form,
+        'upload_max_size': max_size,
+        'upload_max_size_display': format_size(max_size),
+        'upload_chunk_size': get_max_chunk_size(),
+        **context,
+    }
+
+
+# Chunked uploads (protocol described in documents/chunked_uploads.py)
+
+def _upload_response(session, status=200):
+    response = JsonResponse({
+        'id': session.pk,
+        'url': reverse('documents:upload_session', args=[session.pk]),
+        'offset': session.przeslano,
+        'length': session.rozmiar,
+        'complete': session.is_complete,
+    }, status=status)
+    response['Upload-Offset'] = str(session.przeslano)
+    response['Upload-Length'] = str(session.rozmiar)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+def _upload_error(message, status=400):
+    return JsonResponse({'error': message}, status=status)
+
+
+@login_required
+@require_http_methods(["POST"])
+def upload_sessions(request):
+    """Start a chunked upload"""
+    if not user_can_create_document(request.user): # Editors and admins - the only ones adding files or versions
+        return _upload_error("Nie masz uprawnień do wgrywania plików.", status=403)
+    try:
+        size = int(request.POST.get('rozmiar') or request.headers.get('Upload-Length', ''))
+    except ValueError:
+        return _upload_error("Nieprawidłowy rozmiar pliku.")
+    try:
+        session = create_session(request.user, request.POST.get('nazwa_pliku', ''), size)
+    except ValidationError as e:
+        return _upload_error(' '.join(e.messages), status=413 if size > get_max_upload_size() else 400)
+    response = _upload_response(session, status=201)
+    response['Location'] = reverse('documents:upload_session', args=[session.pk])
+    return response
+
+
+@login_required
+@require_http_methods(["GET", "HEAD", "PATCH", "DELETE"])
+def upload_session(request, pk):
+    """Offset of a chunked upload (GET/HEAD), its next chunk (PATCH) or abandoning it (DELETE)"""
+    session = get_object_or_404(UploadSession, pk=pk, uzytkownik=request.user)
+    if request.method == 'DELETE':
+        abort_session(session)
+        return HttpResponse(status=204)
+    if request.method == 'PATCH':
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.headers.get('Content-Length') or 0)
+        except ValueError:
+            return _upload_error("Brak lub nieprawidłowy nagłówek Upload-Offset.")
+        try:
+            # Read from the request stream, so the chunk never sits in memory whole
+            append_chunk(session, offset, request, length, request.headers.get('Upload-Checksum'))
+        except UploadConflict as e:
+            response = _upload_error("Fragment nie zaczyna się w miejscu, w którym zatrzymało się przesyłanie.", status=409)
+            response['Upload-Offset'] = str(e.offset)
+            return response
+        except ValidationError as e:
+            session.refresh_from_db()
+            response = _upload_error(' '.join(e.messages))
+            response['Upload-Offset'] = str(session.przeslano)
+            return response
+        session.refresh_from_db()
+    return _upload_response(session)
 
 
 @login_required
 def folder_list(request):
-    # Similar to document_list, this could be admin-focused or show folders user can view
+    # Admins see all folders, other users the folders they own or that were shared with them
     if not (request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.is_admin)):
-        messages.warning(request, "Ta lista folderów jest dostępna dla administratorów.")
-        # return redirect('documents:home')
-        root_folders_qs = get_objects_for_user(request.user, 'documents.browse_folder', klass=Folder).filter(rodzic=None)
+        root_folders_qs = Folder.objects.accessible_by(request.user).filter(rodzic=None)
     else:
         root_folders_qs = Folder.objects.filter(rodzic=None)
 
-    root_folders_qs = root_folders_qs.select_related('wlasciciel__profile').prefetch_related(
+    root_folders_qs = root_folders_qs.with_counts().select_related('wlasciciel__profile').prefetch_related(
         'tagi', 
-        Prefetch('podkatalogi', queryset=Folder.objects.select_related('wlasciciel__profile').prefetch_related('tagi'))
+        Prefetch('podkatalogi', queryset=Folder.objects.with_counts().select_related('wlasciciel__profile').prefetch_related('tagi'))
     )
     
+    all_listed_folders = []
     for folder_item in root_folders_qs:
-        folder_item.current_user_can_edit = user_can_edit_folder(request.user, folder_item)
-        folder_item.current_user_can_delete = user_can_delete_folder(request.user, folder_item)
-        for sub_folder in folder_item.podkatalogi.all(): # Assuming prefetch worked
-            sub_folder.current_user_can_edit = user_can_edit_folder(request.user, sub_folder)
-            sub_folder.current_user_can_delete = user_can_delete_folder(request.user, sub_folder)
+        all_listed_folders.append(folder_item)
+        all_listed_folders.extend(folder_item.podkatalogi.all()) # Assuming prefetch worked
+
+    folder_perms = resolve_folder_permissions(request.user, all_listed_folders)
+    for folder_item in all_listed_folders:
+        folder_item.current_user_can_edit = 'change_folder' in folder_perms[folder_item.pk]
+        folder_item.current_user_can_delete = 'delete_folder' in folder_perms[folder_item.pk]
 
 
     # For statistics card
     user_folders_count = Folder.objects.filter(wlasciciel=request.user).count()
+    total_subfolders = sum(folder_item.subfolder_count for folder_item in root_folders_qs)
+    total_documents_in_folders = sum(folder_item.doc_count for folder_item in all_listed_folders)
 
 
     context = {
         'root_folders': root_folders_qs,
         'user_can_create_folders': user_can_create_folder(request.user),
         'user_folders_count': user_folders_count, # For stats card
+        'total_subfolders': total_subfolders,
+        'total_documents_in_folders': total_documents_in_folders,
         }
     return render(request, 'documents/folder_list.html', context)
 
@@ -462,13 +613,11 @@ def folder_create(request, parent_id=None):
             form.save_m2m() # For tags
 
             # Assign default owner permissions
-            assign_perm('browse_folder', request.user, new_folder)
-            assign_perm('change_folder', request.user, new_folder)
-            assign_perm('delete_folder', request.user, new_folder)
+            bulk_grant_permissions([new_folder], [request.user], ['browse_folder', 'change_folder', 'delete_folder'])
             # assign_perm('add_document_to_folder', request.user, new_folder)
             # assign_perm('add_subfolder_to_folder', request.user, new_folder)
 
-            ActivityLog.objects.create(
+            log_activity(
                 uzytkownik=request.user, typ_aktywnosci='tworzenie', folder=new_folder,
                 szczegoly=f"Utworzono folder {new_folder.nazwa}" + (f" w folderze {parent_folder.nazwa}" if parent_folder else ""),
                 adres_ip=get_client_ip(request)
@@ -495,7 +644,7 @@ def folder_edit(request, pk):
         form = FolderUpdateForm(request.POST, instance=folder, user=request.user)
         if form.is_valid():
             updated_folder = form.save()
-            ActivityLog.objects.create(
+            log_activity(
                 uzytkownik=request.user, typ_aktywnosci='edycja', folder=updated_folder,
                 szczegoly=f"Edytowano folder {updated_folder.nazwa}", adres_ip=get_client_ip(request)
             )
@@ -514,6 +663,10 @@ def folder_delete(request, pk):
     if not user_can_delete_folder(request.user, folder):
         raise PermissionDenied("Nie masz uprawnień do usunięcia tego folderu.")
 
+    active_job = get_active_job(folder)
+    if active_job:
+        return redirect('documents:folder_delete_job', pk=active_job.pk)
+
     documents_count = folder.documents.filter(usunieto=False).count()
     subfolders_count = folder.podkatalogi.count() # Assumes podkatalogi is the related_name
 
@@ -529,20 +682,24 @@ def folder_delete(request, pk):
                 if action == 'move_to_parent':
                     parent = folder.rodzic
                     moved_docs = folder.documents.filter(usunieto=False).update(folder=parent)
-                    moved_folders = folder.podkatalogi.update(rodzic=parent)
+                    moved_folders = folder.move_children_to(parent)
                     details = f"Usunięto folder {folder_name}. Przeniesiono {moved_docs} dok. i {moved_folders} podf. do nadrzędnego."
                 elif action == 'move_to_folder':
                     moved_docs = folder.documents.filter(usunieto=False).update(folder=target_folder_form)
-                    moved_folders = folder.podkatalogi.update(rodzic=target_folder_form)
+                    moved_folders = folder.move_children_to(target_folder_form)
                     details = f"Usunięto folder {folder_name}. Przeniesiono {moved_docs} dok. i {moved_folders} podf. do {target_folder_form.nazwa}."
                 elif action == 'delete_all':
-                    # Documents marked as usunieto=True
-                    deleted_docs_count = folder.documents.filter(usunieto=False).update(usunieto=True)
-                    # Subfolders will be deleted by cascade if Folder.rodzic on_delete=models.CASCADE
-                    # If not, you'd need to recursively delete subfolders here or ensure models.CASCADE.
-                    details = f"Usunięto folder {folder_name} wraz z {deleted_docs_count} dok. i {subfolders_count} podfolderami."
-
-                ActivityLog.objects.create(
+                    # The subtree is deleted in batches by a background job, documents go to the trash
+                    job = start_folder_deletion(folder, request.user)
+                    log_activity(
+                        uzytkownik=request.user, typ_aktywnosci='usuniecie',
+                        szczegoly=f"Rozpoczęto usuwanie folderu {folder_name} wraz z {job.liczba_dokumentow} dok. i {job.liczba_folderow - 1} podfolderami.",
+                        adres_ip=get_client_ip(request)
+                    )
+                    messages.info(request, f'Folder "{folder_name}" jest usuwany w tle.')
+                    return redirect('documents:folder_delete_job', pk=job.pk)
+
+                log_activity(
                     uzytkownik=request.user, typ_aktywnosci='usuniecie',
                     szczegoly=details, adres_ip=get_client_ip(request)
                 )
@@ -566,10 +723,39 @@ def folder_delete(request, pk):
     return render(request, 'documents/folder_delete.html', context)
 
 
+def _get_folder_delete_job(request, pk):
+    job = get_object_or_404(FolderDeletionJob.objects.select_related('rodzic'), pk=pk)
+    if job.uzytkownik_id != request.user.pk and not (request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.is_admin)):
+        raise PermissionDenied("Nie masz dostępu do tego zadania.")
+    resume_if_stale(job) # Its worker may have died with a restart
+    return job
+
+
+@login_required
+def folder_delete_job(request, pk):
+    """Progress of a background folder deletion"""
+    job = _get_folder_delete_job(request, pk)
+    return render(request, 'documents/folder_delete_job.html', {'job': job})
+
+
+@login_required
+def folder_delete_job_status(request, pk):
+    job = _get_folder_delete_job(request, pk)
+    return JsonResponse({
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'finished': job.is_finished,
+        'progress': job.get_progress(),
+        'usuniete_dokumenty': job.usuniete_dokumenty,
+        'liczba_dokumentow': job.liczba_dokumentow,
+        'usuniete_foldery': job.usuniete_foldery,
+        'liczba_folderow': job.liczba_folderow,
+        'blad': job.blad,
+    })
+
+
 # AJAX Search and other APIs remain largely the same,
 # but ensure their internal queries respect permissions if they list/access sensitive data.
-# For search_documents, the existing owner/superuser check is a basic filter.
-# A full permission-aware search would use get_objects_for_user.
 
 @login_required
 def search_documents(request):
@@ -577,18 +763,13 @@ def search_documents(request):
     results_data = []
     if len(query) >= 2: # Minimum query length
         # Get documents user is allowed to browse
-        allowed_documents = get_objects_for_user(
-            request.user,
-            'documents.browse_document',
-            klass=Document
-        ).filter(usunieto=False)
-
-        # Further filter by the search query
-        searched_documents = allowed_documents.filter(
-            Q(nazwa__icontains=query) |
-            Q(opis__icontains=query) |
-            Q(tagi__nazwa__icontains=query)
-        ).distinct()[:10] # Limit results
+        if request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.is_admin):
+            allowed_documents = Document.objects.filter(usunieto=False)
+        else:
+            allowed_documents = Document.objects.accessible_by(request.user).filter(usunieto=False)
+
+        # Further filter by the search query, best matches first
+        searched_documents = search_queryset(allowed_documents, query).select_related('folder')[:10] # Limit results
 
         for doc in searched_documents:
             results_data.append({
@@ -619,21 +800,19 @@ def document_download(request, pk):
         raise Http404("Plik nie został znaleziony.")
 
     try:
-        # Log download activity
-        ActivityLog.objects.create(
-            uzytkownik=request.user,
-            typ_aktywnosci='pobieranie',
-            dokument=document,
-            szczegoly=f"Pobranie dokumentu {document.nazwa}",
-            adres_ip=get_client_ip(request)
-        )
-
-        # Serve file
-        response = FileResponse(
-            document.plik.open('rb'),
-            as_attachment=True,
-            filename=document.nazwa # Use the document's name for the downloaded file
+        # Serve file (conditional GET, Range, optional X-Sendfile offload)
+        response = serve_file(
+            request, document.plik, document.hash_pliku,
+            filename=document.nazwa, # Use the document's name for the downloaded file
         )
+        if is_new_transfer(response): # Not for 304s and resumed ranges
+            log_activity(
+                uzytkownik=request.user,
+                typ_aktywnosci='pobieranie',
+                dokument=document,
+                szczegoly=f"Pobranie dokumentu {document.nazwa}",
+                adres_ip=get_client_ip(request)
+            )
         return response
 
     except FileNotFoundError:
@@ -664,24 +843,25 @@ def document_preview(request, pk):
         messages.warning(request, "Ten typ pliku nie może być wyświetlony w przeglądarce.")
         return redirect('documents:document_detail', pk=pk)
 
+    if document.has_html_preview(): # Word and Excel files: HTML rendered once per content
+        try:
+            preview_html = get_preview_html(document.plik, document.hash_pliku)
+        except PreviewUnavailable as e:
+            messages.warning(request, f"Nie można wyświetlić podglądu tego pliku: {e}")
+            return redirect('documents:document_detail', pk=pk)
+        return render(request, 'documents/document_office_preview.html', {
+            'document': document,
+            'preview_html': preview_html,
+        })
+
     try:
-        # Determine content type
-        content_type, encoding = mimetypes.guess_type(document.plik.name)
-        if not content_type:
-            # Fallback if mimetypes can't guess, you might have stored it on the model
-            content_type = document.typ_pliku # Assuming typ_pliku is a basic MIME type
-            if not content_type: # Further fallback
-                 content_type = 'application/octet-stream'
-
-
-        # Serve file for preview
-        response = FileResponse(
-            document.plik.open('rb'),
-            content_type=content_type
+        # Serve file for preview - 'inline' suggests to the browser to display it
+        # if possible; PDF viewers fetch it with Range requests. The Content-Type
+        # follows the file extension (see documents/serving.py)
+        return serve_file(
+            request, document.plik, document.hash_pliku,
+            filename=document.nazwa, as_attachment=False,
         )
-        # 'inline' suggests to the browser to display it if possible, rather than download
-        response['Content-Disposition'] = f'inline; filename="{document.nazwa}"'
-        return response
 
     except FileNotFoundError:
         messages.error(request, "Plik dokumentu nie został znaleziony na serwerze.")
@@ -690,6 +870,30 @@ def document_preview(request, pk):
         messages.error(request, f"Wystąpił błąd podczas próby podglądu pliku: {e}")
         return redirect('documents:document_detail', pk=document.pk)
 
+@login_required
+def document_rendition(request, pk, size):
+    """Downscaled image of a document (see documents/renditions.py)"""
+    document = get_object_or_404(Document, pk=pk, usunieto=False)
+    if not user_can_view_document(request.user, document):
+        raise PermissionDenied("Nie masz uprawnień do tego dokumentu.")
+    if size not in get_sizes() or not document.has_renditions():
+        raise Http404("Brak miniatury dla tego dokumentu.")
+
+    etag = f'"{document.hash_pliku}-{size}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        path = get_rendition_path(document.hash_pliku, document.plik.name, size)
+        if path is None:
+            raise Http404("Nie udało się utworzyć miniatury.")
+        response = FileResponse(open(path, 'rb'), content_type=rendition_content_type())
+        response['ETag'] = etag
+    if request.GET.get('v') == rendition_version(document.hash_pliku):
+        # The URL changes with the content - cached for good, in the user's browser only
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    else:
+        response['Cache-Control'] = 'private, no-cache'
+    return response
+
 @login_required
 def document_version_download(request, document_pk, version_pk):
     """Download specific version of document file"""
@@ -704,25 +908,23 @@ def document_version_download(request, document_pk, version_pk):
         raise Http404("Plik wersji nie został znaleziony.")
 
     try:
-        # Log download activity
-        ActivityLog.objects.create(
-            uzytkownik=request.user,
-            typ_aktywnosci='pobieranie',
-            dokument=document,
-            szczegoly=f"Pobranie wersji {version.numer_wersji} dokumentu {document.nazwa}",
-            adres_ip=get_client_ip(request)
-        )
-
         # Serve file with version info in filename
         base_name = os.path.splitext(document.nazwa)[0]
         ext = os.path.splitext(document.nazwa)[1]
         version_filename = f"{base_name}_v{version.numer_wersji}{ext}"
 
-        response = FileResponse(
-            version.plik.open('rb'),
-            as_attachment=True,
-            filename=version_filename
+        response = serve_file(
+            request, version.plik, version.hash_pliku,
+            filename=version_filename,
         )
+        if is_new_transfer(response):
+            log_activity(
+                uzytkownik=request.user,
+                typ_aktywnosci='pobieranie',
+                dokument=document,
+                szczegoly=f"Pobranie wersji {version.numer_wersji} dokumentu {document.nazwa}",
+                adres_ip=get_client_ip(request)
+            )
         return response
 
     except FileNotFoundError:
@@ -730,4 +932,151 @@ def document_version_download(request, document_pk, version_pk):
         return redirect('documents:document_detail', pk=document.pk)
     except Exception as e:
         messages.error(request, f"Wystąpił błąd podczas próby pobrania pliku: {e}")
-        return redirect('documents:document_detail', pk=document.pk)
\ No newline at end of file
+        return redirect('documents:document_detail', pk=document.pk)
+
+
+@login_required
+def folder_export(request, pk):
+    """Download a folder with its subfolders as a ZIP archive, streamed while it is built"""
+    folder = get_object_or_404(Folder, pk=pk)
+    if not user_can_view_folder(request.user, folder):
+        raise PermissionDenied("Nie masz uprawnień do pobrania tego folderu.")
+
+    # Documents the user cannot view are left out, like in the folder view
+    response = export_response(
+        exportable_documents(request.user, folder=folder), f"{folder.nazwa}.zip", paths=folder_paths(folder)
+    )
+    log_activity(
+        uzytkownik=request.user,
+        typ_aktywnosci='pobieranie',
+        folder=folder,
+        szczegoly=f"Pobranie folderu {folder.nazwa} jako ZIP",
+        adres_ip=get_client_ip(request)
+    )
+    return response
+
+
+@login_required
+@require_http_methods(["GET", "POST"])
+def documents_export(request):
+    """Download the selected documents (dokumenty=<id>, repeated) as a ZIP archive"""
+    data = request.POST if request.method == 'POST' else request.GET
+    document_ids = [value for value in data.getlist('dokumenty') if value.isdigit()]
+    if not document_ids:
+        messages.error(request, "Nie zaznaczono żadnych dokumentów do pobrania.")
+        return redirect(request.META.get('HTTP_REFERER') or 'documents:home')
+
+    documents = exportable_documents(request.user, document_ids=document_ids)
+    response = export_response(documents, f"dokumenty_{datetime.now():%Y%m%d_%H%M}.zip")
+    log_activity(
+        uzytkownik=request.user,
+        typ_aktywnosci='pobieranie',
+        szczegoly=f"Pobranie {len(document_ids)} zaznaczonych dokumentów jako ZIP",
+        adres_ip=get_client_ip(request)
+    )
+    return response
+
+
+@login_required
+def trash(request):
+    """Documents in the trash - all for admins, otherwise the user's own"""
+    is_admin = request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.is_admin)
+    documents_qs = Document.objects.in_trash().select_related('wlasciciel__profile', 'folder', 'usuniety_przez')
+    if not is_admin:
+        documents_qs = documents_qs.filter(wlasciciel=request.user)
+
+    paginator = KeysetPaginator(documents_qs, 20, ('data_usuniecia', 'id'))
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    resolved = resolve_document_permissions(request.user, page_obj.object_list)
+    for doc_item in page_obj:
+        doc_item.current_user_can_delete = 'delete_document' in resolved[doc_item.pk]
+
+    context = {
+        'page_obj': page_obj,
+        'retention_days': Document.get_trash_retention_days(),
+    }
+    return render(request, 'documents/trash.html', context)
+
+
+@login_required
+@require_http_methods(["POST"])
+def document_restore(request, pk):
+    document = get_object_or_404(Document.objects.in_trash().select_related('folder'), pk=pk)
+    if not user_can_delete_document(request.user, document):
+        raise PermissionDenied("Nie masz uprawnień do przywrócenia tego dokumentu.")
+
+    deleted_folder = '' if document.folder_id else document.lokalizacja_przed_usunieciem
+    document.restore()
+    log_activity(
+        uzytkownik=request.user, typ_aktywnosci='edycja', dokument=document,
+        szczegoly=f"Przywrócono dokument {document.nazwa} z kosza", adres_ip=get_client_ip(request)
+    )
+    if deleted_folder:
+        messages.warning(
+            request, f'Dokument "{document.nazwa}" został przywrócony do folderu głównego - '
+                     f'jego folder "{deleted_folder}" został usunięty.'
+        )
+    else:
+        messages.success(request, f'Dokument "{document.nazwa}" został przywrócony.')
+    return redirect('documents:trash')
+
+
+@login_required
+@require_http_methods(["POST"])
+def document_purge(request, pk):
+    document = get_object_or_404(Document.objects.in_trash(), pk=pk)
+    if not user_can_delete_document(request.user, document):
+        raise PermissionDenied("Nie masz uprawnień do usunięcia tego dokumentu.")
+
+    schedule_purge([document.pk])
+    log_activity(
+        uzytkownik=request.user, typ_aktywnosci='usuniecie',
+        szczegoly=f"Trwale usunięto dokument {document.nazwa} z kosza", adres_ip=get_client_ip(request)
+    )
+    messages.success(request, f'Dokument "{document.nazwa}" zostanie trwale usunięty.')
+    return redirect('documents:trash')
+
+
+@login_required
+@require_http_methods(["POST"])
+def trash_empty(request):
+    """Purge every trashed document the user may delete, in the background"""
+    documents_qs = Document.objects.in_trash().only('pk', 'wlasciciel_id')
+    if not (request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.is_admin)):
+        documents_qs = documents_qs.filter(wlasciciel=request.user)
+    resolved = resolve_document_permissions(request.user, documents_qs)
+    document_ids = [pk for pk, perms in resolved.items() if 'delete_document' in perms]
+
+    schedule_purge(document_ids)
+    if document_ids:
+        log_activity(
+            uzytkownik=request.user, typ_aktywnosci='usuniecie',
+            szczegoly=f"Opróżniono kosz ({len(document_ids)} dok.)", adres_ip=get_client_ip(request)
+        )
+    messages.success(request, f'Dokumenty z kosza ({len(document_ids)}) zostaną trwale usunięte.')
+    return redirect('documents:trash')
+
+
+@login_required
+def activity_log(request):
+    """Activity log for admins, newest first, paged by cursor on (znacznik_czasu, id)"""
+    if not (request.user.is_superuser or (hasattr(request.user, 'profile') and request.user.profile.is_admin)):
+        raise PermissionDenied("Nie masz uprawnień do przeglądania dziennika aktywności.")
+
+    logs_qs = ActivityLog.objects.select_related('uzytkownik', 'dokument', 'folder')
+    selected_type = request.GET.get('typ', '')
+    if selected_type:
+        logs_qs = logs_qs.filter(typ_aktywnosci=selected_type)
+
+    paginator = KeysetPaginator(logs_qs, 50, ('znacznik_czasu', 'id'))
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    pagination_query = request.GET.copy()
+    pagination_query.pop('cursor', None)
+
+    context = {
+        'page_obj': page_obj,
+        'pagination_query': pagination_query.urlencode(),
+        'activity_types': ActivityLog.ACTION_CHOICES,
+        'selected_type': selected_type,
+    }
+    return render(request, 'documents/activity_log.html', context)
\ No newline at end of file
@@ -199,8 +199,7 @@ class CustomPasswordChangeForm(PasswordChangeForm):
         if commit:
             # Log password change activity with real IP
             try:
-                from documents.models import ActivityLog
-                from django.utils import timezone
+                from documents.activity import log_activity
                 
                 # Get IP address from request if available
                 ip_address = '127.0.0.1'
@@ -211,11 +210,10 @@ class CustomPasswordChangeForm(PasswordChangeForm):
                     else:
                         ip_address = self.request.META.get('REMOTE_ADDR', '127.0.0.1')
                 
-                ActivityLog.objects.create(
+                log_activity(
                     uzytkownik=user,
                     typ_aktywnosci='zmiana_hasla',
                     szczegoly=f'Użytkownik {user.get_full_name()} zmienił swoje hasło',
-                    znacznik_czasu=timezone.now(),
                     adres_ip=ip_address
                 )
             except ImportError:
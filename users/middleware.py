@@ -0,0 +1,22 @@
+from django.contrib.auth.middleware import get_user
+from django.utils.functional import SimpleLazyObject
+
+from .permissions import attach_permission_context
+
+
+class PermissionContextMiddleware:
+    """
+    Memoize permission checks for the duration of a request.
+
+    Wraps request.user so the user gets a PermissionContext when it is first
+    used: profile, role and guardian object permissions are then loaded once
+    and every user_can_* helper reads them from memory. Must come after
+    AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.user = SimpleLazyObject(lambda: attach_permission_context(get_user(request)))
+        return self.get_response(request)
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 21:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_create_default_roles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoleVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wersja', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'wersja_rol',
+            },
+        ),
+    ]
@@ -47,6 +47,20 @@ class UserProfile(models.Model):
     
     def __str__(self):
         return f"{self.user.get_full_name()} ({self.user.email}) - {self.rola if self.rola else 'Brak roli'}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_role()
+        return instance
+
+    def remember_role(self):
+        """Remember the stored role and active flag, see role_changed()"""
+        self._stored_role = (self.rola_id, self.aktywny)
+
+    def role_changed(self):
+        """Role or active flag differ from the stored ones (unknown ones count as changed)"""
+        return getattr(self, '_stored_role', None) != (self.rola_id, self.aktywny)
     
     @property
     def full_name(self):
@@ -79,6 +93,14 @@ class UserProfile(models.Model):
         verbose_name_plural = 'Profile użytkowników'
 
 
+class RoleVersion(models.Model):
+    """Version stamp of user roles, bumped on every change to invalidate cached roles in all processes"""
+    wersja = models.BigIntegerField(default=0)
+
+    class Meta:
+        db_table = 'wersja_rol'
+
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     """Automatically create user profile when user is created"""
@@ -1,8 +1,10 @@
 """
 Guardian permissions helpers for Document Manager
 """
-from guardian.shortcuts import assign_perm, remove_perm, get_perms
-# from guardian.core import ObjectPermissionChecker # Not directly used in these functions
+from functools import cached_property
+
+from guardian.core import ObjectPermissionChecker
+from guardian.shortcuts import get_perms
 from django.contrib.auth.models import User # Not directly needed if using request.user
 # from .models import UserProfile, Role # UserProfile is accessed via user.profile
 
@@ -11,48 +13,148 @@ from django.contrib.auth.models import User # Not directly needed if using reque
 # from documents.models import Document, Folder # Import these where needed or pass objects
 
 
+# --- Request-scoped permission context ---
+# A single page checks several permissions of the same user (view, download,
+# comment, edit, delete, share...). PermissionContext resolves the role once
+# (users.roles, usually without a query) and keeps one guardian ObjectPermissionChecker, whose cache holds
+# the object permissions of every object already checked or prefetched.
+# PermissionContextMiddleware attaches one to request.user for the duration of
+# the request; outside requests every helper call gets a fresh context, so
+# permissions changed meanwhile are always seen. Granting or revoking object
+# permissions (apply_object_permissions, assign_perm / remove_perm, group
+# membership) calls invalidate_permission_contexts(), so checks made later in
+# the same request reload them.
+
+_generation = 0 # Bumped by invalidate_permission_contexts()
+
+
+def invalidate_permission_contexts():
+    """Make every PermissionContext of this process reload object permissions on its next check."""
+    global _generation
+    _generation += 1
+
+
+class PermissionContext:
+    """Role and object permissions of one user, loaded at most once."""
+
+    def __init__(self, user):
+        self.user = user
+        self._generation = _generation
+        self._loaded = set() # (model, pk) of objects whose permissions the checker holds
+
+    def _refresh(self):
+        if self._generation != _generation: # Permissions changed since they were loaded
+            self.__dict__.pop('checker', None)
+            self._loaded = set()
+            self._generation = _generation
+
+    @staticmethod
+    def _key(obj):
+        return obj._meta.label_lower, obj.pk
+
+    @cached_property
+    def role(self):
+        from .roles import get_role_info
+        return get_role_info(self.user)
+
+    @cached_property
+    def is_admin(self):
+        from .models import Role
+        return self.user.is_superuser or self.role.rola == Role.ADMIN
+
+    @cached_property
+    def is_editor(self):
+        from .models import Role
+        return self.role.rola == Role.EDITOR
+
+    @cached_property
+    def profile_active(self):
+        return self.role.aktywny
+
+    @cached_property
+    def checker(self):
+        return ObjectPermissionChecker(self.user)
+
+    def prefetch(self, objects):
+        """Load guardian permissions of objects (one model) not checked yet, in two queries."""
+        self._refresh()
+        objects = [obj for obj in objects if self._key(obj) not in self._loaded]
+        if objects and self.user.is_active:
+            self.checker.prefetch_perms(objects)
+        self._loaded.update(self._key(obj) for obj in objects)
+
+    def get_object_perms(self, obj):
+        """Set of guardian permission codenames granted on obj (directly or via groups)."""
+        self._refresh()
+        self._loaded.add(self._key(obj)) # The checker caches what it loads
+        return set(self.checker.get_perms(obj))
+
+    def has_perm(self, perm, obj):
+        self._refresh()
+        self._loaded.add(self._key(obj))
+        return self.checker.has_perm(perm, obj)
+
+
+def get_permission_context(user):
+    """Context attached to user by PermissionContextMiddleware, or a fresh one."""
+    context = getattr(user, '_permission_context', None)
+    if context is None:
+        context = PermissionContext(user)
+    return context
+
+
+def attach_permission_context(user):
+    """Memoize permission checks on this user object (for the current request)."""
+    if getattr(user, '_permission_context', None) is None:
+        user._permission_context = PermissionContext(user)
+    return user
+
+
 # --- Document Permissions ---
 
 def user_can_view_document(user, document):
     """Check if user can view specific document."""
+    context = get_permission_context(user)
     if not user.is_authenticated:
         return False
 
     # Administratorzy widzą wszystko
-    if user.is_superuser or (hasattr(user, 'profile') and user.profile.is_admin):
+    if context.is_admin:
         return True
 
     # Właściciel zawsze może przeglądać swoje dokumenty
-    if document.wlasciciel == user:
+    if document.wlasciciel_id == user.pk:
         return True
 
     # Dla wszystkich innych - tylko jawnie nadane uprawnienia przez administratora
-    return user.has_perm('browse_document', document)
+    return context.has_perm('browse_document', document)
 
 
 def user_can_create_document(user):
     """Check if user can create new documents."""
+    context = get_permission_context(user)
     if not user.is_authenticated:
         return False
-    if user.is_superuser or (hasattr(user, 'profile') and (user.profile.is_admin or user.profile.is_editor)):
+    if context.is_admin or context.is_editor:
         return True
     return False
 
 
 def user_can_edit_document(user, document):
     """Check if user can edit specific document metadata or upload new versions."""
+    context = get_permission_context(user)
     if not user.is_authenticated:
         return False
 
-    if user.is_superuser or (hasattr(user, 'profile') and user.profile.is_admin):
+    if context.is_admin:
         return True
 
     # Owner can always edit their own documents if they are an editor or admin
-    if document.wlasciciel == user and (hasattr(user, 'profile') and (user.profile.is_admin or user.profile.is_editor)):
+    if document.wlasciciel_id == user.pk and context.is_editor:
         return True
     
     # An editor can edit if they have explicit change_document permission
-    if hasattr(user, 'profile') and user.profile.is_editor and user.has_perm('change_document', document):
+    if context.is_editor and context.has_perm('change_document', document):
         return True
 
     return False
@@ -60,21 +162,22 @@ def user_can_edit_document(user, document):
 
 def user_can_delete_document(user, document):
     """Check if user can delete specific document."""
+    context = get_permission_context(user)
     if not user.is_authenticated:
         return False
 
-    if user.is_superuser or (hasattr(user, 'profile') and user.profile.is_admin):
+    if context.is_admin:
         return True
 
     # Owner can delete their own documents if they are an editor or admin
-    if document.wlasciciel == user and (hasattr(user, 'profile') and (user.profile.is_admin or user.profile.is_editor)):
+    if document.wlasciciel_id == user.pk and context.is_editor:
         return True
         
     # An editor can delete if they have explicit delete_document permission (more restrictive)
     # Or, if 'change_document' implies delete for editors on shared items (policy decision)
     # For now, let's say only explicit delete_document perm or being admin/owner.
     # If you want editors with 'change_document' to also delete, add:
-    # if hasattr(user, 'profile') and user.profile.is_editor and user.has_perm('delete_document', document):
+    # if context.is_editor and context.has_perm('delete_document', document):
     #     return True
 
     return False
@@ -82,6 +185,7 @@ def user_can_delete_document(user, document):
 
 def user_can_comment_on_document(user, document):
     """Check if user can comment on a document."""
+    context = get_permission_context(user)
     if not user.is_authenticated:
         return False
 
@@ -90,76 +194,54 @@ def user_can_comment_on_document(user, document):
         return False
     
     # Sprawdź czy profil jest aktywny
-    if hasattr(user, 'profile') and not user.profile.aktywny:
+    if not context.profile_active:
         return False
     
     # Administratorzy mogą komentować wszystko co widzą
-    if user.is_superuser or (hasattr(user, 'profile') and user.profile.is_admin):
+    if context.is_admin:
         return True
     
     # Właściciel może komentować swoje dokumenty
-    if document.wlasciciel == user:
+    if document.wlasciciel_id == user.pk:
         return True
         
     # Dla innych - sprawdź jawnie nadane uprawnienie do komentowania
-    return user.has_perm('comment_document', document)
+    return context.has_perm('comment_document', document)
 
 
 def user_can_share_document(user, document):
     """Check if user can share specific document."""
+    context = get_permission_context(user)
     if not user.is_authenticated:
         return False
 
-    if user.is_superuser or (hasattr(user, 'profile') and user.profile.is_admin):
+    if context.is_admin:
         return True
 
-    if document.wlasciciel == user and (hasattr(user, 'profile') and (user.profile.is_admin or user.profile.is_editor)):
+    if document.wlasciciel_id == user.pk and context.is_editor:
         return True
     
-    if hasattr(user, 'profile') and user.profile.is_editor and user.has_perm('share_document', document):
+    if context.is_editor and context.has_perm('share_document', document):
         return True
 
     return False
 
 
-def share_document_with_user(document, from_user, to_user_obj, permission_level='browse_document'):
+def share_document_with_user(document, from_user, to_user_obj, permission_level='browse_document', adres_ip=None):
     """Share document with another user.
-    to_user_obj is an instance of User.
+    to_user_obj is an instance of User. The change is logged as from_user's activity.
     """
-    # Define all possible document permissions
-    all_doc_permissions = [
-        'browse_document', 'change_document', 'delete_document', 
-        'share_document', 'download_document', 'comment_document'
-    ]
-    
-    # Remove existing document-specific permissions for this document from the target user
-    for perm in all_doc_permissions:
-        if to_user_obj.has_perm(perm, document):
-            remove_perm(perm, to_user_obj, document)
-    
-    # Assign new permission
-    assign_perm(permission_level, to_user_obj, document)
-    
-    # Log the sharing activity
-    from documents.models import ActivityLog # Local import to avoid circularity
-    ActivityLog.objects.create(
-        uzytkownik=from_user,
-        typ_aktywnosci='udostepnianie',
-        dokument=document,
-        szczegoly=f"Udostępniono '{document.nazwa}' dla {to_user_obj.get_full_name()} z uprawnieniem {permission_level}",
-        # adres_ip='127.0.0.1'  # Get real IP in views
+    # Replace existing document-specific permissions of the target user with the new one
+    apply_object_permissions(
+        [document], [to_user_obj], grant=[permission_level],
+        revoke=[perm for perm in DOCUMENT_PERMISSIONS if perm != permission_level],
+        actor=from_user, adres_ip=adres_ip,
     )
 
 
 def remove_all_permissions_for_document_from_user(document, user_obj):
     """Remove all document permissions for a specific document from a user."""
-    all_doc_permissions = [
-        'browse_document', 'change_document', 'delete_document', 
-        'share_document', 'download_document', 'comment_document'
-    ]
-    for perm in all_doc_permissions:
-        if user_obj.has_perm(perm, document):
-            remove_perm(perm, user_obj, document)
+    bulk_revoke_permissions([document], [user_obj], DOCUMENT_PERMISSIONS)
 
 
 def get_user_document_permissions(user, document):
@@ -171,60 +253,269 @@ def get_user_document_permissions(user, document):
 
 def user_can_view_folder(user, folder):
     """Check if user can view specific folder."""
+    context = get_permission_context(user)
     if not user.is_authenticated:
         return False
 
-    if user.is_superuser or (hasattr(user, 'profile') and user.profile.is_admin):
+    if context.is_admin:
         return True
 
-    if folder.wlasciciel == user: # Owner can always view
+    if folder.wlasciciel_id == user.pk: # Owner can always view
         return True
 
-    return user.has_perm('browse_folder', folder)
+    return context.has_perm('browse_folder', folder)
 
 
 def user_can_create_folder(user):
     """Check if user can create new folders."""
+    context = get_permission_context(user)
     if not user.is_authenticated:
         return False
-    if user.is_superuser or (hasattr(user, 'profile') and (user.profile.is_admin or user.profile.is_editor)):
+    if context.is_admin or context.is_editor:
         return True
     return False
 
 
 def user_can_edit_folder(user, folder): # Renamed from user_can_manage_folder for clarity
     """Check if user can edit specific folder's metadata."""
+    context = get_permission_context(user)
     if not user.is_authenticated:
         return False
 
-    if user.is_superuser or (hasattr(user, 'profile') and user.profile.is_admin):
+    if context.is_admin:
         return True
 
-    if folder.wlasciciel == user and (hasattr(user, 'profile') and (user.profile.is_admin or user.profile.is_editor)):
+    if folder.wlasciciel_id == user.pk and context.is_editor:
         return True
         
-    if hasattr(user, 'profile') and user.profile.is_editor and user.has_perm('change_folder', folder): # Specific perm for editing folder
+    if context.is_editor and context.has_perm('change_folder', folder): # Specific perm for editing folder
         return True
         
     return False
 
 def user_can_delete_folder(user, folder):
     """Check if user can delete specific folder."""
+    context = get_permission_context(user)
     if not user.is_authenticated:
         return False
 
-    if user.is_superuser or (hasattr(user, 'profile') and user.profile.is_admin):
+    if context.is_admin:
         return True
 
-    if folder.wlasciciel == user and (hasattr(user, 'profile') and (user.profile.is_admin or user.profile.is_editor)):
+    if folder.wlasciciel_id == user.pk and context.is_editor:
         return True
 
-    # if hasattr(user, 'profile') and user.profile.is_editor and user.has_perm('delete_folder', folder):
+    # if context.is_editor and context.has_perm('delete_folder', folder):
     #     return True
         
     return False
 
-def admin_grant_document_access(admin_user, target_user, document, permissions=['browse_document']):
+# --- Bulk Permission Resolution ---
+# Listing pages check permissions for every row. Instead of calling the
+# user_can_* helpers per object (each may end in guardian's has_perm), the
+# resolvers below load all guardian rows for the whole page at once and apply
+# the same rules as the single-object helpers. The rows land in the
+# permission context, so later user_can_* calls for these objects are free.
+
+def _get_guardian_perms_map(user, objects):
+    """Return {obj.pk: {codename, ...}} with guardian object permissions for objects."""
+    context = get_permission_context(user)
+    context.prefetch(objects)
+    return {obj.pk: context.get_object_perms(obj) for obj in objects}
+
+
+def resolve_document_permissions(user, documents):
+    """
+    Resolve effective permissions of user for many documents at once.
+
+    Returns {document_id: {perm, ...}} where perm is one of 'browse_document',
+    'change_document', 'delete_document', 'comment_document', 'share_document'.
+    Same rules as user_can_view/edit/delete/comment/share_document.
+    """
+    documents = list(documents)
+    resolved = {document.pk: set() for document in documents}
+    if not user.is_authenticated or not documents:
+        return resolved
+
+    context = get_permission_context(user)
+    is_admin = context.is_admin
+    is_editor = context.is_editor
+    can_comment = context.profile_active
+
+    if is_admin:
+        perms = {'browse_document', 'change_document', 'delete_document', 'share_document'}
+        if can_comment:
+            perms.add('comment_document')
+        for document in documents:
+            resolved[document.pk] = set(perms)
+        return resolved
+
+    # Guardian is only consulted for documents the user does not own
+    shared = [document for document in documents if document.wlasciciel_id != user.pk]
+    guardian_perms = _get_guardian_perms_map(user, shared)
+
+    for document in documents:
+        perms = resolved[document.pk]
+        if document.wlasciciel_id == user.pk:
+            perms.add('browse_document')
+            if is_editor:
+                perms.update({'change_document', 'delete_document', 'share_document'})
+            if can_comment:
+                perms.add('comment_document')
+            continue
+
+        granted = guardian_perms[document.pk]
+        if 'browse_document' in granted:
+            perms.add('browse_document')
+            if can_comment and 'comment_document' in granted:
+                perms.add('comment_document')
+        if is_editor and 'change_document' in granted:
+            perms.add('change_document')
+        if is_editor and 'share_document' in granted:
+            perms.add('share_document')
+    return resolved
+
+
+def resolve_folder_permissions(user, folders):
+    """
+    Resolve effective permissions of user for many folders at once.
+
+    Returns {folder_id: {perm, ...}} where perm is one of 'browse_folder',
+    'change_folder', 'delete_folder'.
+    Same rules as user_can_view/edit/delete_folder.
+    """
+    folders = list(folders)
+    resolved = {folder.pk: set() for folder in folders}
+    if not user.is_authenticated or not folders:
+        return resolved
+
+    context = get_permission_context(user)
+    is_admin = context.is_admin
+    is_editor = context.is_editor
+
+    if is_admin:
+        for folder in folders:
+            resolved[folder.pk] = {'browse_folder', 'change_folder', 'delete_folder'}
+        return resolved
+
+    shared = [folder for folder in folders if folder.wlasciciel_id != user.pk]
+    guardian_perms = _get_guardian_perms_map(user, shared)
+
+    for folder in folders:
+        perms = resolved[folder.pk]
+        if folder.wlasciciel_id == user.pk:
+            perms.add('browse_folder')
+            if is_editor:
+                perms.update({'change_folder', 'delete_folder'})
+            continue
+
+        granted = guardian_perms[folder.pk]
+        if 'browse_folder' in granted:
+            perms.add('browse_folder')
+        if is_editor and 'change_folder' in granted:
+            perms.add('change_folder')
+    return resolved
+
+
+# --- Bulk Grant / Revoke ---
+# Granting to many users and objects with assign_perm / remove_perm costs a
+# few queries per (user, object, permission). apply_object_permissions()
+# reads the existing guardian rows once, inserts only the missing ones with
+# bulk_create and removes revoked ones with a single delete, in one
+# transaction, and logs one summarized ActivityLog entry per call.
+
+DOCUMENT_PERMISSIONS = [
+    'browse_document', 'change_document', 'delete_document',
+    'share_document', 'download_document', 'comment_document'
+]
+
+
+def apply_object_permissions(objects, users, grant=(), revoke=(), actor=None, adres_ip=None):
+    """
+    Grant and revoke guardian permissions of users on objects (all of one model).
+
+    grant / revoke are codenames ('browse_document' or 'documents.browse_document').
+    Only user permissions are changed; permissions received through groups stay.
+    Returns (granted, revoked) - numbers of permission rows created and deleted.
+    """
+    from django.contrib.auth.models import Permission
+    from django.contrib.contenttypes.models import ContentType
+    from django.db import transaction
+    from guardian.utils import get_user_obj_perms_model
+    from documents import access
+    from documents.activity import log_activity
+
+    objects = list(objects)
+    users = list(users)
+    user_ids = [getattr(user, 'pk', user) for user in users]
+    grant = {perm.split('.', 1)[-1] for perm in grant}
+    revoke = {perm.split('.', 1)[-1] for perm in revoke} - grant
+    if not objects or not user_ids or not (grant or revoke):
+        return 0, 0
+
+    ctype = ContentType.objects.get_for_model(objects[0])
+    permissions = dict(Permission.objects.filter(content_type=ctype, codename__in=grant | revoke).values_list('codename', 'pk'))
+    unknown = (grant | revoke) - set(permissions)
+    if unknown:
+        raise ValueError(f"Nieznane uprawnienia: {', '.join(sorted(unknown))}")
+
+    UserObjectPermission = get_user_obj_perms_model()
+    object_pks = [str(obj.pk) for obj in objects]
+    rows = UserObjectPermission.objects.filter(content_type=ctype, object_pk__in=object_pks, user_id__in=user_ids)
+
+    with transaction.atomic(), access.batch_sync():
+        granted = revoked = 0
+        if grant:
+            existing = set(rows.filter(permission_id__in=[permissions[perm] for perm in grant]).values_list('user_id', 'object_pk', 'permission_id'))
+            missing = [
+                UserObjectPermission(user_id=user_id, content_type=ctype, object_pk=object_pk, permission_id=permissions[perm])
+                for user_id in user_ids for object_pk in object_pks for perm in sorted(grant)
+                if (user_id, object_pk, permissions[perm]) not in existing
+            ]
+            UserObjectPermission.objects.bulk_create(missing, batch_size=500)
+            granted = len(missing)
+            # bulk_create sends no signals - sync the access table for the whole batch
+            model = access.tracked_model(ctype.pk)
+            if model is not None and missing:
+                access.request_sync(model, [int(pk) for pk in object_pks])
+        if revoke:
+            revoked, _ = rows.filter(permission_id__in=[permissions[perm] for perm in revoke]).delete()
+    if granted or revoked:
+        invalidate_permission_contexts() # bulk_create sends no signals
+
+    if actor is not None and (granted or revoked):
+        changes = []
+        if granted:
+            changes.append(f"nadano {', '.join(sorted(grant))} ({granted})")
+        if revoked:
+            changes.append(f"odebrano {', '.join(sorted(revoke))} ({revoked})")
+        single = objects[0] if len(objects) == 1 else None
+        if len(users) == 1 and isinstance(users[0], User):
+            target = f"użytkownika {users[0].get_full_name() or users[0].username}"
+        else:
+            target = f"{len(user_ids)} użytkowników"
+        log_activity(
+            uzytkownik=actor,
+            typ_aktywnosci='udostepnianie' if granted and not revoked else 'zmiana_uprawnien',
+            dokument=single if ctype.model == 'document' else None,
+            folder=single if ctype.model == 'folder' else None,
+            szczegoly=f"Uprawnienia {target} do {len(objects)} obiektów ({ctype.model}): {'; '.join(changes)}",
+            adres_ip=adres_ip,
+        )
+    return granted, revoked
+
+
+def bulk_grant_permissions(objects, users, permissions, actor=None, adres_ip=None):
+    """Grant permissions of users on objects, skipping ones they already have. Returns rows created."""
+    return apply_object_permissions(objects, users, grant=permissions, actor=actor, adres_ip=adres_ip)[0]
+
+
+def bulk_revoke_permissions(objects, users, permissions, actor=None, adres_ip=None):
+    """Revoke user permissions on objects. Returns rows deleted."""
+    return apply_object_permissions(objects, users, revoke=permissions, actor=actor, adres_ip=adres_ip)[1]
+
+
+def admin_grant_document_access(admin_user, target_user, document, permissions=['browse_document'], adres_ip=None):
     """
     Funkcja dla administratora do nadawania uprawnień do dokumentu.
     
@@ -233,6 +524,7 @@ def admin_grant_document_access(admin_user, target_user, document, permissions=[
         target_user: Użytkownik otrzymujący uprawnienia  
         document: Dokument do którego nadawane są uprawnienia
         permissions: Lista uprawnień do nadania (domyślnie tylko przeglądanie)
+        adres_ip: Adres IP żądania, zapisywany w dzienniku aktywności
     
     Available permissions:
         - 'browse_document': Przeglądanie dokumentu
@@ -246,26 +538,13 @@ def admin_grant_document_access(admin_user, target_user, document, permissions=[
     if not (admin_user.is_superuser or (hasattr(admin_user, 'profile') and admin_user.profile.is_admin)):
         raise PermissionError("Tylko administrator może nadawać uprawnienia do dokumentów.")
     
-    # Nadaj uprawnienia
-    from guardian.shortcuts import assign_perm
-    from documents.models import ActivityLog
-    
-    for permission in permissions:
-        assign_perm(permission, target_user, document)
-    
-    # Zaloguj aktywność
-    ActivityLog.objects.create(
-        uzytkownik=admin_user,
-        typ_aktywnosci='udostepnianie',
-        dokument=document,
-        szczegoly=f"Nadano uprawnienia {', '.join(permissions)} użytkownikowi {target_user.get_full_name()} do dokumentu {document.nazwa}",
-        adres_ip='127.0.0.1'  # W rzeczywistej aplikacji pobierz prawdziwy IP
-    )
+    # Nadaj uprawnienia (i zaloguj jedną aktywność, jeśli coś się zmieniło)
+    bulk_grant_permissions([document], [target_user], permissions, actor=admin_user, adres_ip=adres_ip)
     
     return True
 
 
-def admin_revoke_document_access(admin_user, target_user, document, permissions=None):
+def admin_revoke_document_access(admin_user, target_user, document, permissions=None, adres_ip=None):
     """
     Funkcja dla administratora do odbierania uprawnień do dokumentu.
     
@@ -274,33 +553,17 @@ def admin_revoke_document_access(admin_user, target_user, document, permissions=
         target_user: Użytkownik tracący uprawnienia
         document: Dokument z którego odbierane są uprawnienia  
         permissions: Lista uprawnień do odebrania (None = wszystkie)
+        adres_ip: Adres IP żądania, zapisywany w dzienniku aktywności
     """
     # Sprawdź czy użytkownik ma uprawnienia administratora
     if not (admin_user.is_superuser or (hasattr(admin_user, 'profile') and admin_user.profile.is_admin)):
         raise PermissionError("Tylko administrator może odbierać uprawnienia do dokumentów.")
     
-    from guardian.shortcuts import remove_perm
-    from documents.models import ActivityLog
-    
     # Jeśli nie podano listy uprawnień, usuń wszystkie
     if permissions is None:
-        permissions = [
-            'browse_document', 'download_document', 'comment_document',
-            'change_document', 'delete_document', 'share_document'
-        ]
+        permissions = DOCUMENT_PERMISSIONS
     
-    # Usuń uprawnienia
-    for permission in permissions:
-        if target_user.has_perm(permission, document):
-            remove_perm(permission, target_user, document)
-    
-    # Zaloguj aktywność
-    ActivityLog.objects.create(
-        uzytkownik=admin_user,
-        typ_aktywnosci='zmiana_uprawnien',
-        dokument=document,
-        szczegoly=f"Odebrano uprawnienia {', '.join(permissions)} użytkownikowi {target_user.get_full_name()} do dokumentu {document.nazwa}",
-        adres_ip='127.0.0.1'
-    )
+    # Usuń uprawnienia (i zaloguj jedną aktywność, jeśli coś się zmieniło)
+    bulk_revoke_permissions([document], [target_user], permissions, actor=admin_user, adres_ip=adres_ip)
     
     return True
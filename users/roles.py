@@ -0,0 +1,103 @@
+"""
+Cached role of each user.
+
+Permission checks only need the role code and the active flag of a user's
+profile. get_role_info() takes them from the profile when it is already
+loaded (request.user is loaded with profile and role by
+users.backends.ProfileModelBackend), otherwise from the Django cache, and
+only queries the database on a cache miss.
+
+Cache keys include a version stamp stored in the database (RoleVersion).
+invalidate_role() bumps it whenever the role or active flag of a profile
+changes, a profile is deleted or a role is changed - see users.signals (role
+changes in the admin, including CustomUserAdmin._update_profile_role, go
+through profile.save()). Each process compares its stamp with the database at
+most once every ROLE_VERSION_CHECK_INTERVAL seconds, so with the default
+per-process local-memory cache other workers stop using stale entries within
+that interval; the process making the change sees it at once.
+"""
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+RoleInfo = namedtuple('RoleInfo', ['rola', 'aktywny'])
+
+NO_ROLE = RoleInfo(None, True) # Users without a profile
+
+
+class VersionStamp:
+    """RoleVersion as last read by this process."""
+
+    def __init__(self):
+        self._version = None
+        self._checked_at = 0.0
+
+    def get(self):
+        now = time.monotonic()
+        if self._version is None or now - self._checked_at >= getattr(settings, 'ROLE_VERSION_CHECK_INTERVAL', 5):
+            from .models import RoleVersion
+            self._version = RoleVersion.objects.filter(pk=1).values_list('wersja', flat=True).first() or 0
+            self._checked_at = now
+        return self._version
+
+    def reset(self):
+        self._version = None
+
+
+_stamp = VersionStamp()
+
+
+def _cache_key(user_id, version):
+    return f'users:role:{version}:{user_id}'
+
+
+def get_role_info(user):
+    """RoleInfo(role code or None, profile active) of user."""
+    from django.contrib.auth.models import User
+    from .models import UserProfile
+
+    if not user.is_authenticated:
+        return NO_ROLE
+
+    profile_cache = User.profile.related
+    if profile_cache.is_cached(user):
+        profile = profile_cache.get_cached_value(user)
+        if profile is None:
+            return NO_ROLE
+        if profile.rola_id is None:
+            return RoleInfo(None, profile.aktywny)
+        if UserProfile.rola.is_cached(profile):
+            return RoleInfo(profile.rola.nazwa, profile.aktywny)
+
+    key = _cache_key(user.pk, _stamp.get())
+    cached = cache.get(key)
+    if cached is not None:
+        return RoleInfo(*cached)
+    row = UserProfile.objects.filter(user_id=user.pk).values_list('rola__nazwa', 'aktywny').first()
+    info = RoleInfo(*row) if row else NO_ROLE
+    cache.set(key, tuple(info), getattr(settings, 'ROLE_CACHE_TIMEOUT', 300))
+    return info
+
+
+def bump_version():
+    """Make every process drop its cached roles."""
+    from .models import RoleVersion
+
+    if not RoleVersion.objects.filter(pk=1).update(wersja=F('wersja') + 1):
+        try:
+            with transaction.atomic():
+                RoleVersion.objects.create(pk=1, wersja=1)
+        except IntegrityError: # Created concurrently
+            RoleVersion.objects.filter(pk=1).update(wersja=F('wersja') + 1)
+    _stamp.reset()
+
+
+def invalidate_role(*user_ids):
+    """Roles of user_ids changed - drop cached roles everywhere."""
+    bump_version()
+    # Entries under the new stamp can only be left over from a stamp reused after a rollback
+    cache.delete_many([_cache_key(user_id, _stamp.get()) for user_id in user_ids])
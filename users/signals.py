@@ -1,6 +1,12 @@
-from django.db.models.signals import post_migrate
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_migrate, post_save, post_delete
 from django.dispatch import receiver
 from django.apps import apps
+from guardian.models import GroupObjectPermission, UserObjectPermission
+
+from .models import Role, UserProfile
+from .permissions import invalidate_permission_contexts
+from .roles import invalidate_role
 
 
 @receiver(post_migrate)
@@ -51,3 +57,34 @@ def create_default_roles(sender, **kwargs):
         print(f"✅ Created {created_count} default roles successfully!")
     else:
         print("ℹ All default roles already exist.")
+
+
+@receiver(post_save, sender=UserProfile)
+def invalidate_profile_role(sender, instance, **kwargs):
+    """Drop the cached role when the role or active flag of a profile changes."""
+    # Every user save (e.g. last_login on each login) saves the profile too
+    if instance.role_changed():
+        invalidate_role(instance.user_id)
+        instance.remember_role()
+
+
+@receiver(post_delete, sender=UserProfile)
+def invalidate_deleted_profile_role(sender, instance, **kwargs):
+    invalidate_role(instance.user_id)
+
+
+@receiver(post_save, sender=Role)
+def invalidate_users_role(sender, instance, created, **kwargs):
+    """A changed role code applies to every user having the role."""
+    if not created:
+        invalidate_role(*UserProfile.objects.filter(rola=instance).values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=UserObjectPermission)
+@receiver(post_save, sender=GroupObjectPermission)
+@receiver(post_delete, sender=UserObjectPermission)
+@receiver(post_delete, sender=GroupObjectPermission)
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_object_permissions(sender, **kwargs):
+    """Checks later in the same request see grants, revocations and group changes."""
+    invalidate_permission_contexts()
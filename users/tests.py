@@ -1,3 +1,225 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.db.models import F
+from guardian.shortcuts import assign_perm
 
-# Create your tests here.
+from documents.models import ActivityLog, Document, Folder
+
+from . import roles
+from .models import Role, RoleVersion, UserProfile
+from .permissions import (
+    DOCUMENT_PERMISSIONS, admin_grant_document_access, admin_revoke_document_access, apply_object_permissions,
+    attach_permission_context, bulk_grant_permissions, bulk_revoke_permissions, resolve_document_permissions,
+    share_document_with_user, resolve_folder_permissions, user_can_delete_document, user_can_edit_document,
+    user_can_view_document,
+)
+
+
+def make_user(username, role=Role.READER):
+    user = User.objects.create_user(username, f'{username}@example.com', 'haslo')
+    user.profile.rola, _ = Role.objects.get_or_create(nazwa=role)
+    user.profile.save()
+    return User.objects.get(pk=user.pk)
+
+
+class BulkPermissionResolverTests(TestCase):
+    """resolve_*_permissions apply the rules of the user_can_* helpers in a fixed number of queries."""
+
+    def setUp(self):
+        self.owner = make_user('wlasciciel', Role.EDITOR)
+        self.reader = make_user('czytelnik')
+        self.editor = make_user('edytor', Role.EDITOR)
+        self.documents = [Document.objects.create(nazwa=f'Dokument {i}', wlasciciel=self.owner) for i in range(12)]
+
+    def test_same_rules_as_single_checks(self):
+        shared = self.documents[0]
+        for user in (self.reader, self.editor):
+            assign_perm('browse_document', user, shared)
+            assign_perm('change_document', user, shared)
+            assign_perm('comment_document', user, shared)
+        own = Document.objects.create(nazwa='Własny', wlasciciel=self.reader)
+
+        for user in (self.owner, self.reader, self.editor):
+            resolved = resolve_document_permissions(user, self.documents + [own])
+            for document in self.documents + [own]:
+                perms = resolved[document.pk]
+                fresh_user = User.objects.get(pk=user.pk)
+                self.assertEqual('browse_document' in perms, user_can_view_document(fresh_user, document))
+                self.assertEqual('change_document' in perms, user_can_edit_document(fresh_user, document))
+                self.assertEqual('delete_document' in perms, user_can_delete_document(fresh_user, document))
+
+        self.assertEqual(resolve_document_permissions(self.reader, [shared])[shared.pk], {'browse_document', 'comment_document'})
+        self.assertEqual(
+            resolve_document_permissions(self.editor, [shared])[shared.pk], {'browse_document', 'comment_document', 'change_document'},
+        )
+        self.assertEqual(resolve_document_permissions(self.reader, [own])[own.pk], {'browse_document', 'comment_document'})
+
+    def test_admin_gets_everything(self):
+        admin = make_user('admin', Role.ADMIN)
+        resolved = resolve_document_permissions(admin, self.documents[:1])
+        self.assertEqual(
+            resolved[self.documents[0].pk],
+            {'browse_document', 'change_document', 'delete_document', 'share_document', 'comment_document'},
+        )
+
+    def test_queries_do_not_grow_with_the_page(self):
+        for document in self.documents:
+            assign_perm('browse_document', self.reader, document)
+
+        def count_queries(documents):
+            user = User.objects.get(pk=self.reader.pk)
+            with CaptureQueriesContext(connection) as queries:
+                resolve_document_permissions(user, documents)
+            return len(queries)
+
+        count_queries(self.documents[:1]) # Role now cached (users.roles)
+        self.assertEqual(count_queries(self.documents[:2]), count_queries(self.documents))
+
+    def test_folders(self):
+        folders = [Folder.objects.create(nazwa=f'Folder {i}', wlasciciel=self.owner) for i in range(5)]
+        assign_perm('browse_folder', self.reader, folders[0])
+        assign_perm('change_folder', self.reader, folders[0])
+        resolved = resolve_folder_permissions(self.reader, folders)
+        self.assertEqual(resolved[folders[0].pk], {'browse_folder'}) # Readers never change what is shared with them
+        self.assertEqual(resolved[folders[1].pk], set())
+        self.assertEqual(resolve_folder_permissions(self.owner, folders[:1])[folders[0].pk], {'browse_folder', 'change_folder', 'delete_folder'})
+
+
+class PermissionContextTests(TestCase):
+    """A context attached for a request loads each object's permissions once and sees later changes."""
+
+    def setUp(self):
+        owner = make_user('wlasciciel', Role.EDITOR)
+        self.reader = make_user('czytelnik')
+        self.documents = [Document.objects.create(nazwa=f'Dokument {i}', wlasciciel=owner) for i in range(5)]
+        for document in self.documents[:3]:
+            assign_perm('browse_document', self.reader, document)
+        self.user = attach_permission_context(User.objects.get(pk=self.reader.pk))
+
+    def test_repeated_checks_cost_no_queries(self):
+        resolve_document_permissions(self.user, self.documents)
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                visible = [user_can_view_document(self.user, document) for document in self.documents]
+        self.assertEqual(visible, [True, True, True, False, False])
+
+    def test_single_check_is_remembered(self):
+        user_can_view_document(self.user, self.documents[0])
+        with self.assertNumQueries(0):
+            self.assertTrue(user_can_view_document(self.user, self.documents[0]))
+            resolve_document_permissions(self.user, self.documents[:1])
+
+    def test_grant_and_revoke_seen_in_same_request(self):
+        resolve_document_permissions(self.user, self.documents)
+        self.assertFalse(user_can_view_document(self.user, self.documents[4]))
+
+        apply_object_permissions([self.documents[4]], [self.reader], grant=['browse_document'], revoke=['change_document'])
+        self.assertTrue(user_can_view_document(self.user, self.documents[4]))
+
+        apply_object_permissions(self.documents[:1], [self.reader], revoke=['browse_document'])
+        self.assertFalse(user_can_view_document(self.user, self.documents[0]))
+
+    def test_single_assign_seen_in_same_request(self):
+        self.assertFalse(user_can_view_document(self.user, self.documents[3]))
+        assign_perm('browse_document', self.reader, self.documents[3])
+        self.assertTrue(user_can_view_document(self.user, self.documents[3]))
+
+
+class RoleCacheTests(TestCase):
+    """Cached roles follow role changes, in this process at once and in others after the version check."""
+
+    def setUp(self):
+        self.user = make_user('czytelnik')
+        roles._stamp.reset()
+        self.addCleanup(roles._stamp.reset)
+
+    def role(self):
+        return roles.get_role_info(User.objects.get(pk=self.user.pk)).rola
+
+    def test_role_change_takes_effect(self):
+        self.assertEqual(self.role(), Role.READER)
+        profile = UserProfile.objects.get(user=self.user)
+        profile.rola = Role.objects.get_or_create(nazwa=Role.EDITOR)[0]
+        profile.save()
+        self.assertEqual(self.role(), Role.EDITOR)
+        profile.aktywny = False
+        profile.save()
+        self.assertFalse(roles.get_role_info(User.objects.get(pk=self.user.pk)).aktywny)
+
+    def test_saves_without_role_change_keep_the_cache(self):
+        self.role()
+        version = RoleVersion.objects.values_list('wersja', flat=True).first()
+        user = User.objects.get(pk=self.user.pk)
+        user.first_name = 'Jan'
+        user.save() # Saves the profile as well
+        self.assertEqual(RoleVersion.objects.values_list('wersja', flat=True).first(), version)
+
+    def test_other_processes_see_the_version_bump(self):
+        with self.settings(ROLE_VERSION_CHECK_INTERVAL=3600):
+            self.assertEqual(self.role(), Role.READER)
+            # Another process changes the role: no signals here, only its bump reaches the database
+            UserProfile.objects.filter(user=self.user).update(rola=Role.objects.get_or_create(nazwa=Role.EDITOR)[0])
+            RoleVersion.objects.update(wersja=F('wersja') + 1)
+            with self.assertNumQueries(1):
+                self.assertEqual(self.role(), Role.READER) # Until the next check
+        with self.settings(ROLE_VERSION_CHECK_INTERVAL=0):
+            self.assertEqual(self.role(), Role.EDITOR)
+
+
+@override_settings(ACTIVITY_LOG_SYNC=True)
+class BulkPermissionChangeTests(TestCase):
+    """Grants and revocations only touch missing / present rows and log one entry for the actor."""
+
+    def setUp(self):
+        self.admin = make_user('admin', Role.ADMIN)
+        self.readers = [make_user(f'czytelnik{i}') for i in range(3)]
+        self.documents = [Document.objects.create(nazwa=f'Dokument {i}', wlasciciel=self.admin) for i in range(4)]
+
+    def test_grant_and_revoke_count_changed_rows(self):
+        assign_perm('browse_document', self.readers[0], self.documents[0])
+        granted = bulk_grant_permissions(
+            self.documents, self.readers, ['browse_document', 'documents.comment_document'], actor=self.admin, adres_ip='10.0.0.5',
+        )
+        self.assertEqual(granted, 4 * 3 * 2 - 1)
+        self.assertEqual(bulk_grant_permissions(self.documents, self.readers, ['browse_document'], actor=self.admin), 0)
+
+        self.assertEqual(bulk_revoke_permissions(self.documents[:2], self.readers[:1], ['comment_document', 'share_document'], actor=self.admin), 2)
+        self.assertEqual(apply_object_permissions(
+            self.documents[:1], self.readers, grant=['change_document'], revoke=['browse_document'], actor=self.admin,
+        ), (3, 3))
+
+        entries = ActivityLog.objects.filter(uzytkownik=self.admin).order_by('pk')
+        self.assertEqual([entry.typ_aktywnosci for entry in entries], ['udostepnianie', 'zmiana_uprawnien', 'zmiana_uprawnien'])
+        self.assertEqual(entries[0].adres_ip, '10.0.0.5')
+        self.assertIn('(23)', entries[0].szczegoly)
+        self.assertEqual(entries[2].dokument, self.documents[0])
+
+    def test_unknown_permission(self):
+        with self.assertRaises(ValueError):
+            bulk_grant_permissions(self.documents, self.readers, ['fly_document'])
+
+    def test_admin_helpers_log_once_with_address(self):
+        reader = self.readers[0]
+        admin_grant_document_access(self.admin, reader, self.documents[0], ['browse_document', 'download_document'], adres_ip='10.0.0.7')
+        admin_grant_document_access(self.admin, reader, self.documents[0], ['browse_document'], adres_ip='10.0.0.7') # No change
+        admin_revoke_document_access(self.admin, reader, self.documents[0], adres_ip='10.0.0.8')
+        entries = list(ActivityLog.objects.filter(dokument=self.documents[0]).order_by('pk'))
+        self.assertEqual([(entry.typ_aktywnosci, entry.adres_ip) for entry in entries], [
+            ('udostepnianie', '10.0.0.7'), ('zmiana_uprawnien', '10.0.0.8'),
+        ])
+        self.assertFalse(reader.has_perm('documents.browse_document', self.documents[0]))
+        with self.assertRaises(PermissionError):
+            admin_grant_document_access(reader, self.readers[1], self.documents[0])
+
+    def test_share_replaces_permissions(self):
+        reader = self.readers[0]
+        assign_perm('change_document', reader, self.documents[0])
+        share_document_with_user(self.documents[0], self.admin, reader, 'browse_document', adres_ip='10.0.0.9')
+        fresh = User.objects.get(pk=reader.pk)
+        self.assertEqual(
+            {perm for perm in DOCUMENT_PERMISSIONS if fresh.has_perm(f'documents.{perm}', self.documents[0])}, {'browse_document'},
+        )
+        entry = ActivityLog.objects.get(dokument=self.documents[0])
+        self.assertEqual((entry.uzytkownik, entry.adres_ip), (self.admin, '10.0.0.9'))